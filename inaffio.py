@@ -1,56 +1,249 @@
+import time
+
+# process start, the startup steps are timed from here
+STARTED = time.perf_counter()
+
+import argparse
+import json
+import logging
+import os
 import queue
 import signal
+import subprocess
+import sys
 import threading
 
-from tasks.sensor_task import SensorTask
-from tasks.db_task import DBTask
-from tasks.bot_task import BotTask
-from tasks.pump_task import PumpTask
+# the tasks are imported in main(), sampling starts before the bot and its
+# Telegram client are loaded
+from alarm_utils.alarm_store import AlarmStore
+from metrics_utils.metrics_registry import REGISTRY
+from metrics_utils.metrics_server import MetricsServer
+from task_utils.task_runtime import TaskRuntime
 
-from RPi import GPIO
+CONFIG_FILE = "configs.json"
+TASK_MODULES = ["tasks.sensor_task", "tasks.db_task", "tasks.pump_task", "tasks.bot_task"]
 
 db_queue = queue.Queue()
-alarm_queue = queue.Queue(maxsize=1)
-pump_queue = queue.Queue(maxsize=1)
+# alarms raised by the rules of SensorTask, notified by the bot
+alarm_store = AlarmStore()
+# watering requests, PumpTask queues them as jobs
+pump_queue = queue.Queue()
+
+QUEUE_DEPTH = REGISTRY.gauge("inaffio_queue_depth", "Messages waiting in the task queues")
+QUEUE_DEPTH.set_function(db_queue.qsize, queue="db_queue")
+QUEUE_DEPTH.set_function(pump_queue.qsize, queue="pump_queue")
+
+ALARMS_ACTIVE = REGISTRY.gauge("inaffio_alarms_active", "Alarms raised and not resolved")
+ALARMS_ACTIVE.set_function(alarm_store.__len__)
+
+
+def _load_configs():
+    if not os.path.exists(CONFIG_FILE):
+        return {}
+
+    with open(CONFIG_FILE, "r") as f:
+        return json.load(f)
+
+
+def _start_metrics(configs):
+    # Prometheus endpoint, only when the metrics section is configured
+    metrics = dict(configs.get("metrics", {"enabled": False}))
+    if not metrics.pop("enabled", True):
+        return None
+
+    server = MetricsServer(**metrics)
+    server.start()
+    return server
+
+
+_startup_steps = []
+
+
+def _mark(step):
+    elapsed = time.perf_counter() - STARTED
+    _startup_steps.append({"step": step, "seconds": round(elapsed, 4)})
+    logging.info(f"[INAFFIO]: {step} after {elapsed:.3f} seconds")
+
+
+def _profile_imports(top=15):
+    # self time of every module the tasks import, from python -X importtime
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + ", ".join(TASK_MODULES)],
+        capture_output=True,
+        text=True,
+    )
+
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = [field.strip() for field in line[len("import time:") :].split("|")]
+        if len(fields) != 3 or not fields[0].isdigit():
+            continue
+        modules.append(
+            {
+                "module": fields[2],
+                "self_ms": int(fields[0]) / 1000,
+                "cumulative_ms": int(fields[1]) / 1000,
+            }
+        )
+
+    return {
+        "tasks": [m for m in modules if m["module"] in TASK_MODULES],
+        "slowest": sorted(modules, key=lambda m: m["self_ms"], reverse=True)[:top],
+    }
+
+
+def _load_simulation(args):
+    # simulated sensors, pump and Telegram API driven by an accelerated clock
+    from sim_utils.fake_telegram import FakeTelegram
+    from sim_utils.sim_hardware import SimHardware
+    from task_utils.task_clock import AcceleratedClock
+
+    configs = _load_configs()
+    simulation = configs.get("simulation", {})
+    speed = args.speed or simulation.get("speed", 3600)
+    days = args.days or simulation.get("days")
+
+    clock = AcceleratedClock(speed)
+    hardware = SimHardware(
+        clock,
+        configs.get("sensor_task", {}).get("sensors", [{"zone": "default"}]),
+        simulation,
+    )
+
+    fake = FakeTelegram()
+    fake.start()
+
+    logging.info(
+        f"[SIMULATION]: speed {speed}x, {days if days is not None else 'unlimited'} days, zones {list(hardware.soils.keys())}"
+    )
+    return clock, hardware, fake, days
 
 
 def main():
-    GPIO.setmode(GPIO.BOARD)
+    parser = argparse.ArgumentParser(description="Inaffio plant monitoring")
+    parser.add_argument(
+        "--simulate",
+        action="store_true",
+        help="run on simulated hardware and a local fake Telegram API",
+    )
+    parser.add_argument("--speed", type=float, help="simulated seconds per second")
+    parser.add_argument("--days", type=float, help="stop after this many simulated days")
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="start the tasks, report the startup and import times, then exit",
+    )
+    args = parser.parse_args()
+
+    if args.simulate:
+        clock, hardware, fake, days = _load_simulation(args)
+        gpio = hardware.gpio
+    else:
+        from RPi import GPIO as gpio
+
+        clock, hardware, fake, days = None, None, None, None
+
+    gpio.setmode(gpio.BOARD)
+
+    # tasks block on their inputs and share the runtime stop event,
+    # crashed tasks are restarted by the runtime
+    runtime = TaskRuntime()
 
     def hadle_sigterm(signum, frame):
-        GPIO.cleanup()
-        exit(0)
+        runtime.shutdown()
 
     signal.signal(signal.SIGTERM, hadle_sigterm)
 
+    metrics_server = _start_metrics(_load_configs())
+
     try:
+        # sampling and storage first, they only need light imports
+        from tasks.db_task import DBTask
+        from tasks.pump_task import PumpTask
+        from tasks.sensor_task import SensorTask
+
         db_task = DBTask(db_queue)
-        sensor_task = SensorTask(alarm_queue, db_queue)
-        bot_task = BotTask(alarm_queue, pump_queue)
-        pump_task = PumpTask(pump_queue, alarm_queue)
-
-        # start tasks in separate threads
-        db_task_thread = threading.Thread(target=db_task.run)
-        sensor_task_thread = threading.Thread(target=sensor_task.run)
-        bot_task_thread = threading.Thread(target=bot_task.run)
-        pump_task_thread = threading.Thread(target=pump_task.run)
-
-        db_task_thread.start()
-        sensor_task_thread.start()
-        bot_task_thread.start()
-        pump_task_thread.start()
-
-        # wait for threads to finish
-        db_task_thread.join()
-        sensor_task_thread.join()
-        bot_task_thread.join()
-        pump_task_thread.join()
+        if args.simulate:
+            sensor_task = SensorTask(
+                alarm_store, db_queue, clock=clock, bus_factory=hardware.smbus
+            )
+            pump_task = PumpTask(pump_queue, alarm_store, clock=clock, gpio=gpio)
+        else:
+            sensor_task = SensorTask(alarm_store, db_queue)
+            pump_task = PumpTask(pump_queue, alarm_store)
+
+        runtime.add("db_task", db_task)
+        runtime.add("sensor_task", sensor_task)
+        runtime.add("pump_task", pump_task)
+
+        # optional uplink of the committed telemetry to a fleet collector
+        forwarder_configs = _load_configs().get("forwarder_task")
+        if forwarder_configs is not None and "url" not in forwarder_configs:
+            logging.error("[INAFFIO]: forwarder_task.url missing, telemetry not forwarded")
+        elif forwarder_configs is not None:
+            from tasks.forwarder_task import ForwarderTask
+
+            forwarder_task = ForwarderTask()
+            db_task.subscribe(forwarder_task.on_telemetry)
+            runtime.add("forwarder_task", forwarder_task)
+
+        if days is not None:
+            timer = threading.Timer(days * 86400 / clock.speed, runtime.shutdown)
+            timer.daemon = True
+            timer.start()
+
+        runtime.start()
+        _mark("sampling started")
+
+        # the Telegram client is the slowest import, alarms raised meanwhile
+        # wait in alarm_store
+        import telebot
+        from tasks.bot_task import BotTask
+
+        if args.simulate:
+            telebot.apihelper.API_URL = fake.api_url
+            bot_task = BotTask(alarm_store, pump_queue, clock=clock, token="1:simulated")
+        else:
+            bot_task = BotTask(alarm_store, pump_queue)
+
+        # let the bot pre-render charts as soon as new samples are stored
+        db_task.subscribe(bot_task.on_telemetry)
+        bot_task.pump_jobs = pump_task.jobs
+        bot_task.pump_max_duration = lambda: pump_task.max_duration_seconds
+        runtime.add("bot_task", bot_task)
+        _mark("bot started")
+
+        if args.profile_startup:
+            runtime.shutdown()
+
+        # supervise the tasks until shutdown
+        runtime.join()
     except KeyboardInterrupt:
-        GPIO.cleanup()
-    except Exception as e:
-        GPIO.cleanup()
+        runtime.shutdown()
+        runtime.join()
+    finally:
+        gpio.cleanup()
+
+        if fake is not None:
+            fake.stop()
+
+        if metrics_server is not None:
+            metrics_server.stop()
+
+    if args.profile_startup:
+        print(
+            json.dumps(
+                {"startup": _startup_steps, "imports": _profile_imports()}, indent=2
+            )
+        )
 
+    if args.simulate:
+        logging.info(
+            f"[SIMULATION]: stored {db_task.counters['records']} samples, {hardware.gpio.waterings} waterings, {len(fake.calls_of('sendMessage'))} messages sent"
+        )
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
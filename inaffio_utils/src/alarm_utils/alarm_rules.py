@@ -0,0 +1,268 @@
+import collections
+import logging
+import threading
+
+logging.basicConfig(level=logging.INFO)
+
+
+class RollingWindow:
+    """Samples of the last seconds with their running sum.
+
+    Adding a sample evicts the expired ones, so the mean and the oldest
+    value cost O(1) amortized whatever the window length.
+    """
+
+    __slots__ = ("seconds", "samples", "total")
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.samples = collections.deque()
+        self.total = 0.0
+
+    def add(self, ts, value):
+        self.samples.append((ts, value))
+        self.total += value
+
+        while self.samples[0][0] < ts - self.seconds:
+            self.total -= self.samples.popleft()[1]
+
+    def mean(self):
+        return self.total / len(self.samples)
+
+    def oldest(self):
+        return self.samples[0]
+
+
+class RuleState:
+    # what a rule remembers of one zone
+    __slots__ = ("active", "window", "last_time")
+
+    def __init__(self, window_seconds=None):
+        self.active = False
+        self.window = RollingWindow(window_seconds) if window_seconds else None
+        self.last_time = None
+
+
+class Rule:
+    """Base of the alarm rules.
+
+    update() is called with every record of a zone and check() periodically,
+    both return True (triggered), False (clear) or None (no opinion yet).
+    """
+
+    def __init__(self, name, title=None):
+        self.name = name
+        self.title = title or name
+
+    def new_state(self):
+        return RuleState()
+
+    def update(self, state, record):
+        return None
+
+    def check(self, state, now):
+        return None
+
+    def value(self, state, record):
+        return None
+
+
+class ThresholdRule(Rule):
+    """A measure (or its mean over window_seconds) below or above a limit.
+
+    The alarm only resolves once the value is back past the limit by
+    hysteresis, so a value hovering on the limit does not flap.
+    """
+
+    def __init__(
+        self,
+        name,
+        measure,
+        below=None,
+        above=None,
+        hysteresis=0,
+        aggregate="last",
+        window_seconds=0,
+        title=None,
+    ):
+        if below is None and above is None:
+            raise ValueError(f"threshold rule {name} needs below or above")
+        if aggregate not in ("last", "mean"):
+            raise ValueError(f"unknown aggregate {aggregate}")
+
+        super().__init__(name, title)
+        self.measure = measure
+        self.below = below
+        self.above = above
+        self.hysteresis = hysteresis
+        self.aggregate = aggregate
+        self.window_seconds = window_seconds if aggregate == "mean" else 0
+
+    def new_state(self):
+        return RuleState(self.window_seconds)
+
+    def value(self, state, record):
+        if state.window is not None:
+            return state.window.mean()
+        return getattr(record, self.measure)
+
+    def update(self, state, record):
+        if state.window is not None:
+            state.window.add(record.time, getattr(record, self.measure))
+        value = self.value(state, record)
+
+        margin = self.hysteresis if state.active else 0
+        if self.below is not None and value <= self.below + margin:
+            return True
+        if self.above is not None and value >= self.above - margin:
+            return True
+        return False
+
+
+class RateRule(Rule):
+    """A measure changing by more than max_drop or max_rise within window_seconds."""
+
+    def __init__(
+        self,
+        name,
+        measure,
+        max_drop=None,
+        max_rise=None,
+        window_seconds=3600,
+        hysteresis=0,
+        title=None,
+    ):
+        if max_drop is None and max_rise is None:
+            raise ValueError(f"rate rule {name} needs max_drop or max_rise")
+
+        super().__init__(name, title)
+        self.measure = measure
+        self.max_drop = max_drop
+        self.max_rise = max_rise
+        self.window_seconds = window_seconds
+        self.hysteresis = hysteresis
+
+    def new_state(self):
+        return RuleState(self.window_seconds)
+
+    def value(self, state, record):
+        return getattr(record, self.measure) - state.window.oldest()[1]
+
+    def update(self, state, record):
+        state.window.add(record.time, getattr(record, self.measure))
+        change = self.value(state, record)
+
+        margin = self.hysteresis if state.active else 0
+        if self.max_drop is not None and -change >= self.max_drop - margin:
+            return True
+        if self.max_rise is not None and change >= self.max_rise - margin:
+            return True
+        return False
+
+
+class SilenceRule(Rule):
+    """No sample of the zone for timeout_seconds, e.g. a failing sensor."""
+
+    def __init__(self, name, timeout_seconds, title=None):
+        super().__init__(name, title)
+        self.timeout_seconds = timeout_seconds
+
+    def value(self, state, record):
+        return state.last_time
+
+    def update(self, state, record):
+        state.last_time = record.time
+        return False
+
+    def check(self, state, now):
+        # the timeout also runs from the start, for a zone never heard of
+        if state.last_time is None:
+            state.last_time = now
+        return now - state.last_time > self.timeout_seconds
+
+
+RULE_TYPES = {
+    "threshold": ThresholdRule,
+    "rate": RateRule,
+    "silence": SilenceRule,
+}
+
+
+def build_rule(configs):
+    # {"type": "threshold", "name": ..., **arguments of the rule class}
+    configs = dict(configs)
+    rule_type = configs.pop("type", "threshold")
+    if rule_type not in RULE_TYPES:
+        raise ValueError(f"unknown alarm rule type {rule_type}")
+
+    return RULE_TYPES[rule_type](**configs)
+
+
+class AlarmEngine:
+    """Evaluates the rules of every zone on each sample.
+
+    Each rule keeps a small state per zone (the active flag and, for
+    windowed rules, a rolling window), so a sample costs one update per rule
+    of its zone and history is never read back. Transitions raise or
+    resolve the alarms of store.
+    """
+
+    def __init__(self, store):
+        self._tag = "ALARM_ENGINE"
+        self.store = store
+        # zone -> [(rule, state)]
+        self._zones = {}
+        # zone -> latest record, its measures are attached to silence alarms
+        self._last = {}
+        self._lock = threading.Lock()
+
+    def set_rules(self, zone, rules):
+        states = []
+        for rule in rules:
+            state = rule.new_state()
+            # alarms raised before a restart of the task stay active
+            state.active = self.store.is_active(zone, rule.name)
+            states.append((rule, state))
+
+        with self._lock:
+            self._zones[zone] = states
+
+    def _apply(self, zone, rule, state, triggered, ts, record):
+        if triggered is None or triggered == state.active:
+            return
+
+        # the measures are only copied out of the record on transitions
+        measures = record.measures if record is not None else None
+        state.active = triggered
+        if triggered:
+            logging.info(f"[{self._tag}]: {zone}: {rule.name} triggered")
+            self.store.raise_alarm(
+                zone, rule.name, rule.title, ts, rule.value(state, record), measures
+            )
+        else:
+            logging.info(f"[{self._tag}]: {zone}: {rule.name} resolved")
+            self.store.resolve(zone, rule.name, ts, measures)
+
+    def process(self, record):
+        zone = record.zone
+
+        with self._lock:
+            self._last[zone] = record
+            for rule, state in self._zones.get(zone, []):
+                self._apply(
+                    zone, rule, state, rule.update(state, record), record.time, record
+                )
+
+    def check(self, now):
+        # rules that fire without samples, e.g. silence timeouts
+        with self._lock:
+            for zone, rules in self._zones.items():
+                for rule, state in rules:
+                    self._apply(
+                        zone,
+                        rule,
+                        state,
+                        rule.check(state, now),
+                        now,
+                        self._last.get(zone),
+                    )
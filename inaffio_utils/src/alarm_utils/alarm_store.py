@@ -0,0 +1,102 @@
+import collections
+import itertools
+import threading
+
+from metrics_utils.metrics_registry import REGISTRY
+
+# resolved alarms kept for /alarms
+ALARM_HISTORY = 100
+
+ALARMS_RAISED = REGISTRY.counter("inaffio_alarms_raised_total", "Alarms raised by rule")
+
+
+class AlarmStore:
+    """Active and resolved alarms, shared by the tasks.
+
+    An alarm is raised once per rule and zone and stays active until the rule
+    resolves it, however many samples keep it triggered. Acknowledging (from
+    /alarms_off or after watering) stops the notifications of the active
+    alarms without resolving them.
+    """
+
+    def __init__(self, history=ALARM_HISTORY):
+        self._ids = itertools.count(1)
+        self._active = {}
+        self._resolved = collections.deque(maxlen=history)
+        # resolved alarms the bot has not announced yet
+        self._unannounced = collections.deque(maxlen=history)
+        self._lock = threading.Lock()
+
+    def raise_alarm(self, zone, rule, title, ts, value, measures):
+        with self._lock:
+            alarm = self._active.get((zone, rule))
+            if alarm is not None:
+                return alarm
+
+            alarm = self._active[(zone, rule)] = {
+                "id": next(self._ids),
+                "zone": zone,
+                "rule": rule,
+                "title": title,
+                "time": ts,
+                "value": value,
+                "measures": measures,
+                "acknowledged": False,
+                "resolved": None,
+            }
+
+        ALARMS_RAISED.inc(zone=zone, rule=rule)
+        return alarm
+
+    def resolve(self, zone, rule, ts, measures=None):
+        # measures of the sample that resolved the alarm, if any
+        with self._lock:
+            alarm = self._active.pop((zone, rule), None)
+            if alarm is None:
+                return None
+
+            alarm["resolved"] = ts
+            if measures is not None:
+                alarm["measures"] = measures
+            self._resolved.append(alarm)
+            self._unannounced.append(alarm)
+            return alarm
+
+    def acknowledge(self, zone=None):
+        # returns how many alarms were acknowledged
+        count = 0
+        with self._lock:
+            for alarm in self._active.values():
+                if (zone is None or alarm["zone"] == zone) and not alarm["acknowledged"]:
+                    alarm["acknowledged"] = True
+                    count += 1
+        return count
+
+    def is_active(self, zone, rule):
+        with self._lock:
+            return (zone, rule) in self._active
+
+    def active(self, acknowledged=True):
+        # oldest first, without the acknowledged ones unless asked
+        with self._lock:
+            alarms = [
+                dict(alarm)
+                for alarm in self._active.values()
+                if acknowledged or not alarm["acknowledged"]
+            ]
+        return sorted(alarms, key=lambda alarm: alarm["id"])
+
+    def resolved(self):
+        with self._lock:
+            return [dict(alarm) for alarm in self._resolved]
+
+    def take_resolved(self):
+        # resolved alarms not announced yet, each one is returned once
+        with self._lock:
+            alarms = [dict(alarm) for alarm in self._unannounced]
+            self._unannounced.clear()
+        return alarms
+
+    def __len__(self):
+        with self._lock:
+            return len(self._active)
@@ -0,0 +1,162 @@
+import struct
+
+import numpy as np
+
+from db_utils.db_record import MEASURES, RECORD_FORMAT
+from db_utils.db_rollup import ROLLUP_FORMAT, RollupTier
+from db_utils.db_storage import FixedRecordLog
+
+# one row per sample, the layout of the binary log records
+RECORD_DTYPE = np.dtype(
+    [("time", "<f8"), ("temperature", "<f8"), ("humidity", "<f8")]
+)
+assert RECORD_DTYPE.itemsize == struct.calcsize(RECORD_FORMAT)
+
+# one row per bucket, the layout of the rollup tier records
+ROLLUP_DTYPE = np.dtype(
+    [
+        ("time", "<f8"),
+        ("count", "<u4"),
+        ("temperature_min", "<f8"),
+        ("temperature_max", "<f8"),
+        ("temperature_sum", "<f8"),
+        ("humidity_min", "<f8"),
+        ("humidity_max", "<f8"),
+        ("humidity_sum", "<f8"),
+    ]
+)
+assert ROLLUP_DTYPE.itemsize == struct.calcsize(ROLLUP_FORMAT)
+
+# bucket means with their extremes and sample count
+BUCKET_DTYPE = np.dtype(
+    RECORD_DTYPE.descr
+    + [(f"{measure}_{name}", "<f8") for measure in MEASURES for name in ("min", "max")]
+    + [("count", "<u4")]
+)
+
+PERCENTILES = (5, 50, 95)
+
+# a humidity rise of at least this much between two samples is a watering,
+# the drying rate is fitted on the samples after the last one
+WATERING_JUMP = 5.0
+# fewer samples or a shorter span give a meaningless slope
+MIN_FIT_SAMPLES = 10
+MIN_FIT_SECONDS = 3600
+# the statistics are computed on the samples held on this many grid points
+HOLD_POINTS = 2048
+
+
+def load_window(storage, start=None, end=None):
+    """Samples of storage between start and end as a structured array.
+
+    The binary log records are read as they are, TinyDB documents are
+    converted one by one. A rollup tier gives one row per bucket, the mean
+    of its samples along with their min, max and count (BUCKET_DTYPE).
+    """
+    if isinstance(storage, RollupTier):
+        if start is not None:
+            start -= start % storage.resolution
+        buckets = np.frombuffer(storage.range_bytes(start, end), dtype=ROLLUP_DTYPE)
+
+        window = np.empty(len(buckets), dtype=BUCKET_DTYPE)
+        window["time"] = buckets["time"]
+        window["count"] = buckets["count"]
+        for measure in MEASURES:
+            window[measure] = buckets[f"{measure}_sum"] / buckets["count"]
+            window[f"{measure}_min"] = buckets[f"{measure}_min"]
+            window[f"{measure}_max"] = buckets[f"{measure}_max"]
+        return window
+
+    if isinstance(storage, FixedRecordLog):
+        return np.frombuffer(storage.range_bytes(start, end), dtype=RECORD_DTYPE)
+
+    rows = storage.iter_range(start, end)
+    return np.fromiter((r.astuple() for r in rows), dtype=RECORD_DTYPE)
+
+
+def hold_resample(window, points=HOLD_POINTS):
+    """window on a regular time grid, each sample held until the next.
+
+    Samples may be irregular (adaptive sampling, deadband storage), on the
+    grid every value weighs as long as it lasted.
+    """
+    grid = np.linspace(window["time"][0], window["time"][-1], points)
+    return window[np.searchsorted(window["time"], grid, side="right") - 1]
+
+
+def summarize(held, low, high):
+    # mean and percentiles of the held values, extremes of low and high
+    percentiles = np.percentile(held, PERCENTILES)
+    summary = {
+        "min": float(low.min()),
+        "max": float(high.max()),
+        "mean": float(held.mean()),
+    }
+    for p, value in zip(PERCENTILES, percentiles):
+        summary[f"p{p}"] = float(value)
+    return summary
+
+
+def drying_rate(times, humidity, watering_jump=WATERING_JUMP):
+    """Least squares humidity slope since the last watering.
+
+    Returns (percent per hour, fitted humidity at the last sample, time of
+    the first fitted sample), or None when there is too little to fit.
+    """
+    jumps = np.flatnonzero(np.diff(humidity) >= watering_jump)
+    first = jumps[-1] + 1 if len(jumps) > 0 else 0
+
+    times, humidity = times[first:], humidity[first:]
+    if len(times) < MIN_FIT_SAMPLES or times[-1] - times[0] < MIN_FIT_SECONDS:
+        return None
+
+    # centered on the last sample, the intercept is the current humidity
+    slope, intercept = np.polyfit(times - times[-1], humidity, 1)
+    return float(slope * 3600), float(intercept), float(times[0])
+
+
+def time_to_threshold(rate, humidity, threshold):
+    # seconds until the fitted humidity reaches threshold, None if it never does
+    if humidity <= threshold:
+        return 0.0
+    if rate >= 0:
+        return None
+    return (humidity - threshold) / -rate * 3600
+
+
+def analyze(window, threshold, watering_jump=WATERING_JUMP):
+    """Statistics, drying rate and projected time to threshold of a window.
+
+    window is a load_window array, of samples or of rollup buckets. Returns
+    None for an empty window.
+    """
+    if len(window) == 0:
+        return None
+
+    times = window["time"]
+    humidity = window["humidity"]
+    held = hold_resample(window)
+    buckets = "count" in window.dtype.names
+
+    result = {
+        "samples": int(window["count"].sum()) if buckets else len(window),
+        "start": float(times[0]),
+        "end": float(times[-1]),
+        "threshold": threshold,
+        "drying_rate": None,
+        "drying_since": None,
+        "seconds_to_threshold": None,
+    }
+    for measure in MEASURES:
+        low = window[f"{measure}_min"] if buckets else window[measure]
+        high = window[f"{measure}_max"] if buckets else window[measure]
+        result[measure] = summarize(held[measure], low, high)
+
+    fit = drying_rate(times, humidity, watering_jump)
+    if fit is not None:
+        rate, current, since = fit
+        result["drying_rate"] = rate
+        result["drying_since"] = since
+        result["seconds_to_threshold"] = time_to_threshold(rate, current, threshold)
+
+    return result
@@ -0,0 +1,111 @@
+import struct
+import zlib
+from array import array
+
+from db_utils.db_record import TelemetryRecord
+
+# columnar export: a file header, then blocks of up to EXPORT_BLOCK_ROWS
+# samples, each a row count followed by the time column (float64) and the
+# temperature and humidity columns (float32), all little-endian
+BINARY_MAGIC = b"INAFFIO1"
+BLOCK_HEADER = "<I"
+EXPORT_BLOCK_ROWS = 4096
+
+FORMATS = ["csv", "bin"]
+
+
+def iter_csv(rows, block_rows=EXPORT_BLOCK_ROWS):
+    # one encoded chunk per block of rows
+    yield b"time,temperature,humidity\n"
+
+    lines = []
+    for row in rows:
+        lines.append(
+            f"{row.time:.3f},{row.temperature:.3f},{row.humidity:.3f}\n"
+        )
+        if len(lines) == block_rows:
+            yield "".join(lines).encode()
+            lines = []
+
+    if len(lines) > 0:
+        yield "".join(lines).encode()
+
+
+def _block(times, temperatures, humidities):
+    return (
+        struct.pack(BLOCK_HEADER, len(times))
+        + array("d", times).tobytes()
+        + array("f", temperatures).tobytes()
+        + array("f", humidities).tobytes()
+    )
+
+
+def iter_binary(rows, block_rows=EXPORT_BLOCK_ROWS):
+    # arrays are little-endian on every board the project runs on
+    yield BINARY_MAGIC
+
+    times, temperatures, humidities = [], [], []
+    for row in rows:
+        times.append(row.time)
+        temperatures.append(row.temperature)
+        humidities.append(row.humidity)
+
+        if len(times) == block_rows:
+            yield _block(times, temperatures, humidities)
+            times, temperatures, humidities = [], [], []
+
+    if len(times) > 0:
+        yield _block(times, temperatures, humidities)
+
+
+def read_binary(chunks):
+    """Rows of a binary export, the reverse of iter_binary.
+
+    chunks is the uncompressed export as an iterable of bytes.
+    """
+    data = b"".join(chunks)
+    if not data.startswith(BINARY_MAGIC):
+        raise ValueError("not a telemetry export")
+
+    offset = len(BINARY_MAGIC)
+    while offset < len(data):
+        (count,) = struct.unpack_from(BLOCK_HEADER, data, offset)
+        offset += struct.calcsize(BLOCK_HEADER)
+
+        columns = []
+        for typecode in ("d", "f", "f"):
+            column = array(typecode)
+            size = count * column.itemsize
+            column.frombytes(data[offset : offset + size])
+            offset += size
+            columns.append(column)
+
+        for ts, temperature, humidity in zip(*columns):
+            yield TelemetryRecord(ts, temperature, humidity)
+
+
+def iter_gzip(chunks, level=6):
+    # gzip stream, compressed as the chunks are produced
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def iter_export(rows, fmt="csv", compress=True):
+    """Encoded (and gzip compressed) export of a stream of telemetry rows.
+
+    rows is consumed lazily, only one block of samples is held at a time.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown export format {fmt}")
+
+    chunks = iter_csv(rows) if fmt == "csv" else iter_binary(rows)
+    return iter_gzip(chunks) if compress else chunks
+
+
+def export_name(zone, label, fmt, compress=True):
+    name = f"telemetry_{zone}_{label}.{fmt}"
+    return name + ".gz" if compress else name
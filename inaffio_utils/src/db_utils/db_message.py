@@ -5,11 +5,10 @@ class DBAction(Enum):
     CLEAN = 200
 
 class DBMessage:
-    def __init__(self, action, **kwargs):
+    # one per sample on db_queue, kept as small as the record it carries
+    __slots__ = ("action", "payload")
+
+    def __init__(self, action, payload=None):
         self.action = action
-        
-        # check if payload is present
-        if "payload" in kwargs:
-            self.payload = kwargs["payload"]
-        else:
-            self.payload = None
\ No newline at end of file
+        # a TelemetryRecord for ADD, {"zone": ...} or None for CLEAN
+        self.payload = payload
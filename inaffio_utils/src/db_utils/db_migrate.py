@@ -0,0 +1,256 @@
+import codecs
+import json
+import logging
+import os
+import re
+
+from db_utils.db_record import DEFAULT_ZONE, TelemetryRecord
+
+logging.basicConfig(level=logging.INFO)
+
+# bytes read from the source at a time
+READ_CHUNK_SIZE = 1024 * 1024
+# a single document larger than this means the source is corrupted
+MAX_DOCUMENT_SIZE = 16 * 1024 * 1024
+MIGRATE_BATCH_SIZE = 5000
+
+TINYDB_DEFAULT_TABLE = "_default"
+
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+DECODER = json.JSONDecoder()
+
+
+class TinyDBReader:
+    """Streams the documents of a TinyDB JSON file, table by table.
+
+    The file is read in chunks and only one document is decoded at a time,
+    so memory does not grow with the size of the file. position() after a
+    document can be passed back to resume reading right after it.
+    """
+
+    def __init__(self, path, position=None, chunk_size=READ_CHUNK_SIZE):
+        self.path = path
+        self.chunk_size = chunk_size
+        self._start = position
+
+        self._file = None
+        self._decoder = None
+        self._offset = 0
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+        self._table = None
+
+    def _fill(self):
+        # drop the consumed text, then decode one more chunk
+        self._offset += len(self._buffer[: self._pos].encode())
+        self._buffer = self._buffer[self._pos :]
+        self._pos = 0
+
+        if len(self._buffer) > MAX_DOCUMENT_SIZE:
+            raise ValueError(f"document at byte {self._offset} is too large")
+
+        data = self._file.read(self.chunk_size)
+        self._eof = len(data) == 0
+        self._buffer += self._decoder.decode(data, final=self._eof)
+
+    def _peek(self):
+        # next character that is not whitespace
+        while True:
+            self._pos = WHITESPACE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if self._eof:
+                raise ValueError(f"{self.path} ends unexpectedly")
+            self._fill()
+
+    def _expect(self, chars):
+        char = self._peek()
+        if char not in chars:
+            raise ValueError(
+                f"expected one of {chars!r} at byte {self.position()[0]} of {self.path}, found {char!r}"
+            )
+        self._pos += 1
+        return char
+
+    def _value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = DECODER.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                # most likely cut by the end of the chunk
+                if self._eof:
+                    raise
+                self._fill()
+                continue
+
+            self._pos = end
+            return value
+
+    def _documents(self, first):
+        if first:
+            if self._peek() == "}":
+                self._pos += 1
+                return
+        elif self._expect(",}") == "}":
+            return
+
+        while True:
+            self._value()
+            self._expect(":")
+            yield self._table, self._value()
+
+            if self._expect(",}") == "}":
+                return
+
+    def _tables(self):
+        if self._start is None:
+            self._expect("{")
+            if self._peek() == "}":
+                return
+        else:
+            # resumed right after a document of the table
+            yield from self._documents(first=False)
+            if self._expect(",}") == "}":
+                return
+
+        while True:
+            self._table = self._value()
+            self._expect(":")
+            self._expect("{")
+            yield from self._documents(first=True)
+
+            if self._expect(",}") == "}":
+                return
+
+    def position(self):
+        # (byte offset, table) right after the last document read
+        return self._offset + len(self._buffer[: self._pos].encode()), self._table
+
+    def __iter__(self):
+        """(table, document) of every document of the file."""
+        offset, self._table = self._start if self._start is not None else (0, None)
+
+        with open(self.path, "rb") as self._file:
+            # TinyDB leaves an empty file until the first insert
+            if os.fstat(self._file.fileno()).st_size == 0:
+                return
+
+            self._file.seek(offset)
+            self._decoder = codecs.getincrementaldecoder("utf-8")()
+            self._offset = offset
+            self._buffer = ""
+            self._pos = 0
+            self._eof = False
+
+            yield from self._tables()
+
+
+def _save_progress(progress_file, progress):
+    # written aside and renamed, a crash never leaves half a progress file
+    with open(progress_file + ".tmp", "w") as f:
+        json.dump(progress, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(progress_file + ".tmp", progress_file)
+
+
+def _load_progress(progress_file, source):
+    if progress_file is None or not os.path.exists(progress_file):
+        return None
+
+    with open(progress_file, "r") as f:
+        progress = json.load(f)
+
+    # TinyDB rewrites the whole file, offsets of another version are useless
+    stat = os.stat(source)
+    if progress.get("size") != stat.st_size or progress.get("mtime") != stat.st_mtime:
+        logging.warning(f"[TINYDB_MIGRATION]: {source} changed, starting over")
+        return None
+
+    return progress
+
+
+def migrate_tinydb(source, telemetry, progress_file=None, batch_size=MIGRATE_BATCH_SIZE):
+    """Copies the telemetry of a TinyDB file into telemetry, returns the counters.
+
+    Records are inserted in batches; after each batch the read position is
+    saved to progress_file, so an interrupted migration resumes from there.
+    A record not newer than the last one stored in its zone is skipped, which
+    drops duplicated timestamps and makes replaying a batch harmless.
+    """
+    tag = "TINYDB_MIGRATION"
+    stat = os.stat(source)
+
+    progress = _load_progress(progress_file, source)
+    if progress is not None and progress.get("done", False):
+        logging.info(f"[{tag}]: {source} is already migrated")
+        return progress["counters"]
+
+    if progress is not None:
+        position = tuple(progress["position"])
+        counters = progress["counters"]
+        logging.info(f"[{tag}]: resuming {source} at byte {position[0]}")
+    else:
+        position = None
+        counters = {"migrated": 0, "duplicates": 0, "out_of_order": 0, "invalid": 0}
+
+    newest = {}
+    reader = TinyDBReader(source, position)
+    batch = []
+
+    def commit(done=False):
+        telemetry.insert_many(batch, sync=True)
+        batch.clear()
+
+        if progress_file is not None:
+            _save_progress(
+                progress_file,
+                {
+                    "source": os.path.abspath(source),
+                    "size": stat.st_size,
+                    "mtime": stat.st_mtime,
+                    "position": reader.position(),
+                    "counters": counters,
+                    "done": done,
+                },
+            )
+
+        logging.info(
+            f"[{tag}]: {counters['migrated']} records migrated, {reader.position()[0] * 100 // max(stat.st_size, 1)}% read"
+        )
+
+    for table, document in reader:
+        zone = DEFAULT_ZONE if table == TINYDB_DEFAULT_TABLE else table
+
+        try:
+            ts = float(document["time"])
+            measures = document["measures"]
+            record = TelemetryRecord(
+                ts,
+                float(measures["temperature"]),
+                float(measures["humidity"]),
+                zone,
+            )
+        except (KeyError, TypeError, ValueError):
+            counters["invalid"] += 1
+            continue
+
+        if zone not in newest:
+            latest = telemetry.latest(zone)
+            newest[zone] = latest.time if latest is not None else None
+
+        if newest[zone] is not None and ts <= newest[zone]:
+            counters["duplicates" if ts == newest[zone] else "out_of_order"] += 1
+            continue
+
+        newest[zone] = ts
+        batch.append(record)
+        counters["migrated"] += 1
+
+        if len(batch) >= batch_size:
+            commit()
+
+    commit(done=True)
+    return counters
@@ -0,0 +1,117 @@
+import bisect
+import struct
+from array import array
+
+# one telemetry sample: timestamp, temperature, humidity
+RECORD_FORMAT = "<ddd"
+RECORD_FIELDS = ("time", "temperature", "humidity")
+MEASURES = ("temperature", "humidity")
+# all doubles, record_columns views the records as an array of them
+assert struct.calcsize(RECORD_FORMAT) == 8 * len(RECORD_FIELDS)
+
+# samples without a zone belong to the default zone
+DEFAULT_ZONE = "default"
+
+
+class TelemetryRecord:
+    """One sample of a zone, from SensorTask through the queues to the storage.
+
+    Slotted attributes instead of the nested {"time", "zone", "measures"}
+    dicts: a record is a single small object, the queues and in-memory
+    batches hold no per-sample dicts.
+    """
+
+    __slots__ = ("time", "zone", "temperature", "humidity")
+
+    def __init__(self, time, temperature, humidity, zone=DEFAULT_ZONE):
+        self.time = time
+        self.zone = zone
+        self.temperature = temperature
+        self.humidity = humidity
+
+    @property
+    def measures(self):
+        # built on demand, e.g. for the alarms that keep them
+        return {"temperature": self.temperature, "humidity": self.humidity}
+
+    def astuple(self):
+        # the fields of a binary log record, in RECORD_FORMAT order
+        return (self.time, self.temperature, self.humidity)
+
+    def to_dict(self):
+        # the TinyDB document of the sample
+        return {"time": self.time, "zone": self.zone, "measures": self.measures}
+
+    @classmethod
+    def from_dict(cls, document, zone=None):
+        measures = document["measures"]
+        return cls(
+            document["time"],
+            measures["temperature"],
+            measures["humidity"],
+            zone if zone is not None else document.get("zone", DEFAULT_ZONE),
+        )
+
+    def __eq__(self, other):
+        if not isinstance(other, TelemetryRecord):
+            return NotImplemented
+        return self.astuple() == other.astuple() and self.zone == other.zone
+
+    def __repr__(self):
+        return f"TelemetryRecord(time={self.time}, temperature={self.temperature}, humidity={self.humidity}, zone={self.zone!r})"
+
+
+def record_columns(data):
+    """Columns of packed RECORD_FORMAT records, without copying them.
+
+    Each column is a strided memoryview of doubles over data (indexing, len,
+    slicing and iteration work as on a list), numpy.asarray wraps it as is.
+    """
+    records = memoryview(data).cast("d")
+    step = len(RECORD_FIELDS)
+    return {field: records[i::step] for i, field in enumerate(RECORD_FIELDS)}
+
+
+def rows_columns(records):
+    # columns of an iterable of TelemetryRecord, one array per field
+    columns = {field: array("d") for field in RECORD_FIELDS}
+    for record in records:
+        columns["time"].append(record.time)
+        columns["temperature"].append(record.temperature)
+        columns["humidity"].append(record.humidity)
+    return columns
+
+
+def column_array(column):
+    # a contiguous copy of a column, e.g. to pickle it to another process
+    if isinstance(column, array):
+        return column
+
+    values = array("d")
+    values.frombytes(memoryview(column).tobytes())
+    return values
+
+
+def resample_hold(columns, step, start=None, end=None):
+    """Columns on a regular grid of step seconds, each sample held until the next.
+
+    With deadband storage only the samples that moved are stored, holding
+    each one rebuilds the skipped ones within the deadband. The grid runs
+    from start (the first sample by default) to end (the last one); grid
+    points before the first sample are left out.
+    """
+    times = columns["time"]
+    resampled = {field: array("d") for field in RECORD_FIELDS}
+    if len(times) == 0:
+        return resampled
+
+    ts = times[0] if start is None else start
+    end = times[-1] if end is None else end
+    while ts <= end:
+        i = bisect.bisect_right(times, ts) - 1
+        if i >= 0:
+            resampled["time"].append(ts)
+            for measure in MEASURES:
+                resampled[measure].append(columns[measure][i])
+        ts += step
+    return resampled
@@ -0,0 +1,243 @@
+import logging
+import os
+import struct
+import time
+from array import array
+
+from db_utils.db_record import MEASURES
+from db_utils.db_storage import (
+    CONFIG_FILE,
+    DEFAULT_ZONE,
+    FixedRecordLog,
+    load_configs,
+    storage_file,
+    zone_file,
+)
+
+logging.basicConfig(level=logging.INFO)
+
+# bucket start, sample count, temperature min/max/sum, humidity min/max/sum
+ROLLUP_FORMAT = "<dIdddddd"
+
+DEFAULT_RESOLUTIONS = [5 * 60, 60 * 60, 24 * 60 * 60]
+DEFAULT_MAX_POINTS = 1000
+
+
+def _to_row(bucket, count, t_min, t_max, t_sum, h_min, h_max, h_sum):
+    return {
+        "time": bucket,
+        "count": count,
+        "measures": {"temperature": t_sum / count, "humidity": h_sum / count},
+        "min": {"temperature": t_min, "humidity": h_min},
+        "max": {"temperature": t_max, "humidity": h_max},
+    }
+
+
+class RollupTier(FixedRecordLog):
+    """Min/max/mean/count of the telemetry over fixed-size time buckets.
+
+    Only the newest bucket is ever modified. Updates are buffered in memory
+    and written by commit(): the newest bucket is rewritten in place and the
+    buckets opened since the last commit are appended, in a single write.
+    """
+
+    def __init__(self, path, resolution):
+        super().__init__(path, ROLLUP_FORMAT)
+        self._tag = "ROLLUP_TIER"
+        self.resolution = resolution
+
+        # newest bucket, loaded from the file on first add
+        self._current = None
+        self._loaded = False
+        self._size = 0
+
+        # buckets to write by the next commit, starting at _pending_offset
+        self._pending = []
+        self._pending_offset = 0
+
+    def _load(self):
+        self._size = os.fstat(self._writer().fileno()).st_size
+        last = self._last()
+        self._current = list(last) if last is not None else None
+        self._loaded = True
+
+    def add(self, ts, temperature, humidity):
+        # offsets are shifted by a concurrent compaction
+        with self._lock:
+            self._add(ts, temperature, humidity)
+
+    def _add(self, ts, temperature, humidity):
+        if not self._loaded:
+            self._load()
+
+        bucket = ts - ts % self.resolution
+        current = self._current
+
+        if current is not None and bucket < current[0]:
+            return
+
+        if current is not None and bucket == current[0]:
+            current[1] += 1
+            current[2] = min(current[2], temperature)
+            current[3] = max(current[3], temperature)
+            current[4] += temperature
+            current[5] = min(current[5], humidity)
+            current[6] = max(current[6], humidity)
+            current[7] += humidity
+
+            if len(self._pending) == 0:
+                # the bucket is already on disk as the last record
+                self._pending = [current]
+                self._pending_offset = self._size - self.record_size
+            return
+
+        self._current = [
+            bucket,
+            1,
+            temperature,
+            temperature,
+            temperature,
+            humidity,
+            humidity,
+            humidity,
+        ]
+        if len(self._pending) == 0:
+            self._pending_offset = self._size
+        self._pending.append(self._current)
+
+    def commit(self, sync=False):
+        with self._lock:
+            if len(self._pending) == 0:
+                return
+
+            self._write_at(self._pending_offset, self._pending, sync)
+            self._size = self._pending_offset + len(self._pending) * self.record_size
+            self._pending = []
+
+    def _compacted(self, dropped_bytes):
+        if not self._loaded:
+            return
+
+        self._size -= dropped_bytes
+        if len(self._pending) > 0:
+            self._pending_offset -= dropped_bytes
+
+    def range(self, start, end=None):
+        # include the bucket that contains start
+        start -= start % self.resolution
+        return [_to_row(*r) for r in self._iter_range(start, end)]
+
+    def columns(self, start, end=None):
+        # bucket means with their min/max, one array per column
+        start -= start % self.resolution
+        columns = {"time": array("d")}
+        for measure in MEASURES:
+            for name in (measure, f"{measure}_min", f"{measure}_max"):
+                columns[name] = array("d")
+
+        rows = struct.iter_unpack(self.record_format, self.range_bytes(start, end))
+        for bucket, count, t_min, t_max, t_sum, h_min, h_max, h_sum in rows:
+            columns["time"].append(bucket)
+            columns["temperature"].append(t_sum / count)
+            columns["temperature_min"].append(t_min)
+            columns["temperature_max"].append(t_max)
+            columns["humidity"].append(h_sum / count)
+            columns["humidity_min"].append(h_min)
+            columns["humidity_max"].append(h_max)
+
+        return columns
+
+    def purge(self):
+        super().purge()
+        self._current = None
+        self._loaded = True
+        self._size = 0
+        self._pending = []
+
+
+class RollupSet:
+    def __init__(self, db_file, resolutions=None, max_points=DEFAULT_MAX_POINTS):
+        self._tag = "ROLLUP_SET"
+        self.max_points = max_points
+
+        if resolutions is None:
+            resolutions = DEFAULT_RESOLUTIONS
+
+        stem = os.path.splitext(db_file)[0]
+        self.tiers = [
+            RollupTier(f"{stem}.{resolution}s.bin", resolution)
+            for resolution in sorted(resolutions)
+        ]
+
+    def add(self, record):
+        for tier in self.tiers:
+            tier.add(record.time, record.temperature, record.humidity)
+
+    def add_many(self, records, sync=False):
+        for record in records:
+            self.add(record)
+        self.commit(sync)
+
+    def commit(self, sync=False):
+        for tier in self.tiers:
+            tier.commit(sync)
+
+    def rebuild(self, storage):
+        # fill tiers that are missing (first start, new resolution) from raw data
+        empty = [tier for tier in self.tiers if len(tier) == 0]
+
+        if len(empty) == 0 or storage.latest() is None:
+            return
+
+        logging.info(
+            f"[{self._tag}]: rebuilding {[tier.resolution for tier in empty]} from raw telemetry"
+        )
+        for i, record in enumerate(storage.iter_range()):
+            for tier in empty:
+                tier.add(record.time, record.temperature, record.humidity)
+            # keep the buffered buckets bounded while rebuilding
+            if i % 10000 == 9999:
+                self.commit()
+
+        self.commit()
+
+    def query(self, storage, start, end=None, raw_since=None):
+        """Columns of the window (see record_columns), for plotting.
+
+        Raw samples when they fit, otherwise the finest tier that fits, with
+        the temperature/humidity _min and _max columns of its buckets;
+        windows starting before raw_since (raw retention) use the tiers.
+        Without end the window runs to the wall clock time, pass it when
+        the samples follow another clock (simulation).
+        """
+        if (raw_since is None or start >= raw_since) and storage.count(
+            start, end
+        ) <= self.max_points:
+            return storage.columns(start, end)
+
+        window = (end if end is not None else time.time()) - start
+        for tier in self.tiers:
+            if window / tier.resolution <= self.max_points:
+                return tier.columns(start, end)
+
+        return self.tiers[-1].columns(start, end)
+
+    def purge(self):
+        for tier in self.tiers:
+            tier.purge()
+
+    def close(self):
+        for tier in self.tiers:
+            tier.close()
+
+
+def open_rollups(configs, zone=DEFAULT_ZONE):
+    return RollupSet(
+        zone_file(storage_file(configs), zone),
+        configs.get("rollups", DEFAULT_RESOLUTIONS),
+        configs.get("max_plot_points", DEFAULT_MAX_POINTS),
+    )
+
+
+def load_rollups(config_file=CONFIG_FILE, zone=DEFAULT_ZONE):
+    return open_rollups(load_configs(config_file), zone)
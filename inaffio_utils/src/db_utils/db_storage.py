@@ -0,0 +1,509 @@
+import glob
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+
+from db_utils.db_record import (
+    DEFAULT_ZONE,
+    RECORD_FORMAT,
+    TelemetryRecord,
+    record_columns,
+    rows_columns,
+)
+
+logging.basicConfig(level=logging.INFO)
+
+CONFIG_FILE = "configs.json"
+CONFIG_SECTION = "db_task"
+
+ZONE_PATTERN = re.compile(r"^[A-Za-z0-9_-]+$")
+
+
+def zone_file(path, zone):
+    # every zone has its own files, the default zone keeps the plain name
+    if zone == DEFAULT_ZONE:
+        return path
+
+    if not ZONE_PATTERN.match(zone):
+        raise ValueError(f"invalid zone name {zone}")
+
+    stem, ext = os.path.splitext(path)
+    return f"{stem}@{zone}{ext}"
+
+
+class TinyDBStorage:
+    """Compatibility backend that keeps telemetry in a TinyDB JSON document.
+
+    Each zone is stored in its own table, the default zone in the default one.
+    Records are stored as the original {"time", "zone", "measures"} documents
+    and read back as TelemetryRecord.
+    """
+
+    def __init__(self, path, zone=DEFAULT_ZONE):
+        from tinydb import TinyDB
+
+        self._tag = "TINYDB_STORAGE"
+        self.path = path
+        self.zone = zone
+        self.db = TinyDB(path)
+
+        if zone != DEFAULT_ZONE:
+            self.db = self.db.table(zone)
+
+        # TinyDB is not thread safe, compaction runs in its own thread
+        self._lock = threading.Lock()
+
+    def insert(self, record):
+        self.insert_many([record])
+
+    def insert_many(self, records, sync=False):
+        # one document rewrite for the whole batch, TinyDB flushes on its own
+        with self._lock:
+            self.db.insert_multiple(record.to_dict() for record in records)
+
+    def _record(self, document):
+        return TelemetryRecord.from_dict(document, self.zone)
+
+    def all(self):
+        return [self._record(document) for document in self.db.all()]
+
+    # TinyDB keeps no index, both queries scan the whole document
+
+    def latest(self):
+        res = self.db.all()
+        return self._record(res[-1]) if len(res) > 0 else None
+
+    def _search(self, start, end=None):
+        from tinydb import Query
+
+        query = Query().time >= start
+        if end is not None:
+            query &= Query().time < end
+
+        return self.db.search(query)
+
+    def range(self, start, end=None):
+        return [self._record(document) for document in self._search(start, end)]
+
+    def iter_range(self, start=None, end=None):
+        if start is None and end is None:
+            documents = self.db.all()
+        else:
+            documents = self._search(start if start is not None else 0, end)
+
+        for document in documents:
+            yield self._record(document)
+
+    def columns(self, start=None, end=None):
+        return rows_columns(self.iter_range(start, end))
+
+    def count(self, start, end=None):
+        return len(self._search(start, end))
+
+    def dead_records(self, before):
+        return self.count(0, before)
+
+    def stats(self, before=None):
+        records = len(self.db)
+        dead = self.dead_records(before) if before is not None else 0
+        return {
+            "path": self.path,
+            "bytes": os.path.getsize(self.path) if os.path.exists(self.path) else 0,
+            "records": records,
+            "dead_records": dead,
+            "dead_ratio": dead / records if records > 0 else 0.0,
+        }
+
+    def compact(self, before):
+        # TinyDB rewrites the whole document on every change anyway
+        from tinydb import Query
+
+        with self._lock:
+            return len(self.db.remove(Query().time < before))
+
+    def purge(self):
+        # TinyDB 4 renamed purge() to truncate()
+        if hasattr(self.db, "truncate"):
+            self.db.truncate()
+        else:
+            self.db.purge()
+
+    def close(self):
+        if hasattr(self.db, "close"):
+            self.db.close()
+
+
+class FixedRecordLog:
+    """File of fixed-width records sorted by their leading timestamp.
+
+    Records are appended at the end of the file and read through a memory
+    map, so the cost of a write does not depend on how much history is
+    stored. Since records are kept in time order the file is its own time
+    index: range lookups bisect on the timestamps and the newest record is
+    the last one.
+    """
+
+    def __init__(self, path, record_format):
+        self._tag = "RECORD_LOG"
+        self.path = path
+        self.record_format = record_format
+        self.record_size = struct.calcsize(record_format)
+
+        # the writer handle is opened on first write, readers never open it
+        self._file = None
+        self._map = None
+        self._map_size = 0
+        self._map_inode = None
+
+        # serializes writes with compaction, which may run in another thread
+        self._lock = threading.RLock()
+
+        if not os.path.exists(path):
+            open(path, "ab").close()
+
+    def _writer(self):
+        if self._file is None:
+            self._file = open(self.path, "r+b")
+
+            # drop a torn record left by a crash in the middle of a write
+            size = os.fstat(self._file.fileno()).st_size
+            if size % self.record_size != 0:
+                logging.warning(f"[{self._tag}]: truncating incomplete record")
+                self._file.truncate(size - size % self.record_size)
+
+        return self._file
+
+    def _records(self):
+        """Map of the records and its size in bytes, taken together.
+
+        Remaps when another handle appended to the file, or when compaction
+        replaced it with a new file. The map is None for an empty file.
+        """
+        with self._lock:
+            stat = os.stat(self.path)
+            size = stat.st_size - stat.st_size % self.record_size
+
+            if size != self._map_size or stat.st_ino != self._map_inode:
+                # an old map is not closed here, a reader may still be
+                # iterating over it, it is released once the last reference
+                # goes away
+                self._map = None
+                self._map_size = 0
+                with open(self.path, "rb") as f:
+                    # the file may have been replaced since the stat above
+                    stat = os.fstat(f.fileno())
+                    size = stat.st_size - stat.st_size % self.record_size
+                    if size > 0:
+                        self._map = mmap.mmap(
+                            f.fileno(), size, access=mmap.ACCESS_READ
+                        )
+                self._map_size = size
+                self._map_inode = stat.st_ino
+
+            return self._map, self._map_size
+
+    def __len__(self):
+        _, size = self._records()
+        return size // self.record_size
+
+    def _time_at(self, records, index):
+        return struct.unpack_from("<d", records, index * self.record_size)[0]
+
+    def _bisect(self, records, count, ts):
+        # index of the first record with time >= ts
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._time_at(records, mid) < ts:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _write_at(self, offset, records, sync=False):
+        # a batch of records goes to disk in a single write
+        data = b"".join(struct.pack(self.record_format, *r) for r in records)
+
+        with self._lock:
+            f = self._writer()
+            f.seek(offset, os.SEEK_SET)
+            f.write(data)
+            f.flush()
+
+            if sync:
+                os.fsync(f.fileno())
+
+    def _append(self, records, sync=False):
+        with self._lock:
+            self._write_at(os.fstat(self._writer().fileno()).st_size, records, sync)
+
+    def _last(self):
+        records, size = self._records()
+        if records is None:
+            return None
+
+        return struct.unpack_from(self.record_format, records, size - self.record_size)
+
+    def _iter_range(self, start=None, end=None):
+        records, size = self._records()
+        if records is None:
+            return
+
+        count = size // self.record_size
+        first = 0 if start is None else self._bisect(records, count, start)
+        last = count if end is None else self._bisect(records, count, end)
+
+        for i in range(first, last):
+            yield struct.unpack_from(self.record_format, records, i * self.record_size)
+
+    def range_bytes(self, start=None, end=None):
+        # packed records of the range, copied out of the map so the map can
+        # still be closed while the caller holds them (e.g. numpy.frombuffer)
+        records, size = self._records()
+        if records is None:
+            return b""
+
+        count = size // self.record_size
+        first = 0 if start is None else self._bisect(records, count, start)
+        last = count if end is None else self._bisect(records, count, end)
+        return records[first * self.record_size : last * self.record_size]
+
+    def dead_records(self, before):
+        # records older than before, dropped by the next compaction
+        records, size = self._records()
+        if records is None:
+            return 0
+        return self._bisect(records, size // self.record_size, before)
+
+    def stats(self, before=None):
+        records = len(self)
+        dead = self.dead_records(before) if before is not None else 0
+        return {
+            "path": self.path,
+            "bytes": os.path.getsize(self.path),
+            "records": records,
+            "dead_records": dead,
+            "dead_ratio": dead / records if records > 0 else 0.0,
+        }
+
+    def _compacted(self, dropped_bytes):
+        # called with the lock held once the file has been replaced
+        pass
+
+    def compact(self, before):
+        """Drops the records older than before, returns how many.
+
+        The records to keep are copied to a new file that replaces the log,
+        readers notice the new file on their next read. The bulk copy runs
+        on a snapshot of the map without the lock, only the records written
+        in the meantime are copied with it held, so writers are not blocked
+        for long.
+        """
+        records, end = self._records()
+        if records is None:
+            return 0
+
+        # the newest record is always kept, it is the latest sample (or the
+        # rollup bucket still being filled)
+        count = end // self.record_size
+        first = min(self._bisect(records, count, before), count - 1)
+        if first <= 0:
+            return 0
+
+        start = first * self.record_size
+        tmp_path = f"{self.path}.compact"
+
+        with open(tmp_path, "wb") as out:
+            out.write(records[start:end])
+
+            with self._lock:
+                # the last copied record may have been rewritten in place
+                # (rollup buckets), copy it again with what was appended
+                resume = max(start, end - self.record_size)
+                with open(self.path, "rb") as f:
+                    f.seek(resume)
+                    tail = f.read()
+                tail = tail[: len(tail) - len(tail) % self.record_size]
+
+                out.seek(resume - start)
+                out.write(tail)
+                out.truncate()
+                out.flush()
+                os.fsync(out.fileno())
+
+                os.replace(tmp_path, self.path)
+
+                # the writer reopens the new file on its next write
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                self._map = None
+                self._map_size = 0
+                self._map_inode = None
+
+                self._compacted(start)
+
+        logging.info(f"[{self._tag}]: dropped {first} records from {self.path}")
+        return first
+
+    def purge(self):
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+                self._map_size = 0
+
+            self._writer().truncate(0)
+
+    def close(self):
+        with self._lock:
+            if self._map is not None:
+                self._map.close()
+                self._map = None
+                self._map_size = 0
+
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class BinaryLogStorage(FixedRecordLog):
+    """Append-only telemetry log, one fixed-width record per sample.
+
+    Each zone is stored in its own file (see zone_file).
+    """
+
+    def __init__(self, path, zone=DEFAULT_ZONE):
+        super().__init__(zone_file(path, zone), RECORD_FORMAT)
+        self._tag = "BINARY_STORAGE"
+        self.zone = zone
+        self._last_time = None
+
+    def _writer(self):
+        opened = self._file is not None
+        f = super()._writer()
+
+        if not opened:
+            last = self._last()
+            self._last_time = last[0] if last is not None else None
+
+        return f
+
+    def insert(self, record):
+        self.insert_many([record])
+
+    def insert_many(self, records, sync=False):
+        self._writer()
+        rows = []
+
+        for record in records:
+            # the time index relies on records being appended in time order
+            if self._last_time is not None and record.time < self._last_time:
+                logging.warning(
+                    f"[{self._tag}]: dropping sample older than the latest stored one"
+                )
+                continue
+
+            rows.append(record.astuple())
+            self._last_time = record.time
+
+        if len(rows) > 0:
+            self._append(rows, sync)
+
+    def all(self):
+        return list(self.iter_range())
+
+    def latest(self):
+        last = self._last()
+        return TelemetryRecord(*last, self.zone) if last is not None else None
+
+    def iter_range(self, start=None, end=None):
+        for r in self._iter_range(start, end):
+            yield TelemetryRecord(*r, self.zone)
+
+    def range(self, start, end=None):
+        return list(self.iter_range(start, end))
+
+    def columns(self, start=None, end=None):
+        # views over one copy of the packed records, no object per sample
+        return record_columns(self.range_bytes(start, end))
+
+    def count(self, start, end=None):
+        records, size = self._records()
+        if records is None:
+            return 0
+
+        count = size // self.record_size
+        last = count if end is None else self._bisect(records, count, end)
+        return max(0, last - self._bisect(records, count, start))
+
+    def purge(self):
+        super().purge()
+        self._last_time = None
+
+
+BACKENDS = {
+    "tinydb": (TinyDBStorage, "telemetry.json"),
+    "binary": (BinaryLogStorage, "telemetry.bin"),
+}
+
+
+def storage_file(configs):
+    backend = configs.get("backend", "tinydb")
+
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown storage backend {backend}")
+
+    return configs.get("db_file", BACKENDS[backend][1])
+
+
+def open_storage(configs, zone=DEFAULT_ZONE):
+    storage_class, _ = BACKENDS[configs.get("backend", "tinydb")]
+    return storage_class(storage_file(configs), zone)
+
+
+def list_zones(configs):
+    # zones that already have stored telemetry
+    path = storage_file(configs)
+
+    if configs.get("backend", "tinydb") == "tinydb":
+        if not os.path.exists(path):
+            return []
+
+        from tinydb import TinyDB
+
+        db = TinyDB(path)
+        tables = db.tables()
+        db.close()
+        return sorted(
+            DEFAULT_ZONE if table == "_default" else table for table in tables
+        )
+
+    stem, ext = os.path.splitext(path)
+    zones = [DEFAULT_ZONE] if os.path.exists(path) else []
+    for zone_path in glob.glob(f"{glob.escape(stem)}@*{ext}"):
+        zone = os.path.splitext(zone_path)[0][len(stem) + 1 :]
+        # rollup tiers of a zone share the prefix
+        if ZONE_PATTERN.match(zone):
+            zones.append(zone)
+
+    return sorted(zones)
+
+
+def load_configs(config_file=CONFIG_FILE):
+    # both the writer (DBTask) and the readers (BotTask) open the same storage
+    if not os.path.exists(config_file):
+        return {}
+
+    with open(config_file, "r") as f:
+        return json.load(f).get(CONFIG_SECTION, {})
+
+
+def load_storage(config_file=CONFIG_FILE, zone=DEFAULT_ZONE):
+    storage = open_storage(load_configs(config_file), zone)
+    logging.info(f"[{storage._tag}]: opened {storage.path}")
+    return storage
@@ -0,0 +1,175 @@
+import logging
+import threading
+
+from db_utils.db_rollup import open_rollups
+from db_utils.db_storage import (
+    CONFIG_FILE,
+    DEFAULT_ZONE,
+    list_zones,
+    load_configs,
+    open_storage,
+)
+
+logging.basicConfig(level=logging.INFO)
+
+DAY = 24 * 60 * 60
+
+
+class ZonedTelemetry:
+    """Raw storage and rollup tiers of every zone.
+
+    Zones are partitioned into their own files (tables for TinyDB), so a
+    query for one zone never reads the samples of the others. Zones are
+    opened on first use. The retention section of the configs sets how many
+    days of raw samples (raw_days) and of each rollup tier (rollup_days,
+    keyed by resolution) compact() keeps, counted back from the newest
+    sample of the zone; everything is kept by default.
+    """
+
+    def __init__(self, configs):
+        self._tag = "ZONED_TELEMETRY"
+        self.configs = configs
+
+        retention = configs.get("retention", {})
+        self.raw_days = retention.get("raw_days")
+        self.rollup_days = {
+            int(resolution): days
+            for resolution, days in retention.get("rollup_days", {}).items()
+        }
+
+        self._zones = {}
+        self._lock = threading.Lock()
+
+    def _open(self, zone):
+        with self._lock:
+            if zone not in self._zones:
+                self._zones[zone] = (
+                    open_storage(self.configs, zone),
+                    open_rollups(self.configs, zone),
+                )
+                logging.info(f"[{self._tag}]: opened zone {zone}")
+            return self._zones[zone]
+
+    def storage(self, zone=DEFAULT_ZONE):
+        return self._open(zone)[0]
+
+    def rollups(self, zone=DEFAULT_ZONE):
+        return self._open(zone)[1]
+
+    def zones(self):
+        with self._lock:
+            opened = set(self._zones.keys())
+        return sorted(opened | set(list_zones(self.configs)))
+
+    def has_zone(self, zone):
+        return zone in self.zones()
+
+    def insert_many(self, records, sync=False):
+        by_zone = {}
+        for record in records:
+            by_zone.setdefault(record.zone, []).append(record)
+
+        for zone, zone_records in by_zone.items():
+            storage, rollups = self._open(zone)
+            storage.insert_many(zone_records, sync)
+            rollups.add_many(zone_records, sync)
+
+    def latest(self, zone=DEFAULT_ZONE):
+        return self.storage(zone).latest()
+
+    def query(self, zone, start, end=None):
+        # raw samples when they fit, otherwise the finest rollup tier that fits
+        storage, rollups = self._open(zone)
+        return rollups.query(
+            storage, start, end, self._cutoff(self.raw_days, self._newest(zone))
+        )
+
+    def window_source(self, zone, start):
+        """Raw storage of the zone, or the rollup tier to read from start on.
+
+        Windows starting before the raw retention are read from the finest
+        tier whose retention reaches start, else from the coarsest one.
+        """
+        storage, rollups = self._open(zone)
+        now = self._newest(zone)
+
+        raw_since = self._cutoff(self.raw_days, now)
+        if raw_since is None or start >= raw_since or len(rollups.tiers) == 0:
+            return storage
+
+        for tier in rollups.tiers:
+            since = self._cutoff(self.rollup_days.get(tier.resolution), now)
+            if since is None or start >= since:
+                return tier
+        return rollups.tiers[-1]
+
+    def _newest(self, zone):
+        latest = self.latest(zone)
+        return latest.time if latest is not None else None
+
+    def _cutoff(self, days, now):
+        if days is None or now is None:
+            return None
+        return now - days * DAY
+
+    def _retained(self, zone, now=None):
+        # (file, cutoff) of every file of the zone with a retention
+        storage, rollups = self._open(zone)
+        if now is None:
+            now = self._newest(zone)
+
+        files = [(storage, self._cutoff(self.raw_days, now))]
+        for tier in rollups.tiers:
+            files.append((tier, self._cutoff(self.rollup_days.get(tier.resolution), now)))
+        return files
+
+    def stats(self, now=None):
+        # size and live/dead records of every file, per zone
+        return {
+            zone: [f.stats(cutoff) for f, cutoff in self._retained(zone, now)]
+            for zone in self.zones()
+        }
+
+    def compact(self, min_dead_ratio=0.1, stop_event=None, now=None):
+        """Enforces the retention one file at a time, returns the dropped count.
+
+        A file is only rewritten once at least min_dead_ratio of its records
+        are past the retention, so each record is copied a bounded number of
+        times before it is dropped.
+        """
+        dropped = 0
+
+        for zone in self.zones():
+            for f, cutoff in self._retained(zone, now):
+                if stop_event is not None and stop_event.is_set():
+                    return dropped
+                if cutoff is None:
+                    continue
+
+                stats = f.stats(cutoff)
+                if stats["dead_records"] > 0 and stats["dead_ratio"] >= min_dead_ratio:
+                    dropped += f.compact(cutoff)
+
+        return dropped
+
+    def rebuild(self):
+        for zone in self.zones():
+            storage, rollups = self._open(zone)
+            rollups.rebuild(storage)
+
+    def purge(self, zone=None):
+        for name in [zone] if zone is not None else self.zones():
+            storage, rollups = self._open(name)
+            storage.purge()
+            rollups.purge()
+
+    def close(self):
+        with self._lock:
+            for storage, rollups in self._zones.values():
+                storage.close()
+                rollups.close()
+            self._zones = {}
+
+
+def load_telemetry(config_file=CONFIG_FILE):
+    return ZonedTelemetry(load_configs(config_file))
@@ -0,0 +1,301 @@
+import hmac
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from db_utils.db_record import TelemetryRecord
+from fleet_utils.fleet_protocol import (
+    INGEST_PATH,
+    MAX_BATCH_BYTES,
+    BatchError,
+    decode_batch,
+)
+from metrics_utils.metrics_registry import REGISTRY
+
+logging.basicConfig(level=logging.INFO)
+
+# batches committed together by the writer
+MAX_GROUP_BATCHES = 64
+
+INGESTED_RECORDS = REGISTRY.counter(
+    "inaffio_collector_records_total", "Records stored by the collector"
+)
+COLLECTOR_COMMIT_SECONDS = REGISTRY.histogram(
+    "inaffio_collector_commit_seconds", "Duration of the collector group commits"
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    node TEXT NOT NULL,
+    zone TEXT NOT NULL,
+    time REAL NOT NULL,
+    temperature REAL NOT NULL,
+    humidity REAL NOT NULL,
+    PRIMARY KEY (node, zone, time)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS nodes (
+    node TEXT PRIMARY KEY,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    last_batch INTEGER NOT NULL,
+    batches INTEGER NOT NULL,
+    records INTEGER NOT NULL,
+    duplicates INTEGER NOT NULL
+);
+"""
+
+
+class CollectorStore:
+    """Telemetry of every node in one SQLite database.
+
+    (node, zone, time) is the primary key, so the samples of a node and zone
+    are read with an index range scan, and a batch received twice (a retry
+    after a lost answer) stores nothing new.
+    """
+
+    def __init__(self, path):
+        self._tag = "COLLECTOR_STORE"
+        self.path = path
+
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+
+        self._lock = threading.Lock()
+
+    def ingest_many(self, batches, now=None):
+        """Stores decoded batches in one transaction.
+
+        batches are (node, seq, zones) as returned by decode_batch, returns
+        (stored, duplicates) of each one.
+        """
+        now = time.time() if now is None else now
+        results = []
+
+        with self._lock, self.db:
+            for node, seq, zones in batches:
+                count = 0
+                stored = 0
+                for zone, rows in zones.items():
+                    cursor = self.db.executemany(
+                        "INSERT OR IGNORE INTO samples VALUES (?, ?, ?, ?, ?)",
+                        ((node, zone, *row) for row in rows),
+                    )
+                    count += len(rows)
+                    stored += cursor.rowcount
+
+                self.db.execute(
+                    """
+                    INSERT INTO nodes VALUES (?, ?, ?, ?, 1, ?, ?)
+                    ON CONFLICT (node) DO UPDATE SET
+                        last_seen = excluded.last_seen,
+                        last_batch = excluded.last_batch,
+                        batches = batches + 1,
+                        records = records + excluded.records,
+                        duplicates = duplicates + excluded.duplicates
+                    """,
+                    (node, now, now, seq, stored, count - stored),
+                )
+                results.append((stored, count - stored))
+
+        return results
+
+    def range(self, node, zone, start=None, end=None):
+        query = "SELECT time, temperature, humidity FROM samples WHERE node = ? AND zone = ?"
+        params = [node, zone]
+        if start is not None:
+            query += " AND time >= ?"
+            params.append(start)
+        if end is not None:
+            query += " AND time < ?"
+            params.append(end)
+
+        with self._lock:
+            rows = self.db.execute(query + " ORDER BY time", params).fetchall()
+        return [TelemetryRecord(*row, zone) for row in rows]
+
+    def zones(self, node):
+        with self._lock:
+            rows = self.db.execute(
+                "SELECT DISTINCT zone FROM samples WHERE node = ?", (node,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def nodes(self):
+        with self._lock:
+            cursor = self.db.execute("SELECT * FROM nodes ORDER BY node")
+            names = [column[0] for column in cursor.description]
+            return [dict(zip(names, row)) for row in cursor.fetchall()]
+
+    def count(self):
+        with self._lock:
+            return self.db.execute("SELECT COUNT(*) FROM samples").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self.db.close()
+
+
+class _PendingBatch:
+    __slots__ = ("batch", "done", "result")
+
+    def __init__(self, batch):
+        self.batch = batch
+        self.done = threading.Event()
+        self.result = None
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # hundreds of nodes may connect at once
+    request_queue_size = 256
+
+
+class CollectorServer:
+    """HTTP endpoint receiving the batches of the node forwarders.
+
+    Handler threads decode the batches and hand them to a single writer
+    thread, which commits all the waiting batches in one transaction; a
+    batch is acknowledged once committed. When more than max_pending batches
+    wait the request is answered with 503 and the node retries later.
+    GET /nodes lists the nodes heard of.
+    """
+
+    def __init__(
+        self,
+        store,
+        listen="0.0.0.0",
+        port=8470,
+        token=None,
+        max_pending=1000,
+        max_batch_bytes=MAX_BATCH_BYTES,
+        timeout_seconds=30,
+    ):
+        self._tag = "COLLECTOR_SERVER"
+        self.store = store
+        self.token = token
+        self.max_batch_bytes = max_batch_bytes
+        self.timeout_seconds = timeout_seconds
+
+        self._pending = queue.Queue(maxsize=max_pending)
+        self._writer = None
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                server._handle_post(self)
+
+            def do_GET(self):
+                server._handle_get(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = _Server((listen, port), Handler)
+        self.port = self.server.server_address[1]
+        self._thread = None
+
+    def _reply(self, request, status, body=None):
+        data = json.dumps(body).encode() if body is not None else b""
+        request.send_response(status)
+        request.send_header("Content-Type", "application/json")
+        request.send_header("Content-Length", str(len(data)))
+        request.end_headers()
+        request.wfile.write(data)
+
+    def _authorized(self, request):
+        if self.token is None:
+            return True
+        return hmac.compare_digest(
+            request.headers.get("Authorization", ""), f"Bearer {self.token}"
+        )
+
+    def _handle_get(self, request):
+        if request.path.split("?")[0] != "/nodes":
+            return self._reply(request, 404)
+        if not self._authorized(request):
+            return self._reply(request, 403)
+
+        self._reply(request, 200, self.store.nodes())
+
+    def _handle_post(self, request):
+        # the body of a refused request is not read, the connection is closed
+        length = int(request.headers.get("Content-Length") or 0)
+        status = None
+        if request.path != INGEST_PATH:
+            status = 404
+        elif not self._authorized(request):
+            status = 403
+        elif length > self.max_batch_bytes:
+            status = 413
+
+        if status is not None:
+            request.close_connection = True
+            return self._reply(request, status)
+
+        try:
+            pending = _PendingBatch(
+                decode_batch(request.rfile.read(length), self.max_batch_bytes)
+            )
+        except BatchError as e:
+            logging.warning(f"[{self._tag}]: rejected batch: {e}")
+            return self._reply(request, 400, {"error": str(e)})
+
+        try:
+            self._pending.put_nowait(pending)
+        except queue.Full:
+            return self._reply(request, 503)
+
+        if not pending.done.wait(self.timeout_seconds) or pending.result is None:
+            return self._reply(request, 503)
+
+        stored, duplicates = pending.result
+        self._reply(request, 200, {"stored": stored, "duplicates": duplicates})
+
+    def _write(self):
+        while True:
+            group = [self._pending.get()]
+            if group[0] is None:
+                return
+
+            # whatever arrived meanwhile goes in the same transaction
+            while len(group) < MAX_GROUP_BATCHES:
+                try:
+                    pending = self._pending.get_nowait()
+                except queue.Empty:
+                    break
+                if pending is None:
+                    self._pending.put(None)
+                    break
+                group.append(pending)
+
+            try:
+                with COLLECTOR_COMMIT_SECONDS.time():
+                    results = self.store.ingest_many([p.batch for p in group])
+                for pending, result in zip(group, results):
+                    pending.result = result
+                    INGESTED_RECORDS.inc(result[0])
+            except Exception as e:
+                logging.error(f"[{self._tag}]: error storing batches: {e}")
+            finally:
+                for pending in group:
+                    pending.done.set()
+
+    def start(self):
+        self._writer = threading.Thread(target=self._write, daemon=True)
+        self._writer.start()
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        logging.info(f"[{self._tag}]: listening on port {self.port}")
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self._pending.put(None)
+        self._writer.join()
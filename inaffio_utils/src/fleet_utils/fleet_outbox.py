@@ -0,0 +1,98 @@
+import logging
+import os
+import threading
+
+logging.basicConfig(level=logging.INFO)
+
+BATCH_SUFFIX = ".batch"
+SEQUENCE_FILE = "sequence"
+
+
+class FleetOutbox:
+    """Batches waiting to be sent to the collector, one file each.
+
+    A batch is written to a temporary file and renamed, so a crash leaves
+    only complete batches behind, and it is removed once the collector
+    acknowledged it. Batches are sent oldest first. While the collector is
+    unreachable they pile up to max_bytes, then the oldest ones are dropped.
+    """
+
+    def __init__(self, path, max_bytes=16 * 1024 * 1024):
+        self._tag = "FLEET_OUTBOX"
+        self.path = path
+        self.max_bytes = max_bytes
+        self.dropped = 0
+
+        os.makedirs(path, exist_ok=True)
+
+        # seq -> size of the batches on disk
+        self._batches = {}
+        for name in os.listdir(path):
+            if name.endswith(BATCH_SUFFIX) and name[: -len(BATCH_SUFFIX)].isdigit():
+                size = os.path.getsize(os.path.join(path, name))
+                self._batches[int(name[: -len(BATCH_SUFFIX)])] = size
+            elif name.endswith(".tmp"):
+                os.remove(os.path.join(path, name))
+
+        # batch numbers keep increasing across restarts
+        self._next_seq = max(self._batches, default=0) + 1
+        sequence_file = os.path.join(path, SEQUENCE_FILE)
+        if os.path.exists(sequence_file):
+            with open(sequence_file, "r") as f:
+                self._next_seq = max(self._next_seq, int(f.read() or 0))
+
+        self._lock = threading.Lock()
+
+        if len(self._batches) > 0:
+            logging.info(f"[{self._tag}]: {len(self._batches)} batches waiting")
+
+    def _file(self, seq):
+        return os.path.join(self.path, f"{seq:016d}{BATCH_SUFFIX}")
+
+    def _write(self, path, data):
+        with open(path + ".tmp", "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+
+    def next_seq(self):
+        with self._lock:
+            seq = self._next_seq
+            self._next_seq += 1
+            self._write(os.path.join(self.path, SEQUENCE_FILE), str(self._next_seq).encode())
+        return seq
+
+    def put(self, seq, data):
+        with self._lock:
+            self._write(self._file(seq), data)
+            self._batches[seq] = len(data)
+
+            while sum(self._batches.values()) > self.max_bytes and len(self._batches) > 1:
+                oldest = min(self._batches)
+                os.remove(self._file(oldest))
+                del self._batches[oldest]
+                self.dropped += 1
+                logging.warning(f"[{self._tag}]: outbox full, dropped batch {oldest}")
+
+    def peek(self):
+        # (seq, data) of the oldest batch, None when empty
+        with self._lock:
+            if len(self._batches) == 0:
+                return None
+            seq = min(self._batches)
+            with open(self._file(seq), "rb") as f:
+                return seq, f.read()
+
+    def remove(self, seq):
+        with self._lock:
+            if self._batches.pop(seq, None) is not None:
+                os.remove(self._file(seq))
+
+    def bytes(self):
+        with self._lock:
+            return sum(self._batches.values())
+
+    def __len__(self):
+        with self._lock:
+            return len(self._batches)
@@ -0,0 +1,123 @@
+import re
+import struct
+import urllib.request
+import zlib
+
+from db_utils.db_record import RECORD_FORMAT, TelemetryRecord
+from db_utils.db_storage import ZONE_PATTERN
+
+# a batch is zlib compressed: the magic, the node name and batch sequence
+# number, then for every zone its name, its record count and its packed
+# records (RECORD_FORMAT), all little-endian
+BATCH_MAGIC = b"INAFFIOF"
+BATCH_HEADER = "<HQ"
+ZONE_HEADER = "<BI"
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+
+INGEST_PATH = "/ingest"
+CONTENT_TYPE = "application/x-inaffio-batch"
+# decompressed size above which a batch is refused, about 300k records
+MAX_BATCH_BYTES = 8 * 1024 * 1024
+
+
+class BatchError(ValueError):
+    pass
+
+
+def node_name(hostname):
+    # a node name the collector accepts, e.g. pi.lan becomes pi-lan
+    return re.sub(r"[^A-Za-z0-9_-]", "-", hostname)
+
+
+def encode_batch(node, seq, records, level=6):
+    """Compressed batch of the records of a node, grouped by zone."""
+    zones = {}
+    for record in records:
+        zones.setdefault(record.zone, []).append(record)
+
+    name = node.encode()
+    parts = [BATCH_MAGIC, struct.pack(BATCH_HEADER, len(name), seq), name]
+    for zone, zone_records in zones.items():
+        zone_name = zone.encode()
+        parts.append(struct.pack(ZONE_HEADER, len(zone_name), len(zone_records)))
+        parts.append(zone_name)
+        parts.append(
+            b"".join(struct.pack(RECORD_FORMAT, *r.astuple()) for r in zone_records)
+        )
+
+    return zlib.compress(b"".join(parts), level)
+
+
+def _name(data, offset, size):
+    name = data[offset : offset + size].decode()
+    if not ZONE_PATTERN.match(name):
+        raise BatchError(f"invalid name {name!r}")
+    return name
+
+
+def decode_batch(data, max_bytes=MAX_BATCH_BYTES):
+    """(node, seq, {zone: [(time, temperature, humidity)]}) of a batch.
+
+    Raises BatchError for a malformed batch or one that decompresses to
+    more than max_bytes.
+    """
+    try:
+        decompressor = zlib.decompressobj()
+        data = decompressor.decompress(data, max_bytes)
+    except zlib.error as e:
+        raise BatchError(f"invalid compressed batch: {e}")
+    if decompressor.unconsumed_tail:
+        raise BatchError("batch too large")
+
+    try:
+        if not data.startswith(BATCH_MAGIC):
+            raise BatchError("not a telemetry batch")
+
+        offset = len(BATCH_MAGIC)
+        name_size, seq = struct.unpack_from(BATCH_HEADER, data, offset)
+        offset += struct.calcsize(BATCH_HEADER)
+        node = _name(data, offset, name_size)
+        offset += name_size
+
+        zones = {}
+        while offset < len(data):
+            name_size, count = struct.unpack_from(ZONE_HEADER, data, offset)
+            offset += struct.calcsize(ZONE_HEADER)
+            zone = _name(data, offset, name_size)
+            offset += name_size
+
+            size = count * RECORD_SIZE
+            if offset + size > len(data):
+                raise BatchError("truncated batch")
+            zones.setdefault(zone, []).extend(
+                struct.iter_unpack(RECORD_FORMAT, data[offset : offset + size])
+            )
+            offset += size
+    except (struct.error, UnicodeDecodeError) as e:
+        raise BatchError(f"malformed batch: {e}")
+
+    return node, seq, zones
+
+
+def batch_records(zones):
+    # the records of a decoded batch
+    for zone, rows in zones.items():
+        for row in rows:
+            yield TelemetryRecord(*row, zone)
+
+
+def post_batch(url, data, token=None, timeout=10):
+    """Sends a batch to a collector, returns its JSON answer as bytes.
+
+    Raises urllib.error.HTTPError when the collector refuses the batch and
+    OSError when it cannot be reached.
+    """
+    headers = {"Content-Type": CONTENT_TYPE}
+    if token is not None:
+        headers["Authorization"] = f"Bearer {token}"
+
+    request = urllib.request.Request(
+        url.rstrip("/") + INGEST_PATH, data=data, headers=headers, method="POST"
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return response.read()
@@ -5,9 +5,60 @@ LATEST_TELEMETRY_MESSAGE = """
 """
 
 ALARM_MESSAGE = """
-🚨 Critical humidity reached 🚨
+🚨 {title} 🚨
 
 💧 {humidity}% 🌡️ {temperature}°C
 
 📅 {date}  🕓 {time}
-"""
\ No newline at end of file
+"""
+
+ALARM_RESOLVED_MESSAGE = """
+✅ {title}: resolved
+
+💧 {humidity}% 🌡️ {temperature}°C
+
+📅 {date}  🕓 {time}
+"""
+
+ALARM_ACKNOWLEDGED_MESSAGE = """(acknowledged)"""
+
+# prepended to the messages of a named zone
+ZONE_HEADER = """🪴 {zone}"""
+
+STATS_TEXT_MESSAGE = """
+📊 Last {window}
+
+🌡️ {temperature_line}
+min {temperature_min} · max {temperature_max} · last {temperature_last}°C
+
+💧 {humidity_line}
+min {humidity_min} · max {humidity_max} · last {humidity_last}%
+"""
+
+SUMMARY_MESSAGE = """
+📊 Last {window}, {samples} samples
+
+🌡️ {temperature_min} - {temperature_max}°C, mean {temperature_mean}°C
+p5 {temperature_p5} · p50 {temperature_p50} · p95 {temperature_p95}
+
+💧 {humidity_min} - {humidity_max}%, mean {humidity_mean}%
+p5 {humidity_p5} · p50 {humidity_p50} · p95 {humidity_p95}
+
+"""
+
+SUMMARY_ROLLUP_MESSAGE = """🗂️ Means of {resolution} buckets, older raw samples are not kept
+"""
+
+SUMMARY_SPAN_MESSAGE = """🗂️ Telemetry since 📅 {date}  🕓 {time} only
+"""
+
+DRYING_MESSAGE = """📉 {rate}%/h since 📅 {date}  🕓 {time}
+"""
+
+TIME_TO_DRY_MESSAGE = """⏳ {threshold}% in {duration}, 📅 {date}  🕓 {time}"""
+
+THRESHOLD_REACHED_MESSAGE = """🚨 Below {threshold}%, time to water"""
+
+NOT_DRYING_MESSAGE = """💦 Not drying, {threshold}% is not in sight"""
+
+NO_DRYING_MESSAGE = """📉 Too few samples since the last watering to project the drying"""
@@ -0,0 +1,259 @@
+import collections
+import logging
+import threading
+import time
+
+from metrics_utils.metrics_registry import REGISTRY
+
+logging.basicConfig(level=logging.INFO)
+
+# Telegram limits: about 30 messages per second overall, one per second per chat
+DEFAULT_GLOBAL_RATE = 30
+DEFAULT_CHAT_INTERVAL = 1.0
+# longest text accepted by sendMessage
+MAX_TEXT_LENGTH = 4096
+
+API_SECONDS = REGISTRY.histogram(
+    "inaffio_telegram_api_seconds", "Duration of the Telegram API calls by method"
+)
+API_FAILURES = REGISTRY.counter(
+    "inaffio_telegram_api_failures_total", "Failed Telegram API calls by method"
+)
+
+
+class OutboundMessage:
+    __slots__ = ("method", "chat_id", "args", "kwargs", "attempts")
+
+    def __init__(self, method, chat_id, args, kwargs):
+        self.method = method
+        self.chat_id = chat_id
+        self.args = args
+        self.kwargs = kwargs
+        self.attempts = 0
+
+    def is_plain_text(self):
+        return self.method == "send_message" and len(self.kwargs) == 0
+
+    def rewind(self):
+        # a file is sent again from its start on a retry
+        for arg in self.args:
+            if hasattr(arg, "seek"):
+                arg.seek(0)
+
+    def close(self):
+        for arg in self.args:
+            if hasattr(arg, "close"):
+                arg.close()
+
+
+class _Chat:
+    __slots__ = ("messages", "next_send", "busy")
+
+    def __init__(self):
+        self.messages = collections.deque()
+        self.next_send = 0
+        self.busy = False
+
+
+class MessageSender:
+    """Single outbound path for every message the bot sends.
+
+    Messages are queued per chat and sent by a small pool of workers. Each
+    chat is served by one worker at a time, so its messages keep their order,
+    and waits chat_interval seconds between sends; all chats together share a
+    token bucket of global_rate sends per second. A burst of plain text
+    messages queued for the same chat is merged into a single message. Failed
+    sends are retried with exponential backoff, honouring the retry_after
+    that Telegram returns with a 429. Files handed over (e.g. a document)
+    are streamed from their start on every attempt and closed once sent or
+    dropped.
+    """
+
+    def __init__(
+        self,
+        bot,
+        workers=2,
+        global_rate=DEFAULT_GLOBAL_RATE,
+        chat_interval=DEFAULT_CHAT_INTERVAL,
+        max_retries=5,
+        retry_delay=1.0,
+    ):
+        self._tag = "BOT_SENDER"
+        self.bot = bot
+        self.workers = workers
+        self.global_rate = global_rate
+        self.chat_interval = chat_interval
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+
+        self._chats = {}
+        self._cond = threading.Condition()
+        self._threads = []
+        self._stopping = False
+
+        # token bucket shared by all chats
+        self._tokens = global_rate
+        self._tokens_at = time.monotonic()
+
+        self.counters = {"sent": 0, "merged": 0, "retried": 0, "dropped": 0}
+
+    def _enqueue(self, method, chat_id, *args, **kwargs):
+        with self._cond:
+            chat = self._chats.setdefault(chat_id, _Chat())
+            chat.messages.append(OutboundMessage(method, chat_id, args, kwargs))
+            self._cond.notify()
+
+    def send_message(self, chat_id, text, **kwargs):
+        self._enqueue("send_message", chat_id, text, **kwargs)
+
+    def send_photo(self, chat_id, photo, **kwargs):
+        self._enqueue("send_photo", chat_id, photo, **kwargs)
+
+    def send_document(self, chat_id, document, **kwargs):
+        self._enqueue("send_document", chat_id, document, **kwargs)
+
+    def delete_message(self, chat_id, message_id):
+        self._enqueue("delete_message", chat_id, message_id)
+
+    def pending(self):
+        with self._cond:
+            return sum(len(chat.messages) for chat in self._chats.values())
+
+    def _refill(self, now):
+        self._tokens = min(
+            self.global_rate, self._tokens + (now - self._tokens_at) * self.global_rate
+        )
+        self._tokens_at = now
+
+    def _take(self, chat):
+        message = chat.messages.popleft()
+
+        if not message.is_plain_text():
+            return message
+
+        # merge the plain text messages queued behind this one
+        text = message.args[0]
+        while len(chat.messages) > 0 and chat.messages[0].is_plain_text():
+            merged = text + "\n" + chat.messages[0].args[0]
+            if len(merged) > MAX_TEXT_LENGTH:
+                break
+            text = merged
+            chat.messages.popleft()
+            self.counters["merged"] += 1
+
+        message.args = (text,)
+        return message
+
+    def _next(self):
+        # wait for a chat that is idle, has messages and may send now
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+
+                # the chat waiting the longest goes first
+                ready = None
+                wait = None
+                for chat in self._chats.values():
+                    if chat.busy or len(chat.messages) == 0:
+                        continue
+                    if chat.next_send <= now:
+                        if ready is None or chat.next_send < ready.next_send:
+                            ready = chat
+                        continue
+                    delay = chat.next_send - now
+                    wait = delay if wait is None else min(wait, delay)
+
+                if ready is None and self._stopping:
+                    return None, None
+
+                if ready is not None:
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        ready.busy = True
+                        return ready, self._take(ready)
+                    wait = (1 - self._tokens) / self.global_rate
+
+                self._cond.wait(wait)
+
+    def _retry_after(self, e):
+        # 429 answers carry the number of seconds to wait
+        result = getattr(e, "result_json", None) or {}
+        return result.get("parameters", {}).get("retry_after")
+
+    def _send(self, chat, message):
+        retry_at = None
+
+        try:
+            message.rewind()
+            with API_SECONDS.time(method=message.method):
+                getattr(self.bot, message.method)(
+                    message.chat_id, *message.args, **message.kwargs
+                )
+            self.counters["sent"] += 1
+        except Exception as e:
+            API_FAILURES.inc(method=message.method)
+            error_code = getattr(e, "error_code", None)
+            retry_after = self._retry_after(e)
+            message.attempts += 1
+
+            if (
+                error_code is not None
+                and 400 <= error_code < 500
+                and error_code != 429
+            ) or message.attempts > self.max_retries:
+                logging.error(
+                    f"[{self._tag}]: dropping {message.method} to {message.chat_id}: {e}"
+                )
+                self.counters["dropped"] += 1
+            else:
+                delay = (
+                    retry_after
+                    if retry_after is not None
+                    else self.retry_delay * 2 ** (message.attempts - 1)
+                )
+                logging.warning(
+                    f"[{self._tag}]: {message.method} to {message.chat_id} failed, retrying in {delay} seconds: {e}"
+                )
+                self.counters["retried"] += 1
+                retry_at = time.monotonic() + delay
+
+        with self._cond:
+            if retry_at is not None:
+                chat.messages.appendleft(message)
+                chat.next_send = retry_at
+            else:
+                chat.next_send = time.monotonic() + self.chat_interval
+            chat.busy = False
+            self._cond.notify_all()
+
+        if retry_at is None:
+            message.close()
+
+    def _worker(self):
+        while True:
+            chat, message = self._next()
+            if message is None:
+                return
+            self._send(chat, message)
+
+    def start(self):
+        with self._cond:
+            self._stopping = False
+
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._worker, name=f"bot_sender_{i}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=5):
+        # workers exit once the messages that can be sent now are sent
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
@@ -0,0 +1,199 @@
+import hmac
+import json
+import logging
+import queue
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logging.basicConfig(level=logging.INFO)
+
+# Telegram updates are a few KB, larger bodies are refused unread
+MAX_UPDATE_BYTES = 1024 * 1024
+
+
+def update_chat_id(update):
+    # updates of the same chat are handled in order, others can run in parallel
+    if update.message is not None:
+        return update.message.chat.id
+    if update.callback_query is not None and update.callback_query.message is not None:
+        return update.callback_query.message.chat.id
+    return 0
+
+
+class UpdateDispatcher:
+    """Bounded pool of handler threads that keeps per-chat ordering.
+
+    Every worker owns a queue and a chat is always routed to the same worker,
+    so updates of one chat are handled one after the other while different
+    chats are handled concurrently. submit() refuses updates once the queue
+    of the worker is full. stop() never blocks on a full queue, the workers
+    return after the update they are handling and the rest is dropped.
+    """
+
+    def __init__(self, handle, workers=4, max_pending=100):
+        self._tag = "UPDATE_DISPATCHER"
+        self.handle = handle
+
+        self._queues = [
+            queue.Queue(maxsize=max(1, max_pending // workers)) for _ in range(workers)
+        ]
+        self._threads = []
+        self._stopped = threading.Event()
+
+    def submit(self, update):
+        if self._stopped.is_set():
+            return False
+        try:
+            self._queues[hash(update_chat_id(update)) % len(self._queues)].put_nowait(
+                update
+            )
+            return True
+        except queue.Full:
+            return False
+
+    def _worker(self, updates):
+        while True:
+            update = updates.get()
+            if update is None or self._stopped.is_set():
+                return
+
+            try:
+                self.handle(update)
+            except Exception as e:
+                logging.error(f"[{self._tag}]: error handling update: {e}")
+
+    def start(self):
+        for i, updates in enumerate(self._queues):
+            thread = threading.Thread(
+                target=self._worker, args=(updates,), name=f"update_worker_{i}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=5):
+        self._stopped.set()
+        for updates in self._queues:
+            # a full queue already wakes its worker up
+            try:
+                updates.put_nowait(None)
+            except queue.Full:
+                pass
+
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+
+class WebhookServer:
+    """HTTP listener receiving the updates that Telegram posts to the webhook.
+
+    Updates are parsed and handed to an UpdateDispatcher. When the dispatcher
+    is full the request is answered with 503, Telegram delivers it again
+    later. Requests without the secret token, which is required, are
+    rejected.
+    """
+
+    def __init__(
+        self,
+        bot,
+        listen="0.0.0.0",
+        port=8443,
+        path="/",
+        secret_token=None,
+        workers=4,
+        max_pending=100,
+        certificate=None,
+        private_key=None,
+    ):
+        from telebot.types import Update
+
+        if not secret_token:
+            # anyone reaching the port could post forged updates
+            raise ValueError("webhook mode needs a secret_token")
+
+        self._tag = "WEBHOOK_SERVER"
+        self.path = path
+        self.secret_token = secret_token
+
+        # handlers run synchronously inside the dispatcher workers
+        bot.threaded = False
+        self.dispatcher = UpdateDispatcher(
+            lambda update: bot.process_new_updates([update]), workers, max_pending
+        )
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                server._handle(self, Update)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((listen, port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+
+        if certificate is not None and private_key is not None:
+            import ssl
+
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certificate, private_key)
+            self.server.socket = context.wrap_socket(
+                self.server.socket, server_side=True
+            )
+
+        self._thread = None
+
+    def _reply(self, request, status):
+        request.send_response(status)
+        request.send_header("Content-Length", "0")
+        request.end_headers()
+
+    def _handle(self, request, update_class):
+        if request.path != self.path:
+            return self._reply(request, 404)
+
+        if not hmac.compare_digest(
+            request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""),
+            self.secret_token,
+        ):
+            return self._reply(request, 403)
+
+        # the body of a refused request is not read, the connection is closed
+        length = request.headers.get("Content-Length")
+        status = None
+        if length is None:
+            status = 413
+        elif not length.isdigit():
+            status = 400
+        elif int(length) == 0 or int(length) > MAX_UPDATE_BYTES:
+            status = 413
+
+        if status is not None:
+            request.close_connection = True
+            return self._reply(request, status)
+        length = int(length)
+
+        try:
+            update = update_class.de_json(json.loads(request.rfile.read(length)))
+        except Exception as e:
+            logging.error(f"[{self._tag}]: invalid update: {e}")
+            return self._reply(request, 400)
+
+        if not self.dispatcher.submit(update):
+            logging.warning(f"[{self._tag}]: handlers busy, rejecting update")
+            return self._reply(request, 503)
+
+        self._reply(request, 200)
+
+    def start(self):
+        self.dispatcher.start()
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        logging.info(f"[{self._tag}]: listening on port {self.port}")
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.dispatcher.stop()
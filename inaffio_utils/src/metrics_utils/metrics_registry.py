@@ -0,0 +1,223 @@
+import bisect
+import threading
+import time
+
+# seconds, from a fast I2C transfer to a slow chart render
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if len(pairs) == 0:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._lock = threading.Lock()
+
+    def samples(self):
+        # (suffix, label key, extra labels, value) of every series
+        return []
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for suffix, key, extra, value in self.samples():
+            lines.append(
+                f"{self.name}{suffix}{_format_labels(key, extra)} {_format_value(value)}"
+            )
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name, help):
+        super().__init__(name, help)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(_key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            return [("", key, (), value) for key, value in self._values.items()]
+
+
+class Gauge(Metric):
+    """Value set by the code, or read from a function when scraped."""
+
+    type = "gauge"
+
+    def __init__(self, name, help):
+        super().__init__(name, help)
+        self._values = {}
+        self._functions = {}
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = _key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function, **labels):
+        # e.g. the size of a queue, only read when the metrics are scraped
+        with self._lock:
+            self._functions[_key(labels)] = function
+
+    def value(self, **labels):
+        key = _key(labels)
+        with self._lock:
+            function = self._functions.get(key)
+            if function is None:
+                return self._values.get(key, 0)
+        return function()
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+            functions = dict(self._functions)
+
+        for key, function in functions.items():
+            try:
+                values[key] = function()
+            except Exception:
+                values.pop(key, None)
+
+        return [("", key, (), value) for key, value in values.items()]
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class Histogram(Metric):
+    """Counts observations in fixed buckets, plus their sum and count.
+
+    Observing costs a bisect and an increment, nothing is kept per sample.
+    """
+
+    type = "histogram"
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = _key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # bucket counts, then the +Inf count and the sum
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[bisect.bisect_left(self.buckets, value)] += 1
+            series[-1] += value
+
+    def time(self, **labels):
+        # with histogram.time(): ... observes the duration of the block
+        return _Timer(self, labels)
+
+    def count(self, **labels):
+        with self._lock:
+            series = self._series.get(_key(labels))
+            return sum(series[:-1]) if series is not None else 0
+
+    def samples(self):
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+
+        samples = []
+        for key, values in series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), values[:-1]):
+                cumulative += count
+                samples.append(("_bucket", key, (("le", _format_value(bound)),), cumulative))
+            samples.append(("_sum", key, (), values[-1]))
+            samples.append(("_count", key, (), cumulative))
+
+        return samples
+
+
+class MetricsRegistry:
+    """Set of metrics rendered together in the Prometheus text format.
+
+    Asking twice for the same name returns the same metric, so modules can
+    declare their metrics at import time.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get(self, metric_class, name, *args):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = metric_class(name, *args)
+            elif not isinstance(metric, metric_class):
+                raise ValueError(f"metric {name} is already a {metric.type}")
+            return metric
+
+    def counter(self, name, help):
+        return self._get(Counter, name, help)
+
+    def gauge(self, name, help):
+        return self._get(Gauge, name, help)
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help, buckets)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+# registry shared by every task of the process
+REGISTRY = MetricsRegistry()
@@ -0,0 +1,59 @@
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from metrics_utils.metrics_registry import REGISTRY
+
+logging.basicConfig(level=logging.INFO)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class MetricsServer:
+    """HTTP endpoint serving a registry in the Prometheus text format.
+
+    Metrics are only rendered when scraped, the tasks just update counters.
+    Listens on localhost unless told otherwise.
+    """
+
+    def __init__(self, registry=REGISTRY, listen="127.0.0.1", port=9108, path="/metrics"):
+        self._tag = "METRICS_SERVER"
+        self.registry = registry
+        self.path = path
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server._handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((listen, port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self._thread = None
+
+    def _handle(self, request):
+        if request.path.split("?")[0] != self.path:
+            request.send_response(404)
+            request.send_header("Content-Length", "0")
+            request.end_headers()
+            return
+
+        body = self.registry.render().encode()
+        request.send_response(200)
+        request.send_header("Content-Type", CONTENT_TYPE)
+        request.send_header("Content-Length", str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        logging.info(f"[{self._tag}]: serving metrics on port {self.port}{self.path}")
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
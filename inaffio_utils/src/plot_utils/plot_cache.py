@@ -0,0 +1,70 @@
+import logging
+import threading
+
+logging.basicConfig(level=logging.INFO)
+
+
+class ChartCache:
+    """PNG charts keyed by (window, newest sample timestamp).
+
+    A chart stays valid until a newer sample is stored, so repeated requests
+    between two samples are answered without rendering. Only the newest chart
+    of each window is kept.
+    """
+
+    def __init__(self, renderer):
+        self._tag = "CHART_CACHE"
+        # renderer(window, columns) -> PNG bytes
+        self.renderer = renderer
+
+        self._charts = {}
+        self._lock = threading.Lock()
+        # renders of a window are serialized, a second request for the same
+        # chart waits for the first one and then finds it in the cache
+        self._render_locks = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, window, newest):
+        with self._lock:
+            cached = self._charts.get(window)
+
+        if cached is not None and cached[0] == newest:
+            return cached[1]
+        return None
+
+    def peek(self, window, newest):
+        return self._lookup(window, newest)
+
+    def get(self, window, newest, query):
+        # query() -> telemetry columns, only called when rendering is needed
+        png = self._lookup(window, newest)
+        if png is not None:
+            self.hits += 1
+            return png
+
+        with self._lock:
+            render_lock = self._render_locks.setdefault(window, threading.Lock())
+
+        with render_lock:
+            png = self._lookup(window, newest)
+            if png is not None:
+                self.hits += 1
+                return png
+
+            self.misses += 1
+            columns = query()
+            if len(columns["time"]) == 0:
+                return None
+
+            png = self.renderer(window, columns)
+
+            with self._lock:
+                self._charts[window] = (newest, png)
+
+        return png
+
+    def clear(self):
+        with self._lock:
+            self._charts = {}
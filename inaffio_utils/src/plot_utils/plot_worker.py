@@ -0,0 +1,95 @@
+import concurrent.futures
+import logging
+import multiprocessing
+import threading
+from concurrent.futures.process import BrokenProcessPool
+
+from db_utils.db_record import column_array
+
+logging.basicConfig(level=logging.INFO)
+
+def to_arrays(columns):
+    # the views of a query to compact float arrays, cheap to pickle to a worker
+    return {name: column_array(column) for name, column in columns.items()}
+
+
+# figures kept alive inside each worker process, keyed by (title, date_format)
+_plots = {}
+
+
+def _render(title, date_format, columns):
+    # runs in the worker process, Matplotlib is only imported there
+    from plot_utils.telemetry_plot import TelemetryPlot
+
+    key = (title, date_format)
+    if key not in _plots:
+        _plots[key] = TelemetryPlot(title, date_format)
+
+    return _plots[key].render_columns(columns)
+
+
+class PlotQueueFull(Exception):
+    pass
+
+
+class PlotWorkerPool:
+    """Renders charts in separate processes.
+
+    Rendering holds the GIL for seconds on a Pi, in a worker process it no
+    longer stalls the bot threads. At most max_pending renders are queued or
+    running, further requests wait for a slot up to timeout_seconds.
+    """
+
+    def __init__(self, processes=1, max_pending=4, timeout_seconds=30):
+        self._tag = "PLOT_WORKER"
+        self.processes = processes
+        self.timeout_seconds = timeout_seconds
+
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                # forkserver avoids forking the threads of the bot process
+                self._executor = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=multiprocessing.get_context("forkserver"),
+                )
+            return self._executor
+
+    def _reset(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    def render(self, title, date_format, columns):
+        if not self._slots.acquire(timeout=self.timeout_seconds):
+            raise PlotQueueFull("too many charts waiting to be rendered")
+
+        columns = to_arrays(columns)
+
+        try:
+            try:
+                future = self._pool().submit(_render, title, date_format, columns)
+            except BrokenProcessPool:
+                logging.error(f"[{self._tag}]: worker pool broken, restarting it")
+                self._reset()
+                future = self._pool().submit(_render, title, date_format, columns)
+        except Exception:
+            self._slots.release()
+            raise
+
+        # the slot is held until the worker is done, even after a timeout
+        future.add_done_callback(lambda _: self._slots.release())
+
+        try:
+            return future.result(timeout=self.timeout_seconds)
+        except BrokenProcessPool:
+            self._reset()
+            raise
+
+    def shutdown(self):
+        self._reset()
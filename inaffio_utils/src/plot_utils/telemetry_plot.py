@@ -0,0 +1,94 @@
+import datetime
+from io import BytesIO
+
+from matplotlib import dates
+from matplotlib.figure import Figure
+
+from db_utils.db_record import rows_columns
+
+
+class TelemetryPlot:
+    """Two-panel temperature/humidity chart kept alive between renders.
+
+    The figure, axes and formatters are built once, later renders only swap
+    the data of the lines and the min/max bands before saving the PNG. The
+    Figure API is used directly, so no pyplot global state is involved.
+    """
+
+    def __init__(self, title, date_format):
+        self.figure = Figure()
+        self.ax1, self.ax2 = self.figure.subplots(2, 1)
+
+        (self.temperature_line,) = self.ax1.plot([], [], "-", color="orange")
+        self.ax1.set_ylabel("Temperature [°C]")
+
+        (self.humidity_line,) = self.ax2.plot([], [], "-", color="blue")
+        self.ax2.set_ylabel("Humidity [%]")
+        self.ax2.set_xlabel("Time")
+
+        # add grid
+        self.ax1.grid()
+        self.ax2.grid()
+
+        # remove seconds from x axis
+        for ax in (self.ax1, self.ax2):
+            ax.xaxis_date()
+            ax.xaxis.set_major_formatter(dates.DateFormatter(date_format))
+
+        # set plot title
+        self.figure.suptitle(title)
+
+        self._bands = []
+
+    def render(self, records):
+        return self.render_columns(rows_columns(records))
+
+    def render_columns(self, columns):
+        x = dates.date2num(
+            [datetime.datetime.fromtimestamp(ts) for ts in columns["time"]]
+        )
+
+        # raw samples hold until the next one (deadband storage), rollup
+        # buckets are joined
+        drawstyle = "default" if "temperature_min" in columns else "steps-post"
+        for line, measure in (
+            (self.temperature_line, "temperature"),
+            (self.humidity_line, "humidity"),
+        ):
+            line.set_data(x, columns[measure])
+            line.set_drawstyle(drawstyle)
+
+        for band in self._bands:
+            band.remove()
+        self._bands = []
+
+        if "temperature_min" in columns:
+            self._bands.append(
+                self.ax1.fill_between(
+                    x,
+                    columns["temperature_min"],
+                    columns["temperature_max"],
+                    color="orange",
+                    alpha=0.3,
+                )
+            )
+            self._bands.append(
+                self.ax2.fill_between(
+                    x,
+                    columns["humidity_min"],
+                    columns["humidity_max"],
+                    color="blue",
+                    alpha=0.3,
+                )
+            )
+
+        for ax in (self.ax1, self.ax2):
+            ax.relim()
+            ax.autoscale_view()
+
+        # set scale
+        self.ax2.set_ylim([0, 100])
+
+        with BytesIO() as bio:
+            self.figure.savefig(bio, format="png")
+            return bio.getvalue()
@@ -0,0 +1,60 @@
+from db_utils.db_record import resample_hold
+
+SPARK_CHARS = "▁▂▃▄▅▆▇█"
+# characters of a sparkline, fits a phone screen
+SPARK_WIDTH = 24
+# grid points per character when raw samples are resampled
+HOLD_POINTS = 8
+
+
+def _downsample(values, width):
+    # mean of equal slices, the line keeps its shape at any length
+    count = len(values)
+    if count <= width:
+        return list(values)
+
+    points = []
+    for i in range(width):
+        chunk = values[i * count // width : (i + 1) * count // width]
+        points.append(sum(chunk) / len(chunk))
+    return points
+
+
+def sparkline(values, width=SPARK_WIDTH):
+    points = _downsample(values, width)
+    if len(points) == 0:
+        return ""
+
+    lo, hi = min(points), max(points)
+    if hi == lo:
+        return SPARK_CHARS[len(SPARK_CHARS) // 2] * len(points)
+
+    scale = (len(SPARK_CHARS) - 1) / (hi - lo)
+    return "".join(SPARK_CHARS[round((v - lo) * scale)] for v in points)
+
+
+def text_chart(columns, width=SPARK_WIDTH):
+    """Sparkline, min, max and last value of each measure of the columns.
+
+    columns are the ones of a telemetry query, for rollups the extremes come
+    from the min/max of the buckets rather than from their means. Raw samples
+    may be irregular (adaptive sampling, deadband storage), the line is drawn
+    from them held on a regular grid so that it follows time.
+    """
+    line_columns = columns
+    times = columns["time"]
+    if "temperature_min" not in columns and len(times) > width:
+        line_columns = resample_hold(
+            columns, (times[-1] - times[0]) / (width * HOLD_POINTS) or 1
+        )
+
+    chart = {}
+    for measure in ("temperature", "humidity"):
+        values = columns[measure]
+        chart[measure] = {
+            "line": sparkline(line_columns[measure], width),
+            "min": min(columns.get(f"{measure}_min", values)),
+            "max": max(columns.get(f"{measure}_max", values)),
+            "last": values[-1],
+        }
+    return chart
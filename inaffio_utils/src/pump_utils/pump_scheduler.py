@@ -0,0 +1,239 @@
+import itertools
+import logging
+import threading
+
+logging.basicConfig(level=logging.INFO)
+
+# longest single watering unless configured, the duty cycle limits the total
+DEFAULT_MAX_DURATION_SECONDS = 300
+
+
+def check_request(duration=None, delay=None, every=None, max_duration=None):
+    """Why a watering request is invalid, None when it is valid.
+
+    Durations are in seconds, delays and periods of at least one second; a
+    period must be longer than the watering.
+    """
+    if duration is not None and duration <= 0:
+        return "the duration must be positive"
+    if duration is not None and max_duration is not None and duration > max_duration:
+        return f"the duration is at most {max_duration}s"
+    if delay is not None and delay < 1:
+        return "the delay is at least 1s"
+    if every is not None and every < 1:
+        return "the period is at least 1s"
+    if every is not None and duration is not None and every <= duration:
+        return "the period must be longer than the duration"
+    return None
+
+
+class WateringJob:
+    """One watering: when it is due, for how long and, if recurring, how often."""
+
+    __slots__ = ("id", "due", "duration", "every", "source")
+
+    def __init__(self, id, due, duration, every=None, source=None):
+        self.id = id
+        self.due = due
+        self.duration = duration
+        self.every = every
+        self.source = source
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "due": self.due,
+            "duration": self.duration,
+            "every": self.every,
+            "source": self.source,
+        }
+
+
+class PumpScheduler:
+    """Queue of watering jobs driving a single pump without blocking.
+
+    The owner calls run_pending(now) whenever next_event(now) is reached or a
+    job is submitted; the pump is switched on and off from there, never by
+    sleeping. Jobs run one at a time in order of due time. A one-shot job due
+    within merge_seconds of another one-shot job (or of the start of the
+    running one) is merged with it, and a recurring job with the same period
+    and duration as an existing one is dropped. The pump is never on for more
+    than max_duty_cycle of any duty_window_seconds: a job that does not fit is
+    postponed until it does.
+    """
+
+    def __init__(
+        self,
+        switch_on,
+        switch_off,
+        max_duty_cycle=0.1,
+        duty_window_seconds=3600,
+        merge_seconds=60,
+    ):
+        self._tag = "PUMP_SCHEDULER"
+        self.switch_on = switch_on
+        self.switch_off = switch_off
+        self.max_duty_cycle = max_duty_cycle
+        self.duty_window_seconds = duty_window_seconds
+        self.merge_seconds = merge_seconds
+
+        self._ids = itertools.count(1)
+        self._jobs = []
+        # job being run and when the pump goes off
+        self._running = None
+        self._started = None
+        self._off_at = None
+        # (start, end) of the recent runs, for the duty cycle
+        self._runs = []
+
+        self._lock = threading.Lock()
+
+    @property
+    def max_on_seconds(self):
+        return self.max_duty_cycle * self.duty_window_seconds
+
+    def _used(self, now):
+        # seconds the pump was on in the duty window ending at now
+        window_start = now - self.duty_window_seconds
+        self._runs = [(start, end) for start, end in self._runs if end > window_start]
+        return sum(min(end, now) - max(start, window_start) for start, end in self._runs)
+
+    def _fits_at(self, now, duration):
+        # first time the window holds duration more seconds, the past runs
+        # leave the window oldest first
+        excess = self._used(now) + duration - self.max_on_seconds
+        if excess <= 0:
+            return now
+
+        window_start = now - self.duty_window_seconds
+
+        for start, end in sorted(self._runs):
+            start = max(start, window_start)
+            if excess <= end - start:
+                return start + excess + self.duty_window_seconds
+            excess -= end - start
+
+        return now
+
+    def _merge(self, due, duration, every):
+        if every is not None:
+            for job in self._jobs:
+                if job.every == every and job.duration == duration:
+                    return job
+            return None
+
+        if (
+            self._running is not None
+            and self._running.every is None
+            and abs(due - self._started) <= self.merge_seconds
+        ):
+            return self._running
+
+        for job in self._jobs:
+            if job.every is None and abs(due - job.due) <= self.merge_seconds:
+                job.duration = max(job.duration, duration)
+                return job
+
+        return None
+
+    def submit(self, due, duration, every=None, source=None):
+        """Schedules a watering, returns (job, merged)."""
+        duration = min(duration, self.max_on_seconds)
+
+        with self._lock:
+            job = self._merge(due, duration, every)
+            if job is not None:
+                logging.info(f"[{self._tag}]: merged request into job {job.id}")
+                return job, True
+
+            job = WateringJob(next(self._ids), due, duration, every, source)
+            self._jobs.append(job)
+            self._jobs.sort(key=lambda j: j.due)
+
+        logging.info(
+            f"[{self._tag}]: job {job.id} scheduled, {duration}s{f' every {every}s' if every else ''}"
+        )
+        return job, False
+
+    def cancel(self, job_id):
+        with self._lock:
+            for job in self._jobs:
+                if job.id == job_id:
+                    self._jobs.remove(job)
+                    return True
+        return False
+
+    def jobs(self):
+        # the running job first, then the pending ones by due time
+        with self._lock:
+            jobs = [job.to_dict() for job in self._jobs]
+            if self._running is not None:
+                running = self._running.to_dict()
+                running["running_until"] = self._off_at
+                jobs.insert(0, running)
+        return jobs
+
+    def running(self):
+        with self._lock:
+            return self._running is not None
+
+    def next_event(self):
+        # clock time of the next switch on or off, None when idle
+        with self._lock:
+            if self._running is not None:
+                return self._off_at
+            return self._jobs[0].due if len(self._jobs) > 0 else None
+
+    def run_pending(self, now):
+        with self._lock:
+            if self._running is not None:
+                if now < self._off_at:
+                    return
+                job, started = self._running, self._started
+                self._runs.append((started, now))
+                self._running = None
+            else:
+                job = None
+
+        if job is not None:
+            self.switch_off(job, now - started)
+
+        with self._lock:
+            if len(self._jobs) == 0 or self._jobs[0].due > now:
+                return
+
+            job = self._jobs[0]
+            fits_at = self._fits_at(now, job.duration)
+            if fits_at > now:
+                job.due = fits_at
+                self._jobs.sort(key=lambda j: j.due)
+                logging.info(
+                    f"[{self._tag}]: duty cycle reached, job {job.id} postponed by {fits_at - now:.0f}s"
+                )
+                return
+
+            self._jobs.pop(0)
+            if job.every is not None:
+                # the next run keeps its period even when this one was late
+                following = WateringJob(
+                    job.id, max(job.due + job.every, now), job.duration, job.every, job.source
+                )
+                self._jobs.append(following)
+                self._jobs.sort(key=lambda j: j.due)
+
+            self._running = job
+            self._started = now
+            self._off_at = now + job.duration
+
+        self.switch_on(job)
+
+    def stop(self, now):
+        # the pump is never left on
+        with self._lock:
+            job, started = self._running, self._started
+            self._running = None
+            if job is not None:
+                self._runs.append((started, now))
+
+        if job is not None:
+            self.switch_off(job, now - started)
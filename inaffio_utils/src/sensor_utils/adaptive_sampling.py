@@ -0,0 +1,102 @@
+class AdaptiveInterval:
+    """Sampling interval that follows how fast the humidity moves.
+
+    When a sample moved the humidity by more than max_change the interval
+    shrinks at once so that the next one should move it by about max_change;
+    while it moves by less than half of it the interval grows by backoff.
+    Within near_threshold of the alarm threshold the interval is also capped,
+    down to min_seconds at the threshold, so the alarm is raised and cleared
+    quickly; far from it, on either side, the interval backs off again.
+    """
+
+    def __init__(
+        self,
+        interval_seconds,
+        min_seconds=10,
+        max_seconds=900,
+        max_change=1.0,
+        near_threshold=10.0,
+        backoff=1.5,
+        threshold=None,
+    ):
+        if not 0 < min_seconds <= max_seconds:
+            raise ValueError("adaptive sampling needs 0 < min_seconds <= max_seconds")
+
+        self.min_seconds = min_seconds
+        self.max_seconds = max_seconds
+        self.max_change = max_change
+        self.near_threshold = near_threshold
+        self.backoff = backoff
+        self.threshold = threshold
+
+        self.interval = self._clamp(interval_seconds)
+        self._last = None
+
+    def _clamp(self, seconds):
+        return min(max(seconds, self.min_seconds), self.max_seconds)
+
+    def update(self, humidity):
+        # returns the interval until the next sample
+        interval = self.interval
+
+        if self._last is not None:
+            change = abs(humidity - self._last)
+            if change > self.max_change:
+                interval *= self.max_change / change
+            elif change < self.max_change / 2:
+                interval *= self.backoff
+        self._last = humidity
+
+        if self.threshold is not None and self.near_threshold > 0:
+            distance = abs(humidity - self.threshold)
+            if distance < self.near_threshold:
+                interval = min(
+                    interval,
+                    self.min_seconds
+                    + (self.max_seconds - self.min_seconds) * distance / self.near_threshold,
+                )
+
+        self.interval = self._clamp(interval)
+        return self.interval
+
+
+class Deadband:
+    """Tells which samples are worth storing.
+
+    A sample is stored when a measure moved by at least its delta since the
+    last stored sample, or max_gap_seconds after it. Every sample skipped
+    is within delta of the stored one before it, so holding each stored
+    value until the next one rebuilds the series within delta (see
+    resample_hold), and no sample for longer than max_gap_seconds means no
+    reading at all.
+    """
+
+    def __init__(self, temperature=None, humidity=None, max_gap_seconds=3600):
+        # a measure without a delta does not make a sample worth storing
+        self.deltas = {
+            measure: delta
+            for measure, delta in (("temperature", temperature), ("humidity", humidity))
+            if delta is not None
+        }
+        if len(self.deltas) == 0:
+            raise ValueError("deadband needs a temperature or humidity delta")
+
+        self.max_gap_seconds = max_gap_seconds
+        self._stored = None
+
+    def _moved(self, record):
+        for measure, delta in self.deltas.items():
+            if abs(getattr(record, measure) - getattr(self._stored, measure)) >= delta:
+                return True
+        return False
+
+    def check(self, record):
+        # True when record is to be stored, it then becomes the reference
+        if (
+            self._stored is None
+            or record.time - self._stored.time >= self.max_gap_seconds
+            or self._moved(record)
+        ):
+            self._stored = record
+            return True
+        return False
@@ -0,0 +1,90 @@
+import collections
+
+
+class MedianFilter:
+    def __init__(self, window=5):
+        self.values = collections.deque(maxlen=window)
+
+    def median(self):
+        values = sorted(self.values)
+        return values[len(values) // 2]
+
+    def add(self, value):
+        self.values.append(value)
+        return self.median()
+
+    def reset(self):
+        self.values.clear()
+
+
+class EMAFilter:
+    def __init__(self, alpha=0.3):
+        self.alpha = alpha
+        self.value = None
+
+    def add(self, value):
+        if self.value is None:
+            self.value = value
+        else:
+            self.value += self.alpha * (value - self.value)
+        return self.value
+
+    def reset(self):
+        self.value = None
+
+
+class MeasureFilter:
+    """Streaming filter for one measure: outlier rejection, median, EMA.
+
+    A sample farther than max_jump from the median of the recent samples is
+    dropped. After max_rejects drops in a row the level is assumed to have
+    really changed (for example after watering) and the filter restarts from
+    the new value.
+    """
+
+    def __init__(self, window=5, alpha=0.3, max_jump=None, max_rejects=3):
+        self.median = MedianFilter(window)
+        self.ema = EMAFilter(alpha)
+        self.max_jump = max_jump
+        self.max_rejects = max_rejects
+
+        self.rejects = 0
+        self.rejected = 0
+
+    def add(self, value):
+        # returns the filtered value, or None when the sample is dropped
+        if (
+            self.max_jump is not None
+            and len(self.median.values) > 0
+            and abs(value - self.median.median()) > self.max_jump
+        ):
+            self.rejects += 1
+            self.rejected += 1
+
+            if self.rejects <= self.max_rejects:
+                return None
+
+            self.median.reset()
+            self.ema.reset()
+
+        self.rejects = 0
+        return self.ema.add(self.median.add(value))
+
+
+class MeasurementFilter:
+    # filters temperature and humidity, a sample is dropped if either is
+
+    def __init__(self, window=5, alpha=0.3, max_jump=None, max_rejects=3):
+        max_jump = max_jump or {}
+        self.filters = {
+            measure: MeasureFilter(window, alpha, max_jump.get(measure), max_rejects)
+            for measure in ("temperature", "humidity")
+        }
+
+    def add(self, c_temp, humidity):
+        temperature = self.filters["temperature"].add(c_temp)
+        humidity = self.filters["humidity"].add(humidity)
+
+        if temperature is None or humidity is None:
+            return None, None
+        return temperature, humidity
@@ -0,0 +1,87 @@
+import logging
+
+logging.basicConfig(level=logging.INFO)
+
+DEFAULT_ADDRESS = 0x44
+
+# single shot without clock stretching, the result is fetched later
+SINGLE_SHOT_COMMANDS = {
+    "high": (0x24, 0x00),
+    "medium": (0x24, 0x0B),
+    "low": (0x24, 0x16),
+}
+
+# periodic acquisition, keyed by measurements per second and repeatability
+PERIODIC_COMMANDS = {
+    0.5: {"high": (0x20, 0x32), "medium": (0x20, 0x24), "low": (0x20, 0x2F)},
+    1: {"high": (0x21, 0x30), "medium": (0x21, 0x26), "low": (0x21, 0x2D)},
+    2: {"high": (0x22, 0x36), "medium": (0x22, 0x20), "low": (0x22, 0x2B)},
+    4: {"high": (0x23, 0x34), "medium": (0x23, 0x22), "low": (0x23, 0x29)},
+    10: {"high": (0x27, 0x37), "medium": (0x27, 0x21), "low": (0x27, 0x2A)},
+}
+
+FETCH_DATA = (0xE0, 0x00)
+BREAK = (0x30, 0x93)
+
+# longest single shot conversion time (high repeatability) in seconds
+MEASUREMENT_DELAY = 0.016
+
+
+class SHT3xCRCError(Exception):
+    pass
+
+
+def crc8(data):
+    # CRC-8 of the datasheet: polynomial 0x31, initialization 0xFF
+    crc = 0xFF
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x31) if crc & 0x80 else (crc << 1)
+            crc &= 0xFF
+    return crc
+
+
+class SHT3x:
+    """Sensirion SHT3x temperature/humidity sensor on an SMBus.
+
+    Supports single shot measurements without clock stretching, where the
+    result is fetched once MEASUREMENT_DELAY has passed, and the periodic
+    acquisition mode, where the sensor measures on its own and read() fetches
+    the latest result. Every word read is checked against its CRC.
+    """
+
+    def __init__(self, bus, address=DEFAULT_ADDRESS):
+        self._tag = "SHT3X"
+        self.bus = bus
+        self.address = address
+        self.periodic = False
+
+    def _command(self, command):
+        self.bus.write_i2c_block_data(self.address, command[0], [command[1]])
+
+    def trigger(self, repeatability="high"):
+        self._command(SINGLE_SHOT_COMMANDS[repeatability])
+
+    def start_periodic(self, mps=1, repeatability="high"):
+        self._command(PERIODIC_COMMANDS[mps][repeatability])
+        self.periodic = True
+
+    def stop_periodic(self):
+        self._command(BREAK)
+        self.periodic = False
+
+    def read(self):
+        # in periodic mode the result buffer is read with the fetch command
+        if self.periodic:
+            self._command(FETCH_DATA)
+
+        data = self.bus.read_i2c_block_data(self.address, 0x00, 6)
+
+        if crc8(data[0:2]) != data[2] or crc8(data[3:5]) != data[5]:
+            raise SHT3xCRCError(f"CRC mismatch in {bytes(data).hex()}")
+
+        c_temp = ((((data[0] * 256.0) + data[1]) * 175) / 65535.0) - 45
+        humidity = 100 * (data[3] * 256 + data[4]) / 65535.0
+
+        return c_temp, humidity
@@ -0,0 +1,207 @@
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+
+logging.basicConfig(level=logging.INFO)
+
+
+def make_message_update(update_id, chat_id, username, text):
+    # minimal Update carrying a text message, as sent by Telegram
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": {
+                "id": chat_id,
+                "is_bot": False,
+                "first_name": username,
+                "username": username,
+            },
+            "text": text,
+            "entities": [
+                {"type": "bot_command", "offset": 0, "length": len(text.split()[0])}
+            ]
+            if text.startswith("/")
+            else [],
+        },
+    }
+
+
+class FakeTelegram:
+    """Local stand-in for the Telegram Bot API, no network involved.
+
+    Point pyTelegramBotAPI at it with
+    telebot.apihelper.API_URL = fake.api_url. Every call is recorded in
+    calls, updates pushed with push_update are served by getUpdates. With
+    chat_interval set, a chat sending faster than that gets a 429 like the
+    real API; latency adds a delay to every answer.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0, chat_interval=None):
+        self._tag = "FAKE_TELEGRAM"
+        self.latency = latency
+        self.chat_interval = chat_interval
+
+        self.calls = []
+        self._updates = []
+        self._last_send = {}
+        self._message_id = 0
+        self._cond = threading.Condition()
+
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                fake._handle(self)
+
+            def do_POST(self):
+                fake._handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.host, self.port = self.server.server_address[:2]
+        self.api_url = f"http://{self.host}:{self.port}/bot{{0}}/{{1}}"
+        self._thread = None
+
+    def _params(self, request):
+        url = urlparse(request.path)
+        params = dict(parse_qsl(url.query))
+
+        length = int(request.headers.get("Content-Length") or 0)
+        body = request.rfile.read(length) if length > 0 else b""
+        content_type = request.headers.get("Content-Type") or ""
+
+        if content_type.startswith("application/json") and len(body) > 0:
+            params.update(json.loads(body))
+        elif content_type.startswith("application/x-www-form-urlencoded"):
+            params.update(parse_qsl(body.decode()))
+
+        # uploaded files are only counted
+        params["_body_size"] = len(body)
+        return url.path.rsplit("/", 1)[-1], params
+
+    def _reply(self, request, status, payload):
+        body = json.dumps(payload).encode()
+        request.send_response(status)
+        request.send_header("Content-Type", "application/json")
+        request.send_header("Content-Length", str(len(body)))
+        request.end_headers()
+        request.wfile.write(body)
+
+    def _message(self, chat_id, params):
+        with self._cond:
+            self._message_id += 1
+            message_id = self._message_id
+
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "private"},
+        }
+        if "text" in params:
+            message["text"] = params["text"]
+        return message
+
+    def _handle(self, request):
+        method, params = self._params(request)
+
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+        with self._cond:
+            self.calls.append((time.monotonic(), method, params))
+
+        if method == "getMe":
+            return self._reply(
+                request,
+                200,
+                {
+                    "ok": True,
+                    "result": {
+                        "id": 1,
+                        "is_bot": True,
+                        "first_name": "inaffio",
+                        "username": "inaffio_bot",
+                    },
+                },
+            )
+
+        if method == "getUpdates":
+            return self._reply(
+                request, 200, {"ok": True, "result": self._get_updates(params)}
+            )
+
+        if method.startswith("send"):
+            chat_id = params.get("chat_id")
+
+            with self._cond:
+                now = time.monotonic()
+                last = self._last_send.get(chat_id)
+                limited = (
+                    self.chat_interval is not None
+                    and last is not None
+                    and now - last < self.chat_interval
+                )
+                if not limited:
+                    self._last_send[chat_id] = now
+
+            if limited:
+                return self._reply(
+                    request,
+                    429,
+                    {
+                        "ok": False,
+                        "error_code": 429,
+                        "description": "Too Many Requests: retry after 1",
+                        "parameters": {"retry_after": 1},
+                    },
+                )
+
+            return self._reply(
+                request, 200, {"ok": True, "result": self._message(chat_id, params)}
+            )
+
+        # setWebhook, deleteWebhook, deleteMessage, answerCallbackQuery, ...
+        return self._reply(request, 200, {"ok": True, "result": True})
+
+    def _get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        timeout = min(float(params.get("timeout") or 0), 1)
+        deadline = time.monotonic() + timeout
+
+        with self._cond:
+            while True:
+                updates = [u for u in self._updates if u["update_id"] >= offset]
+                # updates before the offset are confirmed and can be dropped
+                self._updates = updates
+
+                remaining = deadline - time.monotonic()
+                if len(updates) > 0 or remaining <= 0:
+                    return updates
+                self._cond.wait(remaining)
+
+    def push_update(self, update):
+        with self._cond:
+            self._updates.append(update)
+            self._cond.notify_all()
+
+    def calls_of(self, method):
+        with self._cond:
+            return [params for _, m, params in self.calls if m == method]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        logging.info(f"[{self._tag}]: listening on {self.host}:{self.port}")
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
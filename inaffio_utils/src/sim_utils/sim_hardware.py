@@ -0,0 +1,217 @@
+import errno
+import logging
+import math
+import random
+import threading
+
+from sensor_utils.sht3x import DEFAULT_ADDRESS, crc8
+
+logging.basicConfig(level=logging.INFO)
+
+DEFAULT_BUS = 1
+
+# default soil model, every key can be overridden in the simulation section
+SOIL_DEFAULTS = {
+    # starting and resting humidity in %
+    "humidity": 60.0,
+    "dry_humidity": 10.0,
+    "max_humidity": 90.0,
+    # fraction of the humidity above dry_humidity lost per day
+    "drying_rate_per_day": 0.3,
+    # humidity added per second of pump activity
+    "watering_rate_per_second": 10.0,
+    # daily temperature cycle, coldest at 4 am
+    "temperature": 22.0,
+    "temperature_swing": 4.0,
+    # gaussian noise of every reading
+    "temperature_noise": 0.1,
+    "humidity_noise": 0.5,
+    # probability of a failed transfer and of a corrupted reading
+    "read_failure_rate": 0.0,
+    "crc_error_rate": 0.0,
+}
+
+
+class SimSoil:
+    """Simulated pot read by one SHT3x sensor.
+
+    Humidity decays exponentially towards dry_humidity, following the time
+    of the simulation clock, and rises while the pump is on. Temperature
+    follows a daily sine around its mean.
+    """
+
+    def __init__(self, clock, seed=None, **configs):
+        self._tag = "SIM_SOIL"
+        self.clock = clock
+        self.configs = dict(SOIL_DEFAULTS, **configs)
+        self.random = random.Random(seed)
+
+        self.humidity = self.configs["humidity"]
+        self._updated_at = clock.time()
+        self._lock = threading.Lock()
+
+    def _advance(self, now):
+        elapsed = max(0, now - self._updated_at)
+        self._updated_at = now
+
+        dry = self.configs["dry_humidity"]
+        decay = math.exp(-self.configs["drying_rate_per_day"] * elapsed / 86400)
+        self.humidity = dry + (self.humidity - dry) * decay
+
+    def water(self, seconds):
+        with self._lock:
+            self._advance(self.clock.time())
+            self.humidity = min(
+                self.configs["max_humidity"],
+                self.humidity + self.configs["watering_rate_per_second"] * seconds,
+            )
+
+    def temperature(self, now):
+        hours = (now % 86400) / 3600
+        return self.configs["temperature"] - self.configs[
+            "temperature_swing"
+        ] * math.cos(2 * math.pi * (hours - 4) / 24)
+
+    def read(self):
+        # the true values plus the sensor noise
+        with self._lock:
+            now = self.clock.time()
+            self._advance(now)
+            temperature = self.temperature(now) + self.random.gauss(
+                0, self.configs["temperature_noise"]
+            )
+            humidity = self.humidity + self.random.gauss(
+                0, self.configs["humidity_noise"]
+            )
+
+        return temperature, min(100.0, max(0.0, humidity))
+
+
+def _word(value):
+    raw = [(value >> 8) & 0xFF, value & 0xFF]
+    return raw + [crc8(raw)]
+
+
+class SimSMBus:
+    """Drop-in for smbus.SMBus serving the soils attached at each address.
+
+    Answers the SHT3x commands with readings encoded like the real sensor,
+    including the CRC bytes. Missing addresses and simulated failures raise
+    OSError as a NACK on the real bus does.
+    """
+
+    def __init__(self, bus, soils):
+        self._tag = "SIM_SMBUS"
+        self.bus = bus
+        self.soils = soils
+
+    def _soil(self, address):
+        if address not in self.soils:
+            raise OSError(errno.EREMOTEIO, "Remote I/O error")
+        return self.soils[address]
+
+    def write_i2c_block_data(self, address, register, data):
+        self._soil(address)
+
+    def read_i2c_block_data(self, address, register, length):
+        soil = self._soil(address)
+
+        if soil.random.random() < soil.configs["read_failure_rate"]:
+            raise OSError(errno.EREMOTEIO, "Remote I/O error")
+
+        temperature, humidity = soil.read()
+        data = _word(
+            round(min(65535, max(0, (temperature + 45) * 65535 / 175)))
+        ) + _word(round(humidity * 65535 / 100))
+
+        if soil.random.random() < soil.configs["crc_error_rate"]:
+            data[2] ^= 0xFF
+
+        return data[:length]
+
+    def close(self):
+        pass
+
+
+class SimGPIO:
+    """Drop-in for RPi.GPIO, every output pin drives the pump of all soils."""
+
+    BOARD = "BOARD"
+    BCM = "BCM"
+    OUT = "OUT"
+    IN = "IN"
+    HIGH = 1
+    LOW = 0
+
+    def __init__(self, clock, soils):
+        self._tag = "SIM_GPIO"
+        self.clock = clock
+        self.soils = soils
+
+        self._high_since = {}
+        self.waterings = 0
+        self.watering_seconds = 0
+
+    def setmode(self, mode):
+        pass
+
+    def setup(self, pin, mode, initial=LOW):
+        self.output(pin, initial)
+
+    def output(self, pin, value):
+        now = self.clock.time()
+
+        if value and pin not in self._high_since:
+            self._high_since[pin] = now
+        elif not value and pin in self._high_since:
+            seconds = now - self._high_since.pop(pin)
+            self.waterings += 1
+            self.watering_seconds += seconds
+            logging.info(f"[{self._tag}]: pump on pin {pin} ran {seconds:.1f} seconds")
+
+            for soil in self.soils:
+                soil.water(seconds)
+
+    def cleanup(self, channel=None):
+        pins = list(self._high_since.keys()) if channel is None else [channel]
+        for pin in pins:
+            self.output(pin, self.LOW)
+
+
+class SimHardware:
+    """Simulated sensors and pump wired like the sensor_task configs.
+
+    Every configured sensor gets its own soil, built from the soil settings
+    of the simulation section and overridden per zone by its zones object.
+    """
+
+    def __init__(self, clock, sensor_configs, simulation_configs):
+        self._tag = "SIM_HARDWARE"
+        self.clock = clock
+
+        seed = simulation_configs.get("seed")
+        soil_configs = simulation_configs.get("soil", {})
+        zone_configs = simulation_configs.get("zones", {})
+
+        self.soils = {}
+        self._buses = {}
+        for i, configs in enumerate(sensor_configs):
+            zone = configs.get("zone", "default")
+            address = configs.get("address", DEFAULT_ADDRESS)
+            if isinstance(address, str):
+                address = int(address, 0)
+
+            self.soils[zone] = SimSoil(
+                clock,
+                seed=None if seed is None else seed + i,
+                **dict(soil_configs, **zone_configs.get(zone, {})),
+            )
+            self._buses.setdefault(configs.get("bus", DEFAULT_BUS), {})[
+                address
+            ] = self.soils[zone]
+
+        self.gpio = SimGPIO(clock, list(self.soils.values()))
+
+    def smbus(self, bus):
+        # used in place of smbus.SMBus
+        return SimSMBus(bus, self._buses.get(bus, {}))
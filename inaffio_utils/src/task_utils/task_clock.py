@@ -0,0 +1,45 @@
+import datetime
+import time
+
+
+class SystemClock:
+    """Wall clock used by the tasks for timestamps, scheduling and sleeps."""
+
+    # simulated seconds per real second
+    speed = 1
+
+    def time(self):
+        return time.time()
+
+    def now(self):
+        return datetime.datetime.fromtimestamp(self.time())
+
+    def wait(self, event, seconds):
+        # like event.wait(seconds), seconds are measured on this clock
+        return event.wait(max(0, seconds))
+
+    def sleep(self, seconds):
+        time.sleep(max(0, seconds))
+
+
+class AcceleratedClock(SystemClock):
+    """Clock running speed times faster than the wall clock.
+
+    Time starts at start (now by default) and every wait or sleep lasts
+    1/speed of its length, so schedulers driven by this clock go through
+    days of simulated operation in minutes.
+    """
+
+    def __init__(self, speed=1, start=None):
+        self.speed = speed
+        self.start = start if start is not None else time.time()
+        self._started_at = time.monotonic()
+
+    def time(self):
+        return self.start + (time.monotonic() - self._started_at) * self.speed
+
+    def wait(self, event, seconds):
+        return event.wait(max(0, seconds) / self.speed)
+
+    def sleep(self, seconds):
+        time.sleep(max(0, seconds) / self.speed)
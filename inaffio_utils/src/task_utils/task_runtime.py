@@ -0,0 +1,190 @@
+import logging
+import sched
+import threading
+import time
+
+from metrics_utils.metrics_registry import REGISTRY
+from task_utils.task_clock import SystemClock
+
+logging.basicConfig(level=logging.INFO)
+
+TASK_RESTARTS = REGISTRY.counter(
+    "inaffio_task_restarts_total", "Tasks restarted after a crash or an exit"
+)
+TASK_STALLS = REGISTRY.counter(
+    "inaffio_task_stalls_total", "Tasks that missed their heartbeat"
+)
+
+
+def stoppable_scheduler(stop_event, clock=None):
+    # sched.scheduler that sleeps on stop_event, once it is set the pending
+    # events are cancelled and run() returns; times are read from clock
+    clock = clock or SystemClock()
+
+    def delay(seconds):
+        if clock.wait(stop_event, seconds):
+            for event in scheduler.queue:
+                try:
+                    scheduler.cancel(event)
+                except ValueError:
+                    pass
+
+    scheduler = sched.scheduler(clock.time, delay)
+    return scheduler
+
+
+class SupervisedTask:
+    def __init__(self, name, task):
+        self.name = name
+        self.task = task
+        self.thread = None
+
+        self.restarts = 0
+        self.started_at = 0
+        self.stopped_at = 0
+        self.restart_at = None
+
+        # set by the task through its heartbeat callable
+        self.last_heartbeat = None
+        self.heartbeat_deadline = None
+        self.stalled = False
+
+
+class TaskRuntime:
+    """Runs the tasks in threads sharing one shutdown event.
+
+    Each task is started as task.run(stop_event, heartbeat). A task calls
+    heartbeat(timeout) to promise its next beat within timeout seconds, a
+    missed promise is reported as a stall. A task whose run() raises or
+    returns before shutdown is restarted with exponential backoff, tasks may
+    define stop() to be woken up when shutdown begins.
+    """
+
+    def __init__(self, min_restart_delay=1, max_restart_delay=60):
+        self._tag = "TASK_RUNTIME"
+        self.stop_event = threading.Event()
+
+        self.min_restart_delay = min_restart_delay
+        self.max_restart_delay = max_restart_delay
+
+        self._tasks = []
+        self._lock = threading.Lock()
+        # set when a task stops or shutdown begins, wakes up the supervisor
+        self._wakeup = threading.Event()
+        self._started = False
+
+    def add(self, name, task):
+        # tasks added after start() are started right away, so slow imports
+        # of one task do not delay the others
+        supervised = SupervisedTask(name, task)
+        if self._started:
+            logging.info(f"[{self._tag}]: starting {name}")
+            self._start(supervised)
+        self._tasks.append(supervised)
+
+    def _heartbeat(self, supervised):
+        def heartbeat(timeout=None):
+            now = time.monotonic()
+
+            with self._lock:
+                if supervised.stalled:
+                    logging.info(f"[{self._tag}]: {supervised.name} recovered")
+                supervised.stalled = False
+                supervised.last_heartbeat = now
+                supervised.heartbeat_deadline = (
+                    now + timeout if timeout is not None else None
+                )
+
+        return heartbeat
+
+    def _run(self, supervised):
+        try:
+            supervised.task.run(self.stop_event, self._heartbeat(supervised))
+        except Exception as e:
+            logging.exception(f"[{self._tag}]: {supervised.name} crashed: {e}")
+        finally:
+            supervised.stopped_at = time.monotonic()
+            self._wakeup.set()
+
+    def _start(self, supervised):
+        supervised.started_at = time.monotonic()
+        supervised.restart_at = None
+        supervised.heartbeat_deadline = None
+        supervised.thread = threading.Thread(
+            target=self._run, args=(supervised,), name=supervised.name, daemon=True
+        )
+        supervised.thread.start()
+
+    def start(self):
+        self._started = True
+        for supervised in self._tasks:
+            logging.info(f"[{self._tag}]: starting {supervised.name}")
+            self._start(supervised)
+
+    def _supervise(self, now):
+        # returns the seconds until something needs to be checked again
+        wake = self.max_restart_delay
+
+        for supervised in self._tasks:
+            if supervised.thread.is_alive():
+                with self._lock:
+                    deadline = supervised.heartbeat_deadline
+
+                    if deadline is not None and now > deadline and not supervised.stalled:
+                        supervised.stalled = True
+                        TASK_STALLS.inc(task=supervised.name)
+                        logging.error(
+                            f"[{self._tag}]: {supervised.name} stalled, no heartbeat for {now - supervised.last_heartbeat:.1f} seconds"
+                        )
+
+                    if deadline is not None and now <= deadline:
+                        wake = min(wake, deadline - now)
+                continue
+
+            if supervised.restart_at is None:
+                # a task that ran for a while starts again from the shortest delay
+                if supervised.stopped_at - supervised.started_at > self.max_restart_delay:
+                    supervised.restarts = 0
+
+                delay = min(
+                    self.min_restart_delay * 2**supervised.restarts,
+                    self.max_restart_delay,
+                )
+                supervised.restarts += 1
+                TASK_RESTARTS.inc(task=supervised.name)
+                supervised.restart_at = now + delay
+                logging.warning(
+                    f"[{self._tag}]: {supervised.name} stopped, restarting in {delay} seconds"
+                )
+
+            if now >= supervised.restart_at:
+                self._start(supervised)
+            else:
+                wake = min(wake, supervised.restart_at - now)
+
+        return max(wake, 0.01)
+
+    def join(self):
+        # supervise until shutdown, then wait for the tasks to finish
+        while not self.stop_event.is_set():
+            self._wakeup.wait(self._supervise(time.monotonic()))
+            self._wakeup.clear()
+
+        for supervised in self._tasks:
+            if supervised.thread is not None:
+                supervised.thread.join(timeout=5)
+                if supervised.thread.is_alive():
+                    logging.warning(f"[{self._tag}]: {supervised.name} did not stop")
+
+    def shutdown(self):
+        logging.info(f"[{self._tag}]: shutting down")
+        self.stop_event.set()
+        self._wakeup.set()
+
+        for supervised in self._tasks:
+            stop = getattr(supervised.task, "stop", None)
+            if stop is not None:
+                try:
+                    stop()
+                except Exception as e:
+                    logging.error(f"[{self._tag}]: error stopping {supervised.name}: {e}")
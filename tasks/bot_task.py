@@ -1,121 +1,569 @@
+import concurrent.futures
 import datetime
-from io import BytesIO
 import json
 import os
-import sched
+import queue
+import tempfile
 import threading
-import time
-from matplotlib import dates
 import telebot
 import logging
-import matplotlib.pyplot as plt
-import matplotlib
 
-from tinydb import TinyDB, Query
 from dotenv import load_dotenv
+from analytics_utils.telemetry_analytics import analyze, load_window
+from db_utils.db_export import FORMATS, export_name, iter_export
+from db_utils.db_storage import DEFAULT_ZONE
+from db_utils.db_zones import load_telemetry
 from message_utils.bot_messages import *
+from message_utils.bot_sender import MessageSender
+from metrics_utils.metrics_registry import REGISTRY
+from plot_utils.plot_cache import ChartCache
+from plot_utils.plot_worker import PlotQueueFull, PlotWorkerPool
+from plot_utils.text_plot import text_chart
+from pump_utils.pump_scheduler import DEFAULT_MAX_DURATION_SECONDS, check_request
+from task_utils.task_clock import SystemClock
+from task_utils.task_runtime import stoppable_scheduler
 
 logging.basicConfig(level=logging.INFO)
 load_dotenv(".env")
 
-matplotlib.pyplot.switch_backend("Agg")
-
 TOKEN = os.getenv("TOKEN")
-DB_FILE = "telemetry.json"
+
+# /stats windows: label -> (length, x axis date format)
+STATS_WINDOWS = {
+    "24h": (datetime.timedelta(hours=24), "%H:%M"),
+    "7d": (datetime.timedelta(days=7), "%d/%m"),
+    "30d": (datetime.timedelta(days=30), "%d/%m"),
+    "1y": (datetime.timedelta(days=365), "%m/%Y"),
+}
+DEFAULT_STATS_WINDOW = "24h"
+# /stats replies with a PNG chart or with text sparklines
+STATS_MODES = ["image", "text"]
+DEFAULT_STATS_MODE = "image"
+
+DEFAULT_SUMMARY_WINDOW = "7d"
+# telemetry starting later than this into a /summary window is reported
+SUMMARY_SPAN_SLACK = 3600
+
+# units of the /water durations, e.g. 30s, 2h, 1d
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+# /export takes the /stats windows or the whole history
+EXPORT_ALL = "all"
+DEFAULT_EXPORT_FORMAT = "csv"
+# largest document a bot can upload
+MAX_EXPORT_BYTES = 50 * 1024 * 1024
+# exports larger than this are spooled to a temporary file while encoding
+EXPORT_SPOOL_BYTES = 1024 * 1024
+# period of the heartbeat sent from the scheduler thread
+HEARTBEAT_PERIOD = 30
 CONFIG_FILE = "configs.json"
 
+HANDLER_SECONDS = REGISTRY.histogram(
+    "inaffio_bot_handler_seconds", "Duration of the bot command handlers"
+)
+STATS_SECONDS = REGISTRY.histogram(
+    "inaffio_bot_stats_seconds", "Time to produce a /stats chart, cached or rendered"
+)
 
 class BotTask:
-    def __init__(self, alarm_queue, pump_queue):
+    def __init__(self, alarms, pump_queue, clock=None, token=None):
         self._tag = "BOT_TASK"
-        self.bot = telebot.TeleBot(TOKEN)
-        self.db = TinyDB(DB_FILE)
-
-        self.alarm_queue = alarm_queue
+        self.bot = telebot.TeleBot(token or TOKEN)
+        # drives the alarm scheduler and the /stats windows
+        self.clock = clock or SystemClock()
+        # every outgoing message goes through the rate-limited sender
+        self.sender = MessageSender(self.bot)
+        self.sender_configs = {}
+
+        # updates are received by polling or by a webhook listener
+        self.mode = "polling"
+        self.webhook_configs = {}
+        self.webhook_server = None
+        # read-only view of the telemetry of every zone written by DBTask
+        self.telemetry = load_telemetry()
+
+        # active and resolved alarms, raised by SensorTask
+        self.alarms = alarms
         self.pump_queue = pump_queue
+        # return the watering jobs and the longest watering of PumpTask,
+        # wired by inaffio.py
+        self.pump_jobs = None
+        self.pump_max_duration = None
         self.alarm_notification_period = 60 * 10
         self.allowed_users = {}
+        # alarm thresholds of the sensors, /summary projects the time to reach them
+        self.humidity_alarm_threshold = 5
+        self.humidity_thresholds = {}
+
+        # rendered /stats charts, valid until a newer sample is stored
+        self.charts = ChartCache(self._render_chart)
+        self.plot_processes = 1
+        self.plot_max_pending = 4
+        self.plot_timeout_seconds = 30
+        self.plot_pool = None
+        self._stats_executor = None
+        self._stats_slots = None
+        self.prerender_stats = False
+        self.prerender_windows = [DEFAULT_STATS_WINDOW]
+        self.stats_mode = DEFAULT_STATS_MODE
+        # per-user settings, e.g. the /stats mode, kept across restarts
+        self.preferences_file = "bot_preferences.json"
+        self.preferences = {}
+        self._preferences_lock = threading.Lock()
+        self._prerender_queue = queue.Queue(maxsize=1)
 
         # define bindings for commands
         @self.bot.message_handler(commands=["start"])
         def _process_command_start(message):
-            self._handle_command_start(message)
+            with HANDLER_SECONDS.time(command="start"):
+                self._handle_command_start(message)
 
         @self.bot.message_handler(commands=["telemetry"])
         def _process_command_telemetry(message):
-            self._handle_command_telemetry(message)
+            with HANDLER_SECONDS.time(command="telemetry"):
+                self._handle_command_telemetry(message)
 
         @self.bot.message_handler(commands=["water"])
         def _process_command_water(message):
-            self._handle_command_water(message)
+            with HANDLER_SECONDS.time(command="water"):
+                self._handle_command_water(message)
 
         @self.bot.callback_query_handler(func=lambda call: True)
         def _process_callback_query(call):
-            self._handle_callback_query(call)
+            with HANDLER_SECONDS.time(command="callback_query"):
+                self._handle_callback_query(call)
 
         @self.bot.message_handler(commands=["alarms"])
         def _process_command_alarm(message):
-            self._handle_command_alarm(message)
+            with HANDLER_SECONDS.time(command="alarms"):
+                self._handle_command_alarm(message)
 
         @self.bot.message_handler(commands=["alarms_off"])
         def _process_command_remove_alarms(message):
-            self._handle_command_remove_alarms(message)
+            with HANDLER_SECONDS.time(command="alarms_off"):
+                self._handle_command_remove_alarms(message)
 
         @self.bot.message_handler(commands=["stats"])
         def _process_command_stats(message):
-            self._handle_command_stats(message)
+            with HANDLER_SECONDS.time(command="stats"):
+                self._handle_command_stats(message)
+
+        @self.bot.message_handler(commands=["pump_jobs"])
+        def _process_command_pump_jobs(message):
+            with HANDLER_SECONDS.time(command="pump_jobs"):
+                self._handle_command_pump_jobs(message)
+
+        @self.bot.message_handler(commands=["stats_mode"])
+        def _process_command_stats_mode(message):
+            with HANDLER_SECONDS.time(command="stats_mode"):
+                self._handle_command_stats_mode(message)
+
+        @self.bot.message_handler(commands=["summary"])
+        def _process_command_summary(message):
+            with HANDLER_SECONDS.time(command="summary"):
+                self._handle_command_summary(message)
+
+        @self.bot.message_handler(commands=["export"])
+        def _process_command_export(message):
+            with HANDLER_SECONDS.time(command="export"):
+                self._handle_command_export(message)
+
+    def _render_chart(self, key, columns):
+        # rendered in a worker process, this thread only waits for the PNG
+        zone, window = key
+        title = f"Last {window} telemetry"
+        if zone != DEFAULT_ZONE:
+            title += f" - {zone}"
+
+        return self.plot_pool.render(title, STATS_WINDOWS[window][1], columns)
+
+    def _stats_chart(self, zone, window):
+        latest = self.telemetry.latest(zone)
+        if latest is None:
+            return None
+
+        # raw samples for short windows, rollups for the long ones
+        since, end = self._window_bounds(window)
+        return self.charts.get(
+            (zone, window),
+            latest.time,
+            lambda: self.telemetry.query(zone, since, end),
+        )
 
-    def _generate_plot(self, res, bio):
-        _, (ax1, ax2) = plt.subplots(2, 1)
+    def _window_bounds(self, window):
+        # (start, end) of a stats window by the task clock, the rollup tier
+        # is chosen from it
+        end = self.clock.time()
+        return end - STATS_WINDOWS[window][0].total_seconds(), end
+
+    def _zone_header(self, zone):
+        if zone == DEFAULT_ZONE:
+            return ""
+        return ZONE_HEADER.format(zone=zone) + "\n"
+
+    def _select_zone(self, chat_id, zone):
+        # the only zone is used when none is given
+        zones = self.telemetry.zones()
+
+        if len(zones) == 0:
+            self.sender.send_message(chat_id, "No telemetry found \U0001F622")
+            return None
+
+        if zone is None:
+            if len(zones) == 1:
+                return zones[0]
+            self.sender.send_message(chat_id, f"Specify a zone: {', '.join(zones)}")
+            return None
+
+        if zone not in zones:
+            self.sender.send_message(
+                chat_id, f"Unknown zone, use one of: {', '.join(zones)}"
+            )
+            return None
 
-        x = [datetime.datetime.fromtimestamp(r["time"]) for r in res]
-        y1 = [r["measures"]["temperature"] for r in res]
-        y2 = [r["measures"]["humidity"] for r in res]
+        return zone
 
-        ax1.plot(x, y1, "-", color="orange")
-        ax1.set_ylabel("Temperature [°C]")
+    def on_telemetry(self, records):
+        # called by DBTask after each commit
+        if not self.prerender_stats:
+            return
 
-        ax2.plot(x, y2, "-", color="blue")
-        ax2.set_ylabel("Humidity [%]")
-        ax2.set_xlabel("Time")
+        # a pending request already covers the new samples
+        try:
+            self._prerender_queue.put_nowait(True)
+        except queue.Full:
+            pass
 
-        # add grid
-        ax1.grid()
-        ax2.grid()
+    def _prerender_task(self, stop_event):
+        while not stop_event.is_set():
+            try:
+                self._prerender_queue.get(timeout=HEARTBEAT_PERIOD)
+            except queue.Empty:
+                continue
+
+            # charts of zones without new samples are still cached
+            for zone in self.telemetry.zones():
+                for window in self.prerender_windows:
+                    try:
+                        self._stats_chart(zone, window)
+                    except Exception as e:
+                        logging.error(
+                            f"[{self._tag}]: error pre-rendering {zone} {window}: {e}"
+                        )
+
+    def _handle_command_stats(self, message):
+        if not self._check_user(message):
+            return
 
-        # remove seconds from x axis
-        ax1.xaxis.set_major_formatter(dates.DateFormatter("%H:%M"))
-        ax2.xaxis.set_major_formatter(dates.DateFormatter("%H:%M"))
+        # /stats [window] [text|image] [zone], in any order
+        window = DEFAULT_STATS_WINDOW
+        mode = self._preference(message.from_user.username, "stats_mode", self.stats_mode)
+        zone = None
+        for arg in message.text.split()[1:]:
+            if arg in STATS_WINDOWS:
+                window = arg
+            elif arg in STATS_MODES:
+                mode = arg
+            elif arg[0].isdigit():
+                self.sender.send_message(
+                    message.chat.id,
+                    f"Unknown window, use one of: {', '.join(STATS_WINDOWS.keys())}",
+                )
+                return
+            else:
+                zone = arg
 
-        # set scale
-        ax2.set_ylim([0, 100])
+        zone = self._select_zone(message.chat.id, zone)
+        if zone is None:
+            return
 
-        # set plot title
-        plt.suptitle("Last 24 hours telemetry")
+        if mode == "text":
+            self._send_text_stats(message.chat.id, zone, window)
+            return
 
-        plt.savefig(bio, format="png")
-        bio.seek(0)
-        plt.close()
+        # cached charts are sent right away, renders are handed to the stats
+        # threads so the handler threads stay free for the other commands
+        latest = self.telemetry.latest(zone)
+        png = (
+            self.charts.peek((zone, window), latest.time)
+            if latest is not None
+            else None
+        )
 
-        return bio
+        if png is not None:
+            self.sender.send_photo(message.chat.id, png)
+            return
 
-    def _handle_command_stats(self, message):
+        if not self._stats_slots.acquire(blocking=False):
+            self.sender.send_message(
+                message.chat.id, "Too many charts in progress, try again later"
+            )
+            return
+
+        self._stats_executor.submit(self._send_stats, message.chat.id, zone, window)
+
+    def _send_stats(self, chat_id, zone, window):
+        try:
+            with STATS_SECONDS.time(window=window):
+                png = self._stats_chart(zone, window)
+
+            if png is None:
+                self.sender.send_message(chat_id, "No telemetry found \U0001F622")
+                return
+
+            self.sender.send_photo(chat_id, png)
+        except (PlotQueueFull, concurrent.futures.TimeoutError):
+            logging.warning(f"[{self._tag}]: chart rendering timed out")
+            self.sender.send_message(chat_id, "Chart rendering timed out, try again later")
+        except Exception as e:
+            logging.error(f"[{self._tag}]: error sending stats: {e}")
+        finally:
+            self._stats_slots.release()
+
+    def _send_text_stats(self, chat_id, zone, window):
+        # the same samples or rollups as the chart, no plotting involved
+        since, end = self._window_bounds(window)
+        columns = self.telemetry.query(zone, since, end)
+        if len(columns["time"]) == 0:
+            self.sender.send_message(chat_id, "No telemetry found \U0001F622")
+            return
+
+        values = {"window": window}
+        for measure, chart in text_chart(columns).items():
+            values[f"{measure}_line"] = chart["line"]
+            for name in ("min", "max", "last"):
+                values[f"{measure}_{name}"] = round(chart[name], 1)
+
+        self.sender.send_message(
+            chat_id, self._zone_header(zone) + STATS_TEXT_MESSAGE.format(**values)
+        )
+
+    def _handle_command_stats_mode(self, message):
+        if not self._check_user(message):
+            return
+
+        # /stats_mode [text|image], the default of /stats for this user
+        user = message.from_user.username
+        args = message.text.split()[1:]
+        if len(args) == 0:
+            mode = self._preference(user, "stats_mode", self.stats_mode)
+            self.sender.send_message(message.chat.id, f"/stats replies with {mode}")
+            return
+
+        if args[0] not in STATS_MODES:
+            self.sender.send_message(
+                message.chat.id, f"Unknown mode, use one of: {', '.join(STATS_MODES)}"
+            )
+            return
+
+        self._set_preference(user, "stats_mode", args[0])
+        self.sender.send_message(message.chat.id, f"/stats now replies with {args[0]}")
+
+    def _preference(self, user, name, default):
+        with self._preferences_lock:
+            return self.preferences.get(user, {}).get(name, default)
+
+    def _set_preference(self, user, name, value):
+        with self._preferences_lock:
+            self.preferences.setdefault(user, {})[name] = value
+
+            # written aside and renamed, a crash never leaves half a file
+            try:
+                with open(self.preferences_file + ".tmp", "w") as f:
+                    json.dump(self.preferences, f)
+                os.replace(self.preferences_file + ".tmp", self.preferences_file)
+            except OSError as e:
+                logging.error(f"[{self._tag}]: error saving preferences: {e}")
+
+    def _load_preferences(self):
+        if not os.path.exists(self.preferences_file):
+            return
+
+        with open(self.preferences_file, "r") as f:
+            self.preferences = json.load(f)
+
+    def _handle_command_summary(self, message):
         if not self._check_user(message):
             return
 
-        # get telemetry of last 24 hours
-        res = self.db.search(
-            Query().time
-            > (datetime.datetime.now() - datetime.timedelta(hours=24)).timestamp()
+        # /summary [window] [zone], in any order
+        window = DEFAULT_SUMMARY_WINDOW
+        zone = None
+        for arg in message.text.split()[1:]:
+            if arg in STATS_WINDOWS:
+                window = arg
+            elif arg[0].isdigit():
+                self.sender.send_message(
+                    message.chat.id,
+                    f"Unknown window, use one of: {', '.join(STATS_WINDOWS.keys())}",
+                )
+                return
+            else:
+                zone = arg
+
+        zone = self._select_zone(message.chat.id, zone)
+        if zone is None:
+            return
+
+        # samples of the window as arrays, no chart to render; past the raw
+        # retention the rollup buckets are summarized instead
+        since, end = self._window_bounds(window)
+        source = self.telemetry.window_source(zone, since)
+        summary = analyze(
+            load_window(source, since, end),
+            self.humidity_thresholds.get(zone, self.humidity_alarm_threshold),
+        )
+
+        if summary is None:
+            self.sender.send_message(message.chat.id, "No telemetry found \U0001F622")
+            return
+
+        self.sender.send_message(
+            message.chat.id,
+            self._zone_header(zone)
+            + self._format_summary(
+                window, summary, since, getattr(source, "resolution", None)
+            ),
+        )
+
+    def _format_date(self, ts):
+        dt = datetime.datetime.fromtimestamp(ts) + datetime.timedelta(hours=1)
+        return dt.strftime("%d/%m/%Y"), dt.strftime("%H:%M")
+
+    def _format_summary(self, window, summary, since, resolution=None):
+        values = {"window": window, "samples": summary["samples"]}
+        for measure in ("temperature", "humidity"):
+            for name, value in summary[measure].items():
+                values[f"{measure}_{name}"] = round(value, 1)
+        text = SUMMARY_MESSAGE.format(**values)
+
+        # the window may reach past the stored telemetry
+        if resolution is not None:
+            text += SUMMARY_ROLLUP_MESSAGE.format(
+                resolution=self._format_duration(resolution)
+            )
+        if summary["start"] - since > (resolution or SUMMARY_SPAN_SLACK):
+            date, time = self._format_date(summary["start"])
+            text += SUMMARY_SPAN_MESSAGE.format(date=date, time=time)
+
+        threshold = summary["threshold"]
+        if summary["drying_rate"] is None:
+            return text + NO_DRYING_MESSAGE
+
+        date, time = self._format_date(summary["drying_since"])
+        text += DRYING_MESSAGE.format(
+            rate=round(summary["drying_rate"], 2), date=date, time=time
+        )
+
+        seconds = summary["seconds_to_threshold"]
+        if seconds is None:
+            return text + NOT_DRYING_MESSAGE.format(threshold=threshold)
+        if seconds == 0:
+            return text + THRESHOLD_REACHED_MESSAGE.format(threshold=threshold)
+
+        date, time = self._format_date(summary["end"] + seconds)
+        return text + TIME_TO_DRY_MESSAGE.format(
+            threshold=threshold,
+            duration=self._format_duration(seconds),
+            date=date,
+            time=time,
         )
 
-        if len(res) == 0:
-            self.bot.send_message(message.chat.id, "No telemetry found \U0001F622")
+    def _format_duration(self, seconds):
+        # the two largest units, e.g. 1d 4h, 2h, 5m 30s
+        minutes, seconds = divmod(int(seconds), 60)
+        hours, minutes = divmod(minutes, 60)
+        days, hours = divmod(hours, 24)
+
+        parts = [(days, "d"), (hours, "h"), (minutes, "m"), (seconds, "s")]
+        while len(parts) > 1 and parts[0][0] == 0:
+            parts.pop(0)
+        parts = [f"{value}{unit}" for value, unit in parts[:2] if value > 0]
+        return " ".join(parts) if len(parts) > 0 else "0s"
+
+    def _parse_duration(self, text):
+        # seconds of 30, 30s, 5m, 2h or 1d, None if invalid
+        unit = DURATION_UNITS.get(text[-1:], None)
+        number = text[:-1] if unit is not None else text
+        try:
+            seconds = float(number) * (unit or 1)
+        except ValueError:
+            return None
+        return seconds if 0 < seconds < float("inf") else None
+
+    def _handle_command_export(self, message):
+        if not self._check_user(message):
+            return
+
+        # /export [window|all] [csv|bin] [zone], in any order
+        window = EXPORT_ALL
+        fmt = DEFAULT_EXPORT_FORMAT
+        zone = None
+        for arg in message.text.split()[1:]:
+            if arg in STATS_WINDOWS or arg == EXPORT_ALL:
+                window = arg
+            elif arg in FORMATS:
+                fmt = arg
+            elif arg[0].isdigit():
+                self.sender.send_message(
+                    message.chat.id,
+                    f"Unknown window, use one of: {', '.join(list(STATS_WINDOWS.keys()) + [EXPORT_ALL])}",
+                )
+                return
+            else:
+                zone = arg
+
+        zone = self._select_zone(message.chat.id, zone)
+        if zone is None:
+            return
+
+        # exports share the slots of the charts, both read the whole window
+        if not self._stats_slots.acquire(blocking=False):
+            self.sender.send_message(
+                message.chat.id, "Too many requests in progress, try again later"
+            )
             return
 
-        with BytesIO() as bio:
-            bio = self._generate_plot(res, bio)
-            self.bot.send_photo(message.chat.id, bio)
+        self._stats_executor.submit(
+            self._send_export, message.chat.id, zone, window, fmt
+        )
+
+    def _send_export(self, chat_id, zone, window, fmt):
+        try:
+            since = (
+                (self.clock.now() - STATS_WINDOWS[window][0]).timestamp()
+                if window != EXPORT_ALL
+                else None
+            )
+            rows = self.telemetry.storage(zone).iter_range(since)
+
+            # samples are read and compressed a block at a time into a
+            # spooled file that telebot streams to Telegram
+            size = 0
+            f = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_BYTES)
+            try:
+                for chunk in iter_export(rows, fmt):
+                    size += len(chunk)
+                    if size > MAX_EXPORT_BYTES:
+                        self.sender.send_message(
+                            chat_id, "Export too large, choose a shorter window"
+                        )
+                        return
+                    f.write(chunk)
+
+                f.seek(0)
+                # the sender closes the file once it is sent
+                self.sender.send_document(
+                    chat_id, f, visible_file_name=export_name(zone, window, fmt)
+                )
+                f = None
+            finally:
+                if f is not None:
+                    f.close()
+        except Exception as e:
+            logging.error(f"[{self._tag}]: error sending export: {e}")
+        finally:
+            self._stats_slots.release()
 
     def _handle_command_remove_alarms(self, message):
         if not self._check_user(message):
@@ -129,7 +577,7 @@ class BotTask:
             ),
             telebot.types.InlineKeyboardButton("No", callback_data="remove_alarms_no"),
         )
-        self.bot.send_message(
+        self.sender.send_message(
             message.chat.id,
             "Are you sure to turn off all alarms?",
             reply_markup=markup,
@@ -139,147 +587,260 @@ class BotTask:
         if not self._check_user(message):
             return
 
-        if len(self.alarm_queue.queue) == 0:
-            self.bot.send_message(message.chat.id, "No alarms found ")
+        alarms = self.alarms.active()
+        if len(alarms) == 0:
+            self.sender.send_message(message.chat.id, "No alarms found ")
             return
 
-        for alarm in self.alarm_queue.queue:
-            ts = alarm["time"]
-            date = datetime.datetime.fromtimestamp(ts).strftime("%d/%m/%Y")
-            time = datetime.datetime.fromtimestamp(ts).strftime("%H:%M:%S")
-            temperature = alarm["measures"]["temperature"]
-            humidity = alarm["measures"]["humidity"]
-
-            self.bot.send_message(
-                message.chat.id,
-                ALARM_MESSAGE.format(
-                    temperature=temperature, humidity=humidity, time=time, date=date
-                ),
-            )
+        for alarm in alarms:
+            text = self._alarm_message(ALARM_MESSAGE, alarm)
+            if alarm["acknowledged"]:
+                text += ALARM_ACKNOWLEDGED_MESSAGE
+            self.sender.send_message(message.chat.id, text)
 
     def _handle_command_water(self, message):
         if not self._check_user(message):
             return
 
+        # /water [duration] [in delay] [every period], e.g. /water 30s in 2h
+        request = {}
+        args = message.text.split()[1:]
+        while len(args) > 0:
+            arg = args.pop(0)
+            key = {"in": "delay", "every": "every"}.get(arg, "duration")
+            value = args.pop(0) if key != "duration" and len(args) > 0 else arg
+            seconds = self._parse_duration(value)
+            if seconds is None:
+                self.sender.send_message(
+                    message.chat.id,
+                    "Usage: /water [duration] [in delay] [every period], e.g. /water 30s in 2h every 1d",
+                )
+                return
+            # whole seconds, as they travel in the button data
+            request[key] = int(seconds)
+
+        error = check_request(
+            request.get("duration"),
+            request.get("delay"),
+            request.get("every"),
+            self.pump_max_duration()
+            if self.pump_max_duration is not None
+            else DEFAULT_MAX_DURATION_SECONDS,
+        )
+        if error is not None:
+            self.sender.send_message(message.chat.id, f"Invalid watering, {error}")
+            return
+
+        question = "Do you want to water the Bonsai"
+        if "duration" in request:
+            question += f" for {self._format_duration(request['duration'])}"
+        if "delay" in request:
+            question += f" in {self._format_duration(request['delay'])}"
+        if "every" in request:
+            question += f" every {self._format_duration(request['every'])}"
+
+        # the request travels in the button data, at most 64 bytes
+        data = ":".join(
+            str(request[key]) if key in request else ""
+            for key in ("duration", "delay", "every")
+        )
+
         # send confirmation message with two buttons
         markup = telebot.types.InlineKeyboardMarkup()
         markup.row(
-            telebot.types.InlineKeyboardButton("Yes", callback_data="water_yes"),
+            telebot.types.InlineKeyboardButton("Yes", callback_data=f"water_yes:{data}"),
             telebot.types.InlineKeyboardButton("No", callback_data="water_no"),
         )
-        self.bot.send_message(
+        self.sender.send_message(
             message.chat.id,
-            "Do you want to water the Bonsai?",
+            question + "?",
             reply_markup=markup,
         )
 
-    def _handle_callback_query(self, call):
-        if call.data == "water_yes":
-            if self.pump_queue.empty():
-                self.bot.send_message(call.message.chat.id, "I will water the Bonsai")
-                self.pump_queue.put(True)
+    def _handle_command_pump_jobs(self, message):
+        if not self._check_user(message):
+            return
+
+        # /pump_jobs [cancel id]
+        args = message.text.split()[1:]
+        if len(args) == 2 and args[0] == "cancel" and args[1].isdigit():
+            # PumpTask answers once it looked the job up
+            chat_id, job_id = message.chat.id, int(args[1])
+            self.pump_queue.put(
+                {
+                    "cancel": job_id,
+                    "reply": lambda cancelled: self.sender.send_message(
+                        chat_id,
+                        f"Job {job_id} cancelled"
+                        if cancelled
+                        else f"No pending job {job_id}",
+                    ),
+                }
+            )
+            return
+
+        jobs = self.pump_jobs() if self.pump_jobs is not None else []
+        if len(jobs) == 0:
+            self.sender.send_message(message.chat.id, "No watering scheduled")
+            return
+
+        lines = []
+        for job in jobs:
+            if "running_until" in job:
+                date, time = self._format_date(job["running_until"])
+                when = f"💧 running until {time}"
             else:
-                self.bot.send_message(
-                    call.message.chat.id, "I am already watering the Bonsai"
-                )
+                date, time = self._format_date(job["due"])
+                when = f"📅 {date}  🕓 {time}"
+
+            line = f"#{job['id']} {when} for {self._format_duration(job['duration'])}"
+            if job["every"] is not None:
+                line += f", every {self._format_duration(job['every'])}"
+            lines.append(line)
+
+        self.sender.send_message(message.chat.id, "\n".join(lines))
+
+    def _handle_callback_query(self, call):
+        # buttons can be forged like commands, only allowed users press them
+        if call.message is None or not self._check_user(call, call.message.chat.id):
+            return
+
+        if call.data.startswith("water_yes"):
+            # PumpTask queues the job and merges it with a close one
+            request = {"source": call.from_user.username}
+            values = call.data.split(":")[1:]
+            for key, value in zip(("duration", "delay", "every"), values):
+                if value != "":
+                    request[key] = int(value)
+
+            self.pump_queue.put(request)
+            self.sender.send_message(call.message.chat.id, "I will water the Bonsai")
         elif call.data == "water_no":
-            self.bot.send_message(
+            self.sender.send_message(
                 call.message.chat.id, "Ok, I will not water the Bonsai"
             )
         elif call.data == "remove_alarms_yes":
-            self.bot.send_message(
+            self.sender.send_message(
                 call.message.chat.id, "Ok, I will turn off all alarms"
             )
-            self.alarm_queue.queue.clear()
+            self.alarms.acknowledge()
         elif call.data == "remove_alarms_no":
-            self.bot.send_message(
+            self.sender.send_message(
                 call.message.chat.id, "Ok, I will not turn off all alarms"
             )
         else:
-            self.bot.send_message(call.message.chat.id, "Unknown command")
+            self.sender.send_message(call.message.chat.id, "Unknown command")
 
         # remove message with buttons
-        self.bot.delete_message(call.message.chat.id, call.message.message_id)
+        self.sender.delete_message(call.message.chat.id, call.message.message_id)
 
-    def _check_user(self, message):
+    def _check_user(self, message, chat_id=None):
+        # message or callback query, the chat of a callback is given apart
         user = message.from_user.username
+        chat_id = message.chat.id if chat_id is None else chat_id
 
         if user is None:
-            self.bot.send_message(
-                message.chat.id, "You need to set a username to use this bot"
+            self.sender.send_message(
+                chat_id, "You need to set a username to use this bot"
             )
             return False
 
         if user not in self.allowed_users.keys():
-            self.bot.send_message(
-                message.chat.id, "You are not allowed to use this bot"
-            )
+            self.sender.send_message(chat_id, "You are not allowed to use this bot")
             return False
 
-        self.allowed_users[user] = message.chat.id
+        self.allowed_users[user] = chat_id
         return True
 
     def _handle_command_start(self, message):
         if not self._check_user(message):
             return
 
-        self.bot.send_message(message.chat.id, "Welcome! I am monitoring your Bonsai")
+        self.sender.send_message(message.chat.id, "Welcome! I am monitoring your Bonsai")
 
     def _handle_command_telemetry(self, message):
         if not self._check_user(message):
             return
 
-        res = self.db.all()
+        # /telemetry [zone], the latest sample of every zone without a zone
+        args = message.text.split()[1:]
+        if len(args) > 0:
+            zone = self._select_zone(message.chat.id, args[0])
+            if zone is None:
+                return
+            zones = [zone]
+        else:
+            zones = self.telemetry.zones()
 
-        if len(res) == 0:
-            self.bot.send_message(message.chat.id, "No telemetry found \U0001F622")
-            return
+        found = False
+        for zone in zones:
+            res = self.telemetry.latest(zone)
+            if res is None:
+                continue
+            found = True
+
+            ts = res.time
+            dt = datetime.datetime.fromtimestamp(ts) + datetime.timedelta(hours=1)
+            date = dt.strftime("%d/%m/%Y")
+            time = dt.strftime("%H:%M:%S")
 
-        res = res[-1]
+            temperature = round(res.temperature, 2)
+            humidity = round(res.humidity, 2)
 
-        ts = res["time"]
+            # send latest telemetry
+            self.sender.send_message(
+                message.chat.id,
+                self._zone_header(zone)
+                + LATEST_TELEMETRY_MESSAGE.format(
+                    temperature=temperature, humidity=humidity, time=time, date=date
+                ),
+            )
+
+        if not found:
+            self.sender.send_message(message.chat.id, "No telemetry found \U0001F622")
+
+    def _alarm_message(self, template, alarm):
+        ts = alarm["resolved"] if alarm["resolved"] is not None else alarm["time"]
         dt = datetime.datetime.fromtimestamp(ts) + datetime.timedelta(hours=1)
         date = dt.strftime("%d/%m/%Y")
         time = dt.strftime("%H:%M:%S")
-        temperature = res["measures"]["temperature"]
-        humidity = res["measures"]["humidity"]
 
-        temperature = round(temperature, 2)
-        humidity = round(humidity, 2)
+        # silence alarms carry the last known measures, if any
+        measures = alarm["measures"] or {}
+        temperature = measures.get("temperature")
+        humidity = measures.get("humidity")
 
-        # send latest telemetry
-        self.bot.send_message(
-            message.chat.id,
-            LATEST_TELEMETRY_MESSAGE.format(
-                temperature=temperature, humidity=humidity, time=time, date=date
-            ),
+        temperature = round(temperature, 2) if temperature is not None else "-"
+        humidity = round(humidity, 2) if humidity is not None else "-"
+
+        return self._zone_header(alarm.get("zone", DEFAULT_ZONE)) + template.format(
+            title=alarm["title"],
+            temperature=temperature,
+            humidity=humidity,
+            time=time,
+            date=date,
         )
 
     def _scheduler_task(self):
-        if not self.alarm_queue.empty():
-            alarm = self.alarm_queue.queue[0]
-            logging.info(f"[{self._tag}]: sending alarm message")
-
-            ts = alarm["time"]
-            dt = datetime.datetime.fromtimestamp(ts) + datetime.timedelta(hours=1)
-            date = dt.strftime("%d/%m/%Y")
-            time = dt.strftime("%H:%M:%S")
-            temperature = alarm["measures"]["temperature"]
-            humidity = alarm["measures"]["humidity"]
-
-            temperature = round(temperature, 2)
-            humidity = round(humidity, 2)
+        # active alarms until acknowledged, resolutions once
+        messages = [
+            self._alarm_message(ALARM_MESSAGE, alarm)
+            for alarm in self.alarms.active(acknowledged=False)
+        ]
+        messages += [
+            self._alarm_message(ALARM_RESOLVED_MESSAGE, alarm)
+            for alarm in self.alarms.take_resolved()
+        ]
+
+        if len(messages) > 0:
+            logging.info(f"[{self._tag}]: sending {len(messages)} alarm messages")
 
             for chat_id in self.allowed_users.values():
                 if chat_id is None:
                     logging.warning(f"[{self._tag}]: no chat_id found, skipping")
                     continue
-                self.bot.send_message(
-                    chat_id,
-                    ALARM_MESSAGE.format(
-                        temperature=temperature, humidity=humidity, time=time, date=date
-                    ),
-                )
+                for text in messages:
+                    self.sender.send_message(chat_id, text)
 
         self.scheduler.enter(self.alarm_notification_period, 1, self._scheduler_task)
 
@@ -288,10 +849,53 @@ class BotTask:
             configs = json.load(f)
             section = self._tag.lower()
 
+            # the alarm thresholds are set with the sensors
+            sensor_configs = configs.get("sensor_task", {})
+            self.humidity_alarm_threshold = sensor_configs.get(
+                "humidity_alarm_threshold", self.humidity_alarm_threshold
+            )
+            for sensor in sensor_configs.get("sensors", []):
+                self.humidity_thresholds[sensor.get("zone", DEFAULT_ZONE)] = sensor.get(
+                    "humidity_alarm_threshold", self.humidity_alarm_threshold
+                )
+
             if section not in configs:
                 logging.warning(f"[{self._tag}]: no configs found, using defaults")
                 return
 
+            # optional settings
+            self.prerender_stats = configs[section].get(
+                "prerender_stats", self.prerender_stats
+            )
+            self.prerender_windows = [
+                window
+                for window in configs[section].get(
+                    "prerender_windows", self.prerender_windows
+                )
+                if window in STATS_WINDOWS
+            ]
+            self.stats_mode = configs[section].get("stats_mode", self.stats_mode)
+            if self.stats_mode not in STATS_MODES:
+                logging.warning(
+                    f"[{self._tag}]: unsupported stats_mode {self.stats_mode}, using {DEFAULT_STATS_MODE}"
+                )
+                self.stats_mode = DEFAULT_STATS_MODE
+            self.preferences_file = configs[section].get(
+                "preferences_file", self.preferences_file
+            )
+            self.plot_processes = configs[section].get(
+                "plot_processes", self.plot_processes
+            )
+            self.plot_max_pending = configs[section].get(
+                "plot_max_pending", self.plot_max_pending
+            )
+            self.plot_timeout_seconds = configs[section].get(
+                "plot_timeout_seconds", self.plot_timeout_seconds
+            )
+            self.sender_configs = configs[section].get("sender", self.sender_configs)
+            self.mode = configs[section].get("mode", self.mode)
+            self.webhook_configs = configs[section].get("webhook", self.webhook_configs)
+
             if "alarm_notification_period" not in configs[section]:
                 logging.warning(f"[{self._tag}]: no configs found, using defaults")
                 return
@@ -310,21 +914,97 @@ class BotTask:
                 f"[{self._tag}]: config loaded\n\talarm_notification_period: {self.alarm_notification_period}\n\tallowed_users: {self.allowed_users.keys()}"
             )
 
-    def run(self):
-        logging.info(f"[{self._tag}]: starting")
-        self._load_configs()
-
-        # creating a non blovking scheduler that will run _scheduler_task every 10 seconds in a separate thread
-        self.scheduler = sched.scheduler(time.time, time.sleep)
-        self.scheduler.enter(5, 1, self._scheduler_task)
-        scheduler_thread = threading.Thread(target=self.scheduler.run)
-        scheduler_thread.start()
-
-        while True:
+    def _run_polling(self, stop_event):
+        while not stop_event.is_set():
             try:
                 self.bot.polling()
             except Exception as e:
-                print(e)
-                logging.error(f"[{self._tag}]: error polling, retrying in 5 seconds")
-                time.sleep(5)
-                continue
+                logging.error(
+                    f"[{self._tag}]: error polling, retrying in 5 seconds: {e}"
+                )
+                stop_event.wait(5)
+
+    def _run_webhook(self, stop_event):
+        # the HTTP listener is only loaded in webhook mode
+        from message_utils.bot_webhook import WebhookServer
+
+        configs = dict(self.webhook_configs)
+        url = configs.pop("url", None)
+
+        self.webhook_server = WebhookServer(self.bot, **configs)
+        self.webhook_server.start()
+
+        try:
+            # tell Telegram where to post the updates
+            if url is not None:
+                self.bot.remove_webhook()
+                self.bot.set_webhook(
+                    url=url, secret_token=configs.get("secret_token")
+                )
+
+            stop_event.wait()
+        finally:
+            self.webhook_server.stop()
+
+    def _heartbeat_task(self):
+        self.heartbeat(2 * HEARTBEAT_PERIOD)
+        # heartbeats are promised in real seconds, whatever the clock speed
+        self.scheduler.enter(
+            HEARTBEAT_PERIOD * self.clock.speed, 2, self._heartbeat_task
+        )
+
+    def stop(self):
+        self.bot.stop_polling()
+
+    def run(self, stop_event=None, heartbeat=None):
+        logging.info(f"[{self._tag}]: starting")
+        stop_event = stop_event or threading.Event()
+        self.heartbeat = heartbeat or (lambda timeout=None: None)
+
+        self._load_configs()
+        self._load_preferences()
+
+        # the helpers are stopped with this run, also when it fails, a
+        # restarted task starts its own
+        run_stop = threading.Event()
+        self.sender = MessageSender(self.bot, **self.sender_configs)
+        self.sender.start()
+        self.plot_pool = None
+        self._stats_executor = None
+
+        try:
+            self.plot_pool = PlotWorkerPool(
+                self.plot_processes, self.plot_max_pending, self.plot_timeout_seconds
+            )
+            self._stats_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.plot_max_pending
+            )
+            self._stats_slots = threading.BoundedSemaphore(self.plot_max_pending)
+
+            # scheduler running _scheduler_task every alarm_notification_period in a separate thread
+            self.scheduler = stoppable_scheduler(run_stop, self.clock)
+            self.scheduler.enter(5, 1, self._scheduler_task)
+            self.scheduler.enter(0, 2, self._heartbeat_task)
+            scheduler_thread = threading.Thread(target=self.scheduler.run, daemon=True)
+            scheduler_thread.start()
+
+            if self.prerender_stats:
+                # render /stats charts in background after each commit
+                prerender_thread = threading.Thread(
+                    target=self._prerender_task, args=(run_stop,), daemon=True
+                )
+                prerender_thread.start()
+
+            if self.mode == "webhook":
+                self._run_webhook(stop_event)
+            else:
+                self._run_polling(stop_event)
+        finally:
+            run_stop.set()
+            if self._stats_executor is not None:
+                self._stats_executor.shutdown(wait=False)
+            if self.plot_pool is not None:
+                self.plot_pool.shutdown()
+            self.sender.stop()
+
+        logging.info(f"[{self._tag}]: stopped")
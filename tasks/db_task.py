@@ -1,12 +1,34 @@
 import logging
+import os
+import queue
+import threading
 
 import time
-from tinydb import TinyDB
 from db_utils.db_message import DBAction
+from db_utils.db_storage import load_configs
+from db_utils.db_zones import load_telemetry
+from metrics_utils.metrics_registry import REGISTRY
 
 logging.basicConfig(level=logging.INFO)
 
-DB_FILE = "telemetry.json"
+FSYNC_POLICIES = ["always", "interval", "never"]
+# longest time the task blocks on its queue without a heartbeat
+HEARTBEAT_PERIOD = 30
+
+COMMIT_SECONDS = REGISTRY.histogram(
+    "inaffio_db_commit_seconds", "Duration of the DBTask batch commits"
+)
+COMMITTED_RECORDS = REGISTRY.counter(
+    "inaffio_db_committed_records_total", "Telemetry records committed by DBTask"
+)
+COMPACTED_RECORDS = REGISTRY.counter(
+    "inaffio_db_compacted_records_total", "Records dropped by the retention"
+)
+FILE_BYTES = REGISTRY.gauge("inaffio_db_file_bytes", "Size of the telemetry files")
+DEAD_RATIO = REGISTRY.gauge(
+    "inaffio_db_dead_ratio", "Share of the records of a file past the retention"
+)
+
 
 class DBTask:
     def __init__(self, db_queue):
@@ -14,31 +36,222 @@ class DBTask:
 
         self.db_queue = db_queue
 
+        # raw storage and rollup tiers of every zone, the storage backend is
+        # selected in configs.json (db_task.backend)
+        self.telemetry = load_telemetry()
+
+        # default configs
+        # will be overwritten by configs.json if exists
+        self.batch_size = 100
+        self.batch_window_seconds = 0
+        self.fsync = "interval"
+        self.fsync_interval_seconds = 60
+        # retention is enforced in background, see db_task.retention
+        self.compaction_interval_seconds = 60 * 60
+        self.compaction_min_dead_ratio = 0.1
+        # size and live/dead records of every file, by zone
+        self.storage_stats = {}
+
+        self._last_fsync = time.monotonic()
+        self._pending = []
+
+        # callables notified with the records of each commit
+        self._subscribers = []
 
-        self.db = TinyDB(DB_FILE)
+        # group commit counters, useful to tune batch size and window
+        self.counters = {
+            "batches": 0,
+            "records": 0,
+            "last_batch_size": 0,
+            "max_batch_size": 0,
+            "last_commit_seconds": 0.0,
+            "max_commit_seconds": 0.0,
+            "queue_depth": 0,
+            "max_queue_depth": 0,
+            "compacted_records": 0,
+        }
 
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
 
-    def _handle_add(self, payload):
-        self.db.insert(payload)
-        
-    def _handle_clean(self):
+    def _handle_add(self, record):
+        # buffered until the batch is committed
+        self._pending.append(record)
+
+    def _handle_clean(self, zone=None):
         logging.info(f"[{self._tag}]: cleaning db")
-        # remove all data from db
-        self.db.purge()
+        # remove all data of the zone, or of every zone
+        self.telemetry.purge(zone)
+
+    def _commit(self):
+        if len(self._pending) == 0:
+            return
+
+        start = time.monotonic()
+
+        sync = self.fsync == "always" or (
+            self.fsync == "interval"
+            and start - self._last_fsync >= self.fsync_interval_seconds
+        )
+        if sync:
+            self._last_fsync = start
+
+        self.telemetry.insert_many(self._pending, sync)
+
+        elapsed = time.monotonic() - start
+        committed = self._pending
+        size = len(committed)
+        self._pending = []
+
+        COMMIT_SECONDS.observe(elapsed)
+        COMMITTED_RECORDS.inc(size)
+
+        self.counters["batches"] += 1
+        self.counters["records"] += size
+        self.counters["last_batch_size"] = size
+        self.counters["max_batch_size"] = max(self.counters["max_batch_size"], size)
+        self.counters["last_commit_seconds"] = elapsed
+        self.counters["max_commit_seconds"] = max(
+            self.counters["max_commit_seconds"], elapsed
+        )
+
+        logging.debug(
+            f"[{self._tag}]: committed {size} records in {elapsed * 1000:.1f} ms"
+        )
+
+        for callback in self._subscribers:
+            try:
+                callback(committed)
+            except Exception as e:
+                logging.error(f"[{self._tag}]: subscriber error: {e}")
+
+    def _compact(self, stop_event):
+        start = time.monotonic()
+        dropped = self.telemetry.compact(self.compaction_min_dead_ratio, stop_event)
+        self.counters["compacted_records"] += dropped
+        COMPACTED_RECORDS.inc(dropped)
+
+        self.storage_stats = self.telemetry.stats()
+        for zone, files in self.storage_stats.items():
+            for stats in files:
+                name = os.path.basename(stats["path"])
+                FILE_BYTES.set(stats["bytes"], zone=zone, file=name)
+                DEAD_RATIO.set(round(stats["dead_ratio"], 4), zone=zone, file=name)
+                logging.info(
+                    f"[{self._tag}]: {name}: {stats['bytes']} bytes, {stats['records']} records, {stats['dead_ratio']:.1%} dead"
+                )
 
-    def run(self):
+        logging.info(
+            f"[{self._tag}]: compaction dropped {dropped} records in {time.monotonic() - start:.2f} seconds"
+        )
+
+    def _compaction_task(self, stop_event):
+        # enforces the retention without holding up the commits
+        while not stop_event.is_set():
+            try:
+                self._compact(stop_event)
+            except Exception as e:
+                logging.error(f"[{self._tag}]: compaction error: {e}")
+
+            stop_event.wait(self.compaction_interval_seconds)
+
+    def _next_batch(self):
+        # block until something arrives, then drain up to batch_size messages
+        # or until batch_window_seconds have passed
+        try:
+            batch = [self.db_queue.get(timeout=HEARTBEAT_PERIOD)]
+        except queue.Empty:
+            return []
+
+        deadline = time.monotonic() + self.batch_window_seconds
+
+        while len(batch) < self.batch_size:
+            try:
+                timeout = deadline - time.monotonic()
+                if timeout > 0:
+                    batch.append(self.db_queue.get(timeout=timeout))
+                else:
+                    batch.append(self.db_queue.get_nowait())
+            except queue.Empty:
+                break
+
+        depth = self.db_queue.qsize()
+        self.counters["queue_depth"] = depth
+        self.counters["max_queue_depth"] = max(self.counters["max_queue_depth"], depth)
+
+        return batch
+
+    def _load_configs(self):
+        configs = load_configs()
+
+        self.batch_size = configs.get("batch_size", self.batch_size)
+        self.batch_window_seconds = configs.get(
+            "batch_window_seconds", self.batch_window_seconds
+        )
+        self.fsync = configs.get("fsync", self.fsync)
+        self.fsync_interval_seconds = configs.get(
+            "fsync_interval_seconds", self.fsync_interval_seconds
+        )
+        self.compaction_interval_seconds = configs.get(
+            "compaction_interval_seconds", self.compaction_interval_seconds
+        )
+        self.compaction_min_dead_ratio = configs.get(
+            "compaction_min_dead_ratio", self.compaction_min_dead_ratio
+        )
+
+        if self.fsync not in FSYNC_POLICIES:
+            logging.warning(
+                f"[{self._tag}]: unknown fsync policy {self.fsync}, using interval"
+            )
+            self.fsync = "interval"
+
+        logging.info(
+            f"[{self._tag}]: config loaded\n\tbatch_size: {self.batch_size}\n\tbatch_window_seconds: {self.batch_window_seconds}\n\tfsync: {self.fsync}\n\tfsync_interval_seconds: {self.fsync_interval_seconds}"
+        )
+
+    def stop(self):
+        # wake up the blocking get in run
+        self.db_queue.put(None)
+
+    def _consume(self, stop_event, heartbeat):
+        while not stop_event.is_set():
+            heartbeat(2 * HEARTBEAT_PERIOD)
+
+            for message in self._next_batch():
+                if message is None:
+                    continue
+                elif message.action == DBAction.ADD:
+                    self._handle_add(message.payload)
+                elif message.action == DBAction.CLEAN:
+                    # samples queued before the clean are stored first, the
+                    # clean then drops them with the rest of the zone
+                    self._commit()
+                    self._handle_clean(
+                        message.payload.get("zone") if message.payload else None
+                    )
+                else:
+                    logging.error(f"[{self._tag}]: unknown action {message.action}")
+
+            self._commit()
+
+    def run(self, stop_event=None, heartbeat=None):
         logging.info(f"[{self._tag}]: started")
+        stop_event = stop_event or threading.Event()
+        heartbeat = heartbeat or (lambda timeout=None: None)
+
+        self._load_configs()
+        self.telemetry.rebuild()
 
-        while True:
-            if self.db_queue.empty():
-                time.sleep(1)
-                continue
+        # stopped with this run, a restarted task starts its own
+        compaction_stop = threading.Event()
+        compaction_thread = threading.Thread(
+            target=self._compaction_task, args=(compaction_stop,), daemon=True
+        )
+        compaction_thread.start()
 
-            message = self.db_queue.get()
+        try:
+            self._consume(stop_event, heartbeat)
+        finally:
+            compaction_stop.set()
 
-            if message.action == DBAction.ADD:
-                self._handle_add(message.payload)
-            elif message.action == DBAction.CLEAN:
-                self._handle_clean()
-            else:
-                logging.error(f"[{self._tag}]: unknown action {message.action}")
\ No newline at end of file
+        logging.info(f"[{self._tag}]: stopped")
@@ -0,0 +1,242 @@
+import json
+import logging
+import socket
+import threading
+import time
+import urllib.error
+
+from db_utils.db_storage import ZONE_PATTERN
+from fleet_utils.fleet_outbox import FleetOutbox
+from fleet_utils.fleet_protocol import encode_batch, node_name, post_batch
+from metrics_utils.metrics_registry import REGISTRY
+
+logging.basicConfig(level=logging.INFO)
+CONFIG_FILE = "configs.json"
+# longest time the task waits without a heartbeat
+HEARTBEAT_PERIOD = 30
+
+FORWARDED_RECORDS = REGISTRY.counter(
+    "inaffio_forwarder_records_total", "Records acknowledged by the collector"
+)
+FORWARD_FAILURES = REGISTRY.counter(
+    "inaffio_forwarder_failures_total", "Batches the collector did not acknowledge"
+)
+UPLINK_SECONDS = REGISTRY.histogram(
+    "inaffio_forwarder_uplink_seconds", "Time to send a batch to the collector"
+)
+DROPPED_RECORDS = REGISTRY.counter(
+    "inaffio_forwarder_dropped_records_total",
+    "Records dropped while too many were waiting to be batched",
+)
+OUTBOX_BYTES = REGISTRY.gauge(
+    "inaffio_forwarder_outbox_bytes", "Batches waiting for the collector"
+)
+
+
+class ForwarderTask:
+    """Ships the committed telemetry to a fleet collector.
+
+    DBTask hands over the records of every commit; they are batched, up to
+    batch_size records or batch_seconds, compressed and written to the
+    outbox, then sent oldest first. Batches stay in the outbox until the
+    collector acknowledges them, so nothing is lost while it is unreachable
+    (up to max_outbox_bytes), retries back off up to max_retry_seconds.
+    """
+
+    def __init__(self):
+        self._tag = "FORWARDER_TASK"
+
+        # default configs
+        # will be overwritten by configs.json if exists
+        self.url = None
+        # the collector refuses names other than letters, digits, _ and -
+        self.node = node_name(socket.gethostname())
+        self.token = None
+        self.batch_size = 500
+        self.batch_seconds = 60
+        self.outbox_dir = "outbox"
+        self.max_outbox_bytes = 16 * 1024 * 1024
+        self.compression_level = 6
+        self.timeout_seconds = 10
+        self.min_retry_seconds = 5
+        self.max_retry_seconds = 600
+        # records waiting to be batched, e.g. while the task is restarting
+        self.max_pending_records = 50000
+
+        self.outbox = None
+        # records committed since the last batch
+        self._records = []
+        self._first_record = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+        self._retry_seconds = 0
+        self._retry_at = 0
+
+    def on_telemetry(self, records):
+        # called by DBTask after each commit, the batch is built in run
+        with self._lock:
+            if len(self._records) == 0:
+                self._first_record = time.monotonic()
+
+            room = max(0, self.max_pending_records - len(self._records))
+            dropped = max(0, len(records) - room)
+            if dropped > 0:
+                records = records[:room]
+            self._records.extend(records)
+            full = len(self._records) >= self.batch_size
+
+        if dropped > 0:
+            DROPPED_RECORDS.inc(dropped)
+            logging.warning(
+                f"[{self._tag}]: {self.max_pending_records} records waiting, {dropped} dropped"
+            )
+        if full:
+            self._wakeup.set()
+
+    def _seal(self, force=False):
+        # the waiting records become a batch in the outbox
+        with self._lock:
+            if len(self._records) == 0:
+                return
+            if (
+                not force
+                and len(self._records) < self.batch_size
+                and time.monotonic() - self._first_record < self.batch_seconds
+            ):
+                return
+            records = self._records
+            self._records = []
+
+        seq = self.outbox.next_seq()
+        self.outbox.put(seq, encode_batch(self.node, seq, records, self.compression_level))
+        logging.debug(f"[{self._tag}]: batch {seq}, {len(records)} records")
+
+    def _send(self, stop_event, heartbeat):
+        # sends the outbox until it is empty or the collector fails
+        while not stop_event.is_set() and time.monotonic() >= self._retry_at:
+            heartbeat(2 * HEARTBEAT_PERIOD + self.timeout_seconds)
+            batch = self.outbox.peek()
+            if batch is None:
+                return
+
+            seq, data = batch
+            try:
+                with UPLINK_SECONDS.time():
+                    answer = json.loads(
+                        post_batch(self.url, data, self.token, self.timeout_seconds)
+                    )
+            except urllib.error.HTTPError as e:
+                FORWARD_FAILURES.inc()
+                if e.code in (400, 413):
+                    # the collector will never accept it
+                    logging.error(f"[{self._tag}]: batch {seq} refused ({e.code}), dropped")
+                    self.outbox.remove(seq)
+                    continue
+                self._backoff(f"collector answered {e.code}")
+                return
+            except (OSError, ValueError) as e:
+                FORWARD_FAILURES.inc()
+                self._backoff(e)
+                return
+
+            self.outbox.remove(seq)
+            FORWARDED_RECORDS.inc(answer.get("stored", 0))
+            self._retry_seconds = 0
+
+    def _backoff(self, reason):
+        self._retry_seconds = min(
+            max(self.min_retry_seconds, 2 * self._retry_seconds), self.max_retry_seconds
+        )
+        self._retry_at = time.monotonic() + self._retry_seconds
+        logging.warning(
+            f"[{self._tag}]: {reason}, {len(self.outbox)} batches waiting, retrying in {self._retry_seconds}s"
+        )
+
+    def _load_configs(self):
+        with open(CONFIG_FILE, "r") as f:
+            configs = json.load(f)
+            section = self._tag.lower()
+
+            if section not in configs or "url" not in configs[section]:
+                logging.warning(f"[{self._tag}]: no configs found")
+                return
+
+            self.url = configs[section]["url"]
+
+            # optional settings
+            self.node = configs[section].get("node", self.node)
+            self.token = configs[section].get("token", self.token)
+            self.batch_size = configs[section].get("batch_size", self.batch_size)
+            self.batch_seconds = configs[section].get("batch_seconds", self.batch_seconds)
+            self.outbox_dir = configs[section].get("outbox_dir", self.outbox_dir)
+            self.max_outbox_bytes = configs[section].get(
+                "max_outbox_bytes", self.max_outbox_bytes
+            )
+            self.compression_level = configs[section].get(
+                "compression_level", self.compression_level
+            )
+            self.timeout_seconds = configs[section].get(
+                "timeout_seconds", self.timeout_seconds
+            )
+            self.min_retry_seconds = configs[section].get(
+                "min_retry_seconds", self.min_retry_seconds
+            )
+            self.max_retry_seconds = configs[section].get(
+                "max_retry_seconds", self.max_retry_seconds
+            )
+            self.max_pending_records = configs[section].get(
+                "max_pending_records", self.max_pending_records
+            )
+
+            if not ZONE_PATTERN.match(self.node):
+                # every batch would be refused and dropped
+                raise ValueError(
+                    f"forwarder_task.node {self.node!r} may only hold letters, digits, _ and -"
+                )
+
+            logging.info(
+                f"[{self._tag}]: config loaded\n\turl: {self.url}\n\tnode: {self.node}\n\tbatch_size: {self.batch_size}\n\tbatch_seconds: {self.batch_seconds}"
+            )
+
+    def stop(self):
+        self._wakeup.set()
+
+    def run(self, stop_event=None, heartbeat=None):
+        logging.info(f"[{self._tag}]: started")
+        stop_event = stop_event or threading.Event()
+        heartbeat = heartbeat or (lambda timeout=None: None)
+
+        self._load_configs()
+        if self.url is None:
+            # restarted by the runtime, configs.json is read again
+            raise ValueError("forwarder_task.url missing in configs.json")
+
+        if self.outbox is None:
+            self.outbox = FleetOutbox(self.outbox_dir, self.max_outbox_bytes)
+            OUTBOX_BYTES.set_function(self.outbox.bytes)
+        self._retry_at = 0
+
+        try:
+            while not stop_event.is_set():
+                heartbeat(2 * HEARTBEAT_PERIOD + self.timeout_seconds)
+
+                self._seal()
+                self._send(stop_event, heartbeat)
+
+                # woken up by a full batch, otherwise when the waiting
+                # records are due or the next retry
+                now = time.monotonic()
+                timeout = HEARTBEAT_PERIOD
+                with self._lock:
+                    if len(self._records) > 0:
+                        timeout = min(timeout, self._first_record + self.batch_seconds - now)
+                if len(self.outbox) > 0:
+                    timeout = min(timeout, self._retry_at - now)
+                self._wakeup.wait(max(0, timeout))
+                self._wakeup.clear()
+        finally:
+            # the records not batched yet wait in the outbox
+            self._seal(force=True)
+
+        logging.info(f"[{self._tag}]: stopped")
@@ -1,42 +1,135 @@
 import logging
 import json
+import queue
+import threading
 import time
 
-from RPi import GPIO
+from metrics_utils.metrics_registry import REGISTRY
+from pump_utils.pump_scheduler import (
+    DEFAULT_MAX_DURATION_SECONDS,
+    PumpScheduler,
+    check_request,
+)
+from task_utils.task_clock import SystemClock
 
 logging.basicConfig(level=logging.INFO)
 CONFIG_FILE = "configs.json"
+# longest time the task blocks on its queue without a heartbeat
+HEARTBEAT_PERIOD = 30
+
+PUMP_ON_SECONDS = REGISTRY.counter(
+    "inaffio_pump_on_seconds_total", "Time the pump has been running"
+)
+PUMP_RUNS = REGISTRY.counter("inaffio_pump_runs_total", "Pump activations")
+PUMP_START_SECONDS = REGISTRY.histogram(
+    "inaffio_pump_start_seconds",
+    "Time from a watering request to the pump switching on",
+)
 
 class PumpTask:
-    def __init__(self, pump_quque, alarm_queue):
+    def __init__(self, pump_quque, alarms, clock=None, gpio=None):
         self._tag = "PUMP_TASK"
         self.pump_quque = pump_quque
-        self.alarm_queue = alarm_queue
+        self.alarms = alarms
+
+        # RPi.GPIO unless a simulated pump is given
+        self.clock = clock or SystemClock()
+        if gpio is None:
+            from RPi import GPIO as gpio
+        self.gpio = gpio
 
         self.activity_seconds = 0
         self.gpio_pin = None
 
-    def _water(self):
+        # watering jobs, the pump is switched from the task loop
+        self.max_duty_cycle = 0.1
+        self.max_duration_seconds = DEFAULT_MAX_DURATION_SECONDS
+        self.duty_window_seconds = 3600
+        self.merge_seconds = 60
+        self.job_configs = []
+        # (delay, duration, every) of the checked job_configs
+        self._config_jobs = []
+        self.scheduler = None
+        # perf_counter of the requests waiting for the pump, by job id
+        self._requested = {}
+
+    def _switch_on(self, job):
+        if job.id in self._requested:
+            PUMP_START_SECONDS.observe(time.perf_counter() - self._requested.pop(job.id))
+
         if self.gpio_pin is None:
             return
 
         try:
-            logging.info(f"[{self._tag}]: activating pump")
-            GPIO.output(self.gpio_pin, GPIO.HIGH)
-            time.sleep(self.activity_seconds)
-            GPIO.output(self.gpio_pin, GPIO.LOW)
-            logging.info(f"[{self._tag}]: deativating pump")
-            # clear all messages in alarm queue
-            while not self.alarm_queue.empty():
-                self.alarm_queue.get()
-            logging.info(f"[{self._tag}]: alarms cleared")
+            logging.info(f"[{self._tag}]: activating pump, job {job.id}")
+            self.gpio.output(self.gpio_pin, self.gpio.HIGH)
         except Exception as e:
             logging.error(f"[{self._tag}]: error while activating pump: {e}")
             # set GPIO to default state
-            GPIO.output(self.gpio_pin, GPIO.LOW)
+            self.gpio.output(self.gpio_pin, self.gpio.LOW)
+
+    def _switch_off(self, job, seconds):
+        if self.gpio_pin is None:
+            return
+
+        try:
+            self.gpio.output(self.gpio_pin, self.gpio.LOW)
+            PUMP_RUNS.inc()
+            PUMP_ON_SECONDS.inc(seconds)
+            logging.info(f"[{self._tag}]: deativating pump, job {job.id}")
+            # the plant was watered, stop notifying the active alarms
+            count = self.alarms.acknowledge()
+            logging.info(f"[{self._tag}]: {count} alarms acknowledged")
+        except Exception as e:
+            logging.error(f"[{self._tag}]: error while deactivating pump: {e}")
+
+    def _submit(self, request):
+        # True (a plain /water) or a dict with the optional duration, delay
+        # and period of the watering, in seconds
+        if request is True:
+            request = {}
+
+        if "cancel" in request:
+            # reply(cancelled) tells the requester whether the job was pending
+            cancelled = self.scheduler.cancel(request["cancel"])
+            if request.get("reply") is not None:
+                request["reply"](cancelled)
+            return
+
+        # the bot checks the requests too, but button data can be forged
+        duration = request.get("duration") or self.activity_seconds
+        error = check_request(
+            duration, request.get("delay"), request.get("every"), self.max_duration_seconds
+        )
+        if error is not None:
+            raise ValueError(error)
+
+        job, merged = self.scheduler.submit(
+            self.clock.time() + request.get("delay", 0),
+            duration,
+            request.get("every"),
+            request.get("source"),
+        )
+        if not merged and request.get("delay", 0) == 0:
+            self._requested[job.id] = time.perf_counter()
+
+    def jobs(self):
+        # running and pending watering jobs, read by the bot
+        return self.scheduler.jobs() if self.scheduler is not None else []
 
 
 
+    def _config_job(self, job):
+        # (delay, duration, every) of a jobs entry, every is None for one-shots
+        delay = job.get("delay_seconds")
+        duration = job.get("duration_seconds", self.activity_seconds)
+        every = job.get("every_seconds")
+
+        error = check_request(duration, delay, every, self.max_duration_seconds)
+        if error is not None:
+            raise ValueError(f"invalid pump_task job {job}: {error}")
+        return delay or 0, duration, every
+
     def _load_configs(self):
         with open(CONFIG_FILE, "r") as f:
             configs = json.load(f)
@@ -57,29 +150,95 @@ class PumpTask:
             self.activity_seconds = configs[section]["activity_seconds"]
             self.gpio_pin = configs[section]["gpio_pin"]
 
+            # optional settings
+            self.max_duty_cycle = configs[section].get(
+                "max_duty_cycle", self.max_duty_cycle
+            )
+            self.duty_window_seconds = configs[section].get(
+                "duty_window_seconds", self.duty_window_seconds
+            )
+            self.merge_seconds = configs[section].get("merge_seconds", self.merge_seconds)
+            self.max_duration_seconds = configs[section].get(
+                "max_duration_seconds", self.max_duration_seconds
+            )
+            self.job_configs = configs[section].get("jobs", self.job_configs)
+            self._config_jobs = [self._config_job(job) for job in self.job_configs]
+
             if self.gpio_pin is not None:
-                GPIO.setmode(GPIO.BOARD)
-                GPIO.setup(self.gpio_pin, GPIO.OUT, initial=GPIO.LOW)
+                self.gpio.setmode(self.gpio.BOARD)
+                self.gpio.setup(self.gpio_pin, self.gpio.OUT, initial=self.gpio.LOW)
 
 
             logging.info(
-                f"[{self._tag}]: config loaded\n\tactivity_seconds: {self.activity_seconds}\n\tgpio_pin: {self.gpio_pin}"
+                f"[{self._tag}]: config loaded\n\tactivity_seconds: {self.activity_seconds}\n\tgpio_pin: {self.gpio_pin}\n\tmax_duty_cycle: {self.max_duty_cycle}\n\tjobs: {len(self.job_configs)}"
             )
 
-    def run(self):
+    def stop(self):
+        # wake up the blocking get in run, a queued request wakes it anyway
+        try:
+            self.pump_quque.put_nowait(None)
+        except queue.Full:
+            pass
+
+    def run(self, stop_event=None, heartbeat=None):
+        stop_event = stop_event or threading.Event()
+        heartbeat = heartbeat or (lambda timeout=None: None)
+
         try:
             logging.info(f"[{self._tag}]: started")
             self._load_configs()
 
-            while True:
-                if self.pump_quque.empty():
-                    time.sleep(1)
-                    continue
-
-                if not self.pump_quque.empty():
-                    self._water()
-                    self.pump_quque.get()
+            # kept across restarts of the task, with its pending jobs; set
+            # once all the config jobs are scheduled
+            if self.scheduler is None:
+                scheduler = PumpScheduler(
+                    self._switch_on,
+                    self._switch_off,
+                    self.max_duty_cycle,
+                    self.duty_window_seconds,
+                    self.merge_seconds,
+                )
+                for delay, duration, every in self._config_jobs:
+                    scheduler.submit(
+                        self.clock.time() + delay, duration, every, "configs"
+                    )
+                self.scheduler = scheduler
+
+            while not stop_event.is_set():
+                heartbeat(2 * HEARTBEAT_PERIOD)
+
+                # requests are taken as soon as they arrive, otherwise the
+                # task wakes up for the next switch of the pump
+                timeout = HEARTBEAT_PERIOD
+                next_event = self.scheduler.next_event()
+                if next_event is not None:
+                    timeout = min(
+                        timeout, max(0, next_event - self.clock.time()) / self.clock.speed
+                    )
+
+                try:
+                    request = self.pump_quque.get(timeout=timeout)
+                except queue.Empty:
+                    request = None
+                else:
+                    try:
+                        if request is not None:
+                            self._submit(request)
+                    except Exception as e:
+                        logging.error(f"[{self._tag}]: invalid pump request {request}: {e}")
+                    finally:
+                        self.pump_quque.task_done()
+
+                self.scheduler.run_pending(self.clock.time())
         except Exception as e:
-                GPIO.setup(self.gpio_pin, GPIO.OUT, initial=GPIO.LOW)
-        
-        GPIO.cleanup()
\ No newline at end of file
+            logging.error(f"[{self._tag}]: {e}")
+            # leave the pump off, the runtime restarts the task
+            if self.gpio_pin is not None:
+                self.gpio.setup(self.gpio_pin, self.gpio.OUT, initial=self.gpio.LOW)
+        finally:
+            if self.scheduler is not None:
+                self.scheduler.stop(self.clock.time())
+
+        # only the pump pin is released, and only once the runtime stops
+        if stop_event.is_set() and self.gpio_pin is not None:
+            self.gpio.cleanup(self.gpio_pin)
@@ -1,59 +1,148 @@
-import datetime
 import json
-import sched
-import smbus
+import threading
 import time
 import logging
 
+from alarm_utils.alarm_rules import AlarmEngine, ThresholdRule, build_rule
 from db_utils.db_message import DBMessage, DBAction
+from db_utils.db_record import DEFAULT_ZONE, TelemetryRecord
+from metrics_utils.metrics_registry import REGISTRY
+from sensor_utils.adaptive_sampling import AdaptiveInterval, Deadband
+from sensor_utils.filters import MeasurementFilter
+from sensor_utils.sht3x import (
+    DEFAULT_ADDRESS,
+    MEASUREMENT_DELAY,
+    PERIODIC_COMMANDS,
+    SHT3x,
+    SHT3xCRCError,
+)
+from task_utils.task_clock import SystemClock
+from task_utils.task_runtime import stoppable_scheduler
 
 logging.basicConfig(level=logging.INFO)
 
 CONFIG_FILE = "configs.json"
+DEFAULT_BUS = 1
+
+READ_SECONDS = REGISTRY.histogram(
+    "inaffio_sensor_read_seconds", "Duration of the I2C reads of the sensors"
+)
+READ_FAILURES = REGISTRY.counter(
+    "inaffio_sensor_read_failures_total",
+    "Failed sensor reads by reason (io, crc, outlier)",
+)
+SAMPLES_SKIPPED = REGISTRY.counter(
+    "inaffio_sensor_samples_skipped_total",
+    "Samples not stored, within the deadband of the last stored one",
+)
+SAMPLE_INTERVAL = REGISTRY.gauge(
+    "inaffio_sensor_interval_seconds", "Current sampling interval of the zones"
+)
+
+
+class ZoneSensor:
+    # one sensor and its filter, sampled on its own schedule
+    def __init__(
+        self,
+        zone,
+        sensor,
+        sample_rate_seconds,
+        alarm_rules,
+        filter_configs,
+        sampler=None,
+        deadband=None,
+    ):
+        self.zone = zone
+        self.sensor = sensor
+        self.sample_rate_seconds = sample_rate_seconds
+        self.alarm_rules = alarm_rules
+        self.filter = MeasurementFilter(**filter_configs)
+        # fixed rate and every sample stored when None
+        self.sampler = sampler
+        self.deadband = deadband
+        # the next sampling, rescheduled when the interval changes
+        self.next_event = None
+
+    @property
+    def interval(self):
+        if self.sampler is None:
+            return self.sample_rate_seconds
+        return self.sampler.interval
+
+    @property
+    def max_interval(self):
+        if self.sampler is None:
+            return self.sample_rate_seconds
+        return self.sampler.max_seconds
 
 
 class SensorTask:
-    def __init__(self, alarm_queue, db_queue):
+    def __init__(self, alarms, db_queue, clock=None, bus_factory=None):
         self._tag = "SENSOR_TASK"
-        self.alarm_queue = alarm_queue
+        # every sample goes through the alarm rules, alarms end up in the store
+        self.alarms = alarms
+        self.alarm_engine = AlarmEngine(alarms)
         self.db_queue = db_queue
-        self.bus = smbus.SMBus(1)
+
+        # the clock stamps and schedules the samples, buses are opened with
+        # bus_factory(bus), both are replaced when simulating
+        self.clock = clock or SystemClock()
+        if bus_factory is None:
+            import smbus
+
+            bus_factory = smbus.SMBus
+        self.bus_factory = bus_factory
 
         # default configs
         # will be overwritten by configs.json if exists
         self.sample_rate_seconds = 60
         self.humidity_alarm_threshold = 5
+        # rules of every zone, a humidity threshold when not configured
+        self.alarm_rule_configs = None
+        # "single_shot" or "periodic" acquisition
+        self.acquisition = "single_shot"
+        self.periodic_mps = 1
+        self.repeatability = "high"
+        # "filtered" samples or "raw" (CRC checked) readings
+        self.output = "filtered"
+        self.filter_configs = {}
+        # adaptive sampling interval and deadband storage, off when None
+        self.adaptive_configs = None
+        self.deadband_configs = None
+        # one entry per zone, a single sensor on bus 1 when not configured
+        self.sensor_configs = [{"zone": DEFAULT_ZONE}]
 
-    def _read_measurement(self) -> (float, float):
-        # import random
-        # return random.randint(0, 100), random.randint(0, 100)
-
-        try:
-            self.bus.write_i2c_block_data(0x44, 0x2C, [0x06])
-
-            time.sleep(0.5)
-
-            # Read data from sensor
-            data = self.bus.read_i2c_block_data(0x44, 0x00, 6)
+        # SMBus handles shared by the sensors of the same bus
+        self.buses = {}
+        self.sensors = []
 
-            c_temp = ((((data[0] * 256.0) + data[1]) * 175) / 65535.0) - 45
-            humidity = 100 * (data[3] * 256 + data[4]) / 65535.0
+        self.heartbeat = lambda timeout=None: None
+        # each zone promises its next successful read by its own deadline
+        self._deadlines = {}
+        self._deadlines_lock = threading.Lock()
 
-            if humidity <= self.humidity_alarm_threshold:
-                logging.info(f"[{self._tag}]: humidity alarm triggered")
-                if self.alarm_queue.empty():
-                    self.alarm_queue.put(
-                        {
-                            "time": datetime.datetime.now().timestamp(),
-                            "measures": {"temperature": c_temp, "humidity": humidity},
-                        }
-                    )
-
-            return c_temp, humidity
+    def _read_measurement(self, zone_sensor) -> (float, float):
+        try:
+            with READ_SECONDS.time(zone=zone_sensor.zone):
+                c_temp, humidity = zone_sensor.sensor.read()
         except Exception as e:
-            logging.error(f"[{self._tag}]: {e}")
+            logging.error(f"[{self._tag}]: {zone_sensor.zone}: {e}")
+            READ_FAILURES.inc(
+                zone=zone_sensor.zone,
+                reason="crc" if isinstance(e, SHT3xCRCError) else "io",
+            )
             return None, None
 
+        if self.output == "filtered":
+            # outliers are dropped without waiting for another reading
+            c_temp, humidity = zone_sensor.filter.add(c_temp, humidity)
+            if c_temp is None:
+                logging.warning(f"[{self._tag}]: {zone_sensor.zone}: outlier dropped")
+                READ_FAILURES.inc(zone=zone_sensor.zone, reason="outlier")
+                return None, None
+
+        return c_temp, humidity
+
     def _load_configs(self):
         with open(CONFIG_FILE, "r") as f:
             configs = json.load(f)
@@ -74,33 +163,270 @@ class SensorTask:
             self.sample_rate_seconds = configs[section]["sampling_rate_seconds"]
             self.humidity_alarm_threshold = configs[section]["humidity_alarm_threshold"]
 
+            # optional settings
+            self.acquisition = configs[section].get("acquisition", self.acquisition)
+            self.periodic_mps = configs[section].get("periodic_mps", self.periodic_mps)
+            self.repeatability = configs[section].get(
+                "repeatability", self.repeatability
+            )
+            self.output = configs[section].get("output", self.output)
+            self.filter_configs = configs[section].get("filter", self.filter_configs)
+            self.sensor_configs = configs[section].get("sensors", self.sensor_configs)
+            self.alarm_rule_configs = configs[section].get(
+                "alarm_rules", self.alarm_rule_configs
+            )
+            self.adaptive_configs = configs[section].get(
+                "adaptive", self.adaptive_configs
+            )
+            self.deadband_configs = configs[section].get(
+                "deadband", self.deadband_configs
+            )
+
+            if self.periodic_mps not in PERIODIC_COMMANDS:
+                logging.warning(
+                    f"[{self._tag}]: unsupported periodic_mps {self.periodic_mps}, using 1"
+                )
+                self.periodic_mps = 1
+
             logging.info(
-                f"[{self._tag}]: config loaded\n\tsample_rate_seconds: {self.sample_rate_seconds}\n\thumidity_alarm_threshold: {self.humidity_alarm_threshold}"
+                f"[{self._tag}]: config loaded\n\tsample_rate_seconds: {self.sample_rate_seconds}\n\thumidity_alarm_threshold: {self.humidity_alarm_threshold}\n\tacquisition: {self.acquisition}\n\toutput: {self.output}\n\tadaptive: {self.adaptive_configs is not None}\n\tdeadband: {self.deadband_configs is not None}\n\tsensors: {len(self.sensor_configs)}"
             )
 
-    def _scheduler_task(self):
-        c_temp, humidity = self._read_measurement()
+    def _alarm_rules(self, configs):
+        # the sensor rules, else the task rules, else the humidity threshold
+        rule_configs = configs.get("alarm_rules", self.alarm_rule_configs)
+        if rule_configs is None:
+            rule_configs = [
+                {
+                    "name": "humidity_low",
+                    "title": "Critical humidity reached",
+                    "measure": "humidity",
+                    "below": configs.get(
+                        "humidity_alarm_threshold", self.humidity_alarm_threshold
+                    ),
+                }
+            ]
+
+        return [build_rule(rule) for rule in rule_configs]
+
+    def _sampler(self, configs, sample_rate_seconds, alarm_rules):
+        # sampling speeds up towards the highest humidity lower bound
+        adaptive_configs = configs.get("adaptive", self.adaptive_configs)
+        if adaptive_configs is None:
+            return None
+
+        thresholds = [
+            rule.below
+            for rule in alarm_rules
+            if isinstance(rule, ThresholdRule)
+            and rule.measure == "humidity"
+            and rule.below is not None
+        ]
+        return AdaptiveInterval(
+            sample_rate_seconds,
+            threshold=max(thresholds) if len(thresholds) > 0 else None,
+            **adaptive_configs,
+        )
+
+    def _deadband(self, configs):
+        deadband_configs = configs.get("deadband", self.deadband_configs)
+        if deadband_configs is None:
+            return None
+        return Deadband(**deadband_configs)
+
+    def _open_sensors(self):
+        # sensors without a setting of their own use the task settings
+        self.sensors = []
+        zones = set()
+
+        for configs in self.sensor_configs:
+            zone = configs.get("zone", DEFAULT_ZONE)
+            if zone in zones:
+                raise ValueError(f"zone {zone} has more than one sensor")
+            zones.add(zone)
+
+            bus = configs.get("bus", DEFAULT_BUS)
+            if bus not in self.buses:
+                self.buses[bus] = self.bus_factory(bus)
+
+            address = configs.get("address", DEFAULT_ADDRESS)
+            if isinstance(address, str):
+                address = int(address, 0)
+
+            sample_rate_seconds = configs.get(
+                "sampling_rate_seconds", self.sample_rate_seconds
+            )
+            alarm_rules = self._alarm_rules(configs)
+            self.sensors.append(
+                (
+                    bus,
+                    ZoneSensor(
+                        zone,
+                        SHT3x(self.buses[bus], address),
+                        sample_rate_seconds,
+                        alarm_rules,
+                        configs.get("filter", self.filter_configs),
+                        self._sampler(configs, sample_rate_seconds, alarm_rules),
+                        self._deadband(configs),
+                    ),
+                )
+            )
+
+            logging.info(
+                f"[{self._tag}]: zone {zone} on bus {bus} at address {hex(address)}"
+            )
+
+    def _scheduler_task(self, scheduler, zone_sensor):
+        # reschedule first, a failed read must not stop the sampling
+        zone_sensor.next_event = scheduler.enter(
+            zone_sensor.interval,
+            1,
+            self._scheduler_task,
+            (scheduler, zone_sensor),
+        )
+
+        if self.acquisition == "periodic":
+            # the sensor measures on its own, fetch the latest result
+            self._sample(scheduler, zone_sensor)
+            return
+
+        # start a single shot and fetch it once the conversion is done,
+        # without blocking the scheduler in the meantime
+        try:
+            zone_sensor.sensor.trigger(self.repeatability)
+        except Exception as e:
+            logging.error(f"[{self._tag}]: {zone_sensor.zone}: {e}")
+            return
+
+        scheduler.enter(MEASUREMENT_DELAY, 0, self._sample, (scheduler, zone_sensor))
+
+    def _beat(self, zone_sensor):
+        # the task is alive as long as every zone keeps reading, the next
+        # beat is due by the earliest deadline
+        now = time.monotonic()
+
+        with self._deadlines_lock:
+            self._deadlines[zone_sensor.zone] = (
+                now + 3 * zone_sensor.max_interval + 60
+            )
+            self.heartbeat(min(self._deadlines.values()) - now)
+
+    def _adapt(self, scheduler, zone_sensor, humidity):
+        # the next sampling was scheduled one interval after this one
+        # started, it moves to the interval given by this sample
+        event = zone_sensor.next_event
+        started = event.time - zone_sensor.interval
+        interval = zone_sensor.sampler.update(humidity)
+        SAMPLE_INTERVAL.set(interval, zone=zone_sensor.zone)
+
+        try:
+            scheduler.cancel(event)
+        except ValueError:
+            # already run or cancelled, the scheduler is stopping
+            return
+        zone_sensor.next_event = scheduler.enterabs(
+            started + interval,
+            event.priority,
+            event.action,
+            event.argument,
+        )
+
+    def _sample(self, scheduler, zone_sensor):
+        c_temp, humidity = self._read_measurement(zone_sensor)
 
         if c_temp is None or humidity is None:
             return
 
-        logging.info(f"[{self._tag}]: c_temp: {c_temp}, humidity: {humidity}")
+        # only successful reads count as a heartbeat, a sensor that keeps
+        # failing is reported as stalled by the runtime
+        self._beat(zone_sensor)
+
+        logging.info(
+            f"[{self._tag}]: {zone_sensor.zone}: c_temp: {c_temp}, humidity: {humidity}"
+        )
 
-        payload = {
-            "time": datetime.datetime.now().timestamp(),
-            "measures": {"temperature": c_temp, "humidity": humidity},
-        }
+        if zone_sensor.sampler is not None:
+            self._adapt(scheduler, zone_sensor, humidity)
 
-        message = DBMessage(DBAction.ADD, payload=payload)
-        self.db_queue.put(message)
+        record = TelemetryRecord(self.clock.time(), c_temp, humidity, zone_sensor.zone)
 
-        # reschedule
-        self.scheduler.enter(self.sample_rate_seconds, 1, self._scheduler_task)
+        # every sample goes through the alarm rules, only the ones out of
+        # the deadband are stored
+        if zone_sensor.deadband is None or zone_sensor.deadband.check(record):
+            self.db_queue.put(DBMessage(DBAction.ADD, record))
+        else:
+            SAMPLES_SKIPPED.inc(zone=zone_sensor.zone)
 
-    def run(self):
+        self.alarm_engine.process(record)
+
+    def _run_bus(self, zone_sensors, stop_event, errors):
+        # transactions on one bus are serialized by its own scheduler,
+        # different buses are sampled in parallel
+        scheduler = stoppable_scheduler(stop_event, self.clock)
+
+        try:
+            for zone_sensor in zone_sensors:
+                if self.acquisition == "periodic":
+                    zone_sensor.sensor.start_periodic(
+                        self.periodic_mps, self.repeatability
+                    )
+                scheduler.enter(0, 1, self._scheduler_task, (scheduler, zone_sensor))
+
+            scheduler.run()
+        except Exception as e:
+            errors.append(e)
+        finally:
+            # a failed bus stops the others, the runtime restarts the task
+            stop_event.set()
+
+            for zone_sensor in zone_sensors:
+                if zone_sensor.sensor.periodic:
+                    try:
+                        zone_sensor.sensor.stop_periodic()
+                    except Exception as e:
+                        logging.error(f"[{self._tag}]: {zone_sensor.zone}: {e}")
+
+    def run(self, stop_event=None, heartbeat=None):
         logging.info(f"[{self._tag}]: started")
+        stop_event = stop_event or threading.Event()
+        self.heartbeat = heartbeat or (lambda timeout=None: None)
+
         self._load_configs()
+        self._open_sensors()
+
+        for _, zone_sensor in self.sensors:
+            self.alarm_engine.set_rules(zone_sensor.zone, zone_sensor.alarm_rules)
+
+        buses = {}
+        for bus, zone_sensor in self.sensors:
+            buses.setdefault(bus, []).append(zone_sensor)
+
+        # the bus threads also stop when one of them fails
+        bus_stop = threading.Event()
+        errors = []
+        threads = [
+            threading.Thread(
+                target=self._run_bus,
+                args=(zone_sensors, bus_stop, errors),
+                name=f"sensor_bus_{bus}",
+                daemon=True,
+            )
+            for bus, zone_sensors in buses.items()
+        ]
+
+        for thread in threads:
+            thread.start()
+
+        try:
+            # rules that fire without samples are checked from here
+            while not bus_stop.is_set() and not stop_event.wait(1):
+                self.alarm_engine.check(self.clock.time())
+        finally:
+            bus_stop.set()
+            for thread in threads:
+                thread.join()
+
+        if len(errors) > 0:
+            raise errors[0]
 
-        self.scheduler = sched.scheduler(time.time, time.sleep)
-        self.scheduler.enter(0, 1, self._scheduler_task)
-        self.scheduler.run()
+        logging.info(f"[{self._tag}]: stopped")
@@ -0,0 +1,46 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from db_utils.db_record import TelemetryRecord
+from fleet_utils.fleet_protocol import decode_batch, encode_batch
+from tasks.forwarder_task import ForwarderTask
+
+
+class ForwarderNodeTest(unittest.TestCase):
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._dir = tempfile.TemporaryDirectory()
+        os.chdir(self._dir.name)
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        self._dir.cleanup()
+
+    def _configs(self, section):
+        with open("configs.json", "w") as f:
+            json.dump({"forwarder_task": section}, f)
+
+    def test_dotted_hostname(self):
+        with mock.patch("socket.gethostname", return_value="pi.lan"):
+            task = ForwarderTask()
+        self._configs({"url": "http://collector.lan:8470"})
+        task._load_configs()
+
+        self.assertEqual(task.node, "pi-lan")
+        # the collector accepts the batch of the node
+        records = [TelemetryRecord(1000, 21.5, 40.0, "balcony")]
+        node, seq, zones = decode_batch(encode_batch(task.node, 1, records))
+        self.assertEqual(node, "pi-lan")
+        self.assertEqual(list(zones), ["balcony"])
+
+    def test_invalid_configured_node(self):
+        self._configs({"url": "http://collector.lan:8470", "node": "pi.lan"})
+        with self.assertRaises(ValueError):
+            ForwarderTask()._load_configs()
+
+
+if __name__ == "__main__":
+    unittest.main()
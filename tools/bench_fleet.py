@@ -0,0 +1,127 @@
+import argparse
+import concurrent.futures
+import json
+import os
+import random
+import tempfile
+import time
+
+from db_utils.db_record import TelemetryRecord
+from fleet_utils.fleet_collector import CollectorServer, CollectorStore
+from fleet_utils.fleet_protocol import encode_batch, post_batch
+
+
+def _batches(node, zones, batches, records, interval, end):
+    # what the forwarder of a node would send, zones sampled in turn
+    rng = random.Random(node)
+    ts = end - batches * records * interval
+    for seq in range(1, batches + 1):
+        rows = []
+        for _ in range(records):
+            ts += interval
+            rows.append(
+                TelemetryRecord(
+                    ts,
+                    22 + rng.gauss(0, 1),
+                    50 + rng.gauss(0, 5),
+                    f"zone{len(rows) % zones}",
+                )
+            )
+        yield seq, encode_batch(node, seq, rows)
+
+
+def _node(url, node, batches, resend):
+    # sends the batches of one node in order, returns the latency of each
+    latencies = []
+    stored = 0
+    for seq, data in batches:
+        for _ in range(2 if resend and seq % 2 == 0 else 1):
+            start = time.perf_counter()
+            answer = json.loads(post_batch(url, data))
+            latencies.append((time.perf_counter() - start) * 1000)
+            stored += answer["stored"]
+    return latencies, stored
+
+
+def _percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the fleet collector with simulated nodes"
+    )
+    parser.add_argument("--nodes", type=int, default=300)
+    parser.add_argument("--zones", type=int, default=2, help="zones per node")
+    parser.add_argument("--batches", type=int, default=10, help="batches per node")
+    parser.add_argument("--records", type=int, default=500, help="records per batch")
+    parser.add_argument("--interval", type=float, default=60, help="seconds between samples")
+    parser.add_argument("--concurrency", type=int, default=64, help="nodes sending at once")
+    parser.add_argument(
+        "--resend", action="store_true", help="send every other batch twice, as after a lost answer"
+    )
+    parser.add_argument("--db", help="collector database, a temporary one by default")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="inaffio_fleet_")
+    store = CollectorStore(args.db or os.path.join(workdir, "fleet.sqlite"))
+    server = CollectorServer(store, "127.0.0.1", 0)
+    server.start()
+    url = f"http://127.0.0.1:{server.port}"
+
+    # batches are encoded up front, only the uplink and the ingest are timed
+    end = time.time()
+    nodes = {
+        f"node{i:04d}": list(
+            _batches(f"node{i:04d}", args.zones, args.batches, args.records, args.interval, end)
+        )
+        for i in range(args.nodes)
+    }
+    payload_bytes = sum(len(data) for batches in nodes.values() for _, data in batches)
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(args.concurrency) as executor:
+        futures = [
+            executor.submit(_node, url, node, batches, args.resend)
+            for node, batches in nodes.items()
+        ]
+        results = [future.result() for future in futures]
+    elapsed = time.perf_counter() - start
+
+    server.stop()
+    latencies = [latency for node_latencies, _ in results for latency in node_latencies]
+    records = args.nodes * args.batches * args.records
+
+    result = {
+        "nodes": args.nodes,
+        "batches": len(latencies),
+        "records": records,
+        "seconds": round(elapsed, 3),
+        "records_per_second": round(records / elapsed, 1),
+        "batches_per_second": round(len(latencies) / elapsed, 1),
+        "latency_ms": {
+            "p50": round(_percentile(latencies, 50), 2),
+            "p95": round(_percentile(latencies, 95), 2),
+            "max": round(max(latencies), 2),
+        },
+        "payload_bytes_per_record": round(payload_bytes / records, 2),
+        "stored": sum(stored for _, stored in results),
+        "stored_in_db": store.count(),
+        "db_bytes": sum(
+            os.path.getsize(os.path.join(workdir, name)) for name in os.listdir(workdir)
+        )
+        if args.db is None
+        else os.path.getsize(args.db),
+    }
+    store.close()
+
+    for name in os.listdir(workdir):
+        os.remove(os.path.join(workdir, name))
+    os.rmdir(workdir)
+
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import argparse
+import json
+import time
+
+import telebot
+
+from message_utils.bot_sender import MessageSender
+from sim_utils.fake_telegram import FakeTelegram
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure MessageSender throughput against a local fake Telegram API"
+    )
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--global-rate", type=float, default=30)
+    parser.add_argument("--chat-interval", type=float, default=1.0)
+    parser.add_argument("--latency", type=float, default=0.05, help="API latency in seconds")
+    args = parser.parse_args()
+
+    fake = FakeTelegram(latency=args.latency)
+    fake.start()
+    telebot.apihelper.API_URL = fake.api_url
+
+    bot = telebot.TeleBot("123456:fake", threaded=False, validate_token=False)
+    sender = MessageSender(
+        bot,
+        workers=args.workers,
+        global_rate=args.global_rate,
+        chat_interval=args.chat_interval,
+    )
+
+    start = time.monotonic()
+    sender.start()
+    for i in range(args.messages):
+        sender.send_message(1000 + i % args.chats, f"message {i}")
+
+    while sender.pending() > 0 or sender.counters["sent"] + sender.counters[
+        "dropped"
+    ] + sender.counters["merged"] < args.messages:
+        time.sleep(0.01)
+    elapsed = time.monotonic() - start
+
+    sender.stop()
+    fake.stop()
+
+    calls = len(fake.calls_of("sendMessage"))
+    print(
+        json.dumps(
+            {
+                "messages": args.messages,
+                "chats": args.chats,
+                "workers": args.workers,
+                "api_calls": calls,
+                "merged": sender.counters["merged"],
+                "retried": sender.counters["retried"],
+                "dropped": sender.counters["dropped"],
+                "elapsed_seconds": round(elapsed, 3),
+                "messages_per_second": round(args.messages / elapsed, 1),
+                "api_calls_per_second": round(calls / elapsed, 1),
+            }
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
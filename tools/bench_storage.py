@@ -0,0 +1,279 @@
+import argparse
+import concurrent.futures
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from db_utils.db_record import TelemetryRecord
+from db_utils.db_storage import BACKENDS, DEFAULT_ZONE
+from db_utils.db_zones import ZonedTelemetry
+
+DAY = 86400
+
+
+def _samples(size, interval, end):
+    # a slow daily cycle with some noise, the newest sample at end
+    rng = random.Random(size)
+    start = end - size * interval
+
+    for i in range(size):
+        ts = start + i * interval
+        phase = 2 * math.pi * (ts % DAY) / DAY
+        yield TelemetryRecord(
+            ts,
+            22 + 4 * math.sin(phase) + rng.gauss(0, 0.2),
+            50 + 20 * math.cos(phase) + rng.gauss(0, 1),
+        )
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+
+def _timed(func, repeat, budget_seconds=None):
+    # milliseconds of each call, slow calls stop repeating once the budget
+    # is spent so the large TinyDB cases finish in reasonable time
+    timings = []
+    deadline = None if budget_seconds is None else time.perf_counter() + budget_seconds
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append((time.perf_counter() - start) * 1000)
+        if deadline is not None and time.perf_counter() > deadline:
+            break
+    return result, timings
+
+
+def _summary(timings):
+    timings = sorted(timings)
+    return {
+        "mean_ms": round(sum(timings) / len(timings), 4),
+        "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 4),
+    }
+
+
+def _max_rss_mb():
+    # ru_maxrss is in kilobytes on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def run_case(backend, size, args):
+    # runs in a fresh process, so the peak memory is the one of this case
+    workdir = tempfile.mkdtemp(prefix=f"inaffio_bench_{backend}_")
+    db_file = os.path.join(workdir, BACKENDS[backend][1])
+    telemetry = ZonedTelemetry({"backend": backend, "db_file": db_file})
+
+    interval = args.interval
+    end = time.time() - args.insert_batches * args.batch_size * interval
+    result = {"backend": backend, "size": size}
+
+    # history written in large batches, then the steady state insert cost
+    # measured with batches of the size DBTask commits
+    start = time.perf_counter()
+    for chunk in _chunks(_samples(size, interval, end), args.load_batch_size):
+        telemetry.insert_many(chunk)
+    result["load_seconds"] = round(time.perf_counter() - start, 3)
+
+    # the new samples follow the loaded history
+    batches = list(
+        _chunks(
+            _samples(args.insert_batches * args.batch_size, interval, time.time()),
+            args.batch_size,
+        )
+    )
+
+    inserted = 0
+    start = time.perf_counter()
+    for batch in batches:
+        telemetry.insert_many(batch)
+        inserted += len(batch)
+        if time.perf_counter() - start > args.budget_seconds:
+            break
+    elapsed = time.perf_counter() - start
+    result["insert_records_per_second"] = round(inserted / elapsed, 1)
+    result["insert_batch_ms"] = round(elapsed * 1000 * args.batch_size / inserted, 4)
+
+    newest = telemetry.latest().time
+
+    _, timings = _timed(telemetry.latest, args.repeat, args.budget_seconds)
+    result["latest"] = _summary(timings)
+
+    storage = telemetry.storage()
+    raw, timings = _timed(
+        lambda: storage.range(newest - DAY), args.repeat, args.budget_seconds
+    )
+    result["range_24h"] = dict(_summary(timings), points=len(raw))
+
+    # the query behind /stats, raw samples or rollups when there are too many
+    stats, timings = _timed(
+        lambda: telemetry.query(DEFAULT_ZONE, newest - DAY),
+        args.repeat,
+        args.budget_seconds,
+    )
+    result["stats_query_24h"] = dict(_summary(timings), points=len(stats["time"]))
+
+    stats_year, timings = _timed(
+        lambda: telemetry.query(DEFAULT_ZONE, newest - 365 * DAY),
+        args.repeat,
+        args.budget_seconds,
+    )
+    result["stats_query_1y"] = dict(
+        _summary(timings), points=len(stats_year["time"])
+    )
+
+    if not args.skip_render:
+        from plot_utils.telemetry_plot import TelemetryPlot
+
+        plot = TelemetryPlot("Last 24h telemetry", "%H:%M")
+        # the first render builds the figure, the others reuse it
+        _, timings = _timed(lambda: plot.render_columns(stats), 1)
+        result["render_first_ms"] = round(timings[0], 2)
+        _, timings = _timed(lambda: plot.render_columns(stats), args.render_repeat)
+        result["render_24h"] = _summary(timings)
+
+    result["disk_bytes"] = sum(
+        os.path.getsize(os.path.join(workdir, name)) for name in os.listdir(workdir)
+    )
+    result["peak_rss_mb"] = _max_rss_mb()
+
+    telemetry.close()
+    for name in os.listdir(workdir):
+        os.remove(os.path.join(workdir, name))
+    os.rmdir(workdir)
+
+    return result
+
+
+def _metrics(result, prefix=""):
+    # flattened timing metrics, lower is better
+    for key, value in result.items():
+        if isinstance(value, dict):
+            yield from _metrics(value, f"{prefix}{key}.")
+        elif key.endswith("_ms") or key.endswith("_seconds"):
+            yield f"{prefix}{key}", value
+
+
+def compare(results, baseline, threshold):
+    # timing metrics slower than threshold times the baseline
+    previous = {(r["backend"], r["size"]): r for r in baseline["results"]}
+    regressions = []
+
+    for result in results:
+        old = previous.get((result["backend"], result["size"]))
+        if old is None or "error" in result or "error" in old:
+            continue
+
+        old_metrics = dict(_metrics(old))
+        for name, value in _metrics(result):
+            if old_metrics.get(name) and value > old_metrics[name] * threshold:
+                regressions.append(
+                    {
+                        "backend": result["backend"],
+                        "size": result["size"],
+                        "metric": name,
+                        "baseline": old_metrics[name],
+                        "value": value,
+                        "ratio": round(value / old_metrics[name], 2),
+                    }
+                )
+
+    return regressions
+
+
+def _revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark telemetry ingest, queries and chart rendering"
+    )
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    parser.add_argument("--backends", default=",".join(BACKENDS.keys()))
+    parser.add_argument("--interval", type=float, default=60, help="seconds between samples")
+    parser.add_argument("--batch-size", type=int, default=100, help="records per measured insert")
+    parser.add_argument("--insert-batches", type=int, default=20)
+    parser.add_argument("--load-batch-size", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=50, help="calls per query measure")
+    parser.add_argument("--render-repeat", type=int, default=5)
+    parser.add_argument(
+        "--budget-seconds",
+        type=float,
+        default=10,
+        help="stop repeating a measure after this long",
+    )
+    parser.add_argument("--skip-render", action="store_true")
+    parser.add_argument("--output", help="write the JSON results to this file")
+    parser.add_argument("--baseline", help="JSON results of a previous run to compare with")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=1.25,
+        help="slowdown against the baseline reported as a regression",
+    )
+    args = parser.parse_args()
+
+    results = []
+    for backend in args.backends.split(","):
+        for size in [int(size) for size in args.sizes.split(",")]:
+            # one process per case, memory and caches do not leak between them
+            with concurrent.futures.ProcessPoolExecutor(
+                1, mp_context=multiprocessing.get_context("spawn")
+            ) as executor:
+                try:
+                    result = executor.submit(run_case, backend, size, args).result()
+                except Exception as e:
+                    result = {"backend": backend, "size": size, "error": str(e)}
+
+            print(json.dumps(result), file=sys.stderr)
+            results.append(result)
+
+    report = {
+        "revision": _revision(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "created": time.time(),
+        "results": results,
+    }
+
+    exit_code = 0
+    if args.baseline is not None:
+        with open(args.baseline, "r") as f:
+            report["regressions"] = compare(results, json.load(f), args.threshold)
+        exit_code = 1 if len(report["regressions"]) > 0 else 0
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
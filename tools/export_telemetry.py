@@ -0,0 +1,70 @@
+import argparse
+import datetime
+import sys
+import time
+
+from db_utils.db_export import FORMATS, export_name, iter_export
+from db_utils.db_storage import CONFIG_FILE, DEFAULT_ZONE
+from db_utils.db_zones import load_telemetry
+
+DAY = 86400
+
+
+def _timestamp(value):
+    # seconds since the epoch or an ISO date
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.datetime.fromisoformat(value).timestamp()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Stream the raw telemetry of a zone as CSV or binary columns"
+    )
+    parser.add_argument("--config", default=CONFIG_FILE)
+    parser.add_argument("--zone", default=DEFAULT_ZONE)
+    parser.add_argument("--days", type=float, help="export the last days only")
+    parser.add_argument("--since", type=_timestamp, help="epoch seconds or ISO date")
+    parser.add_argument("--until", type=_timestamp, help="epoch seconds or ISO date")
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument("--no-compress", action="store_true")
+    parser.add_argument(
+        "--output",
+        help="file to write, '-' for stdout, defaults to a name from the zone",
+    )
+    args = parser.parse_args()
+
+    since = args.since
+    if args.days is not None:
+        since = time.time() - args.days * DAY
+
+    compress = not args.no_compress
+    output = args.output or export_name(
+        args.zone, "all" if since is None else int(since), args.format, compress
+    )
+
+    telemetry = load_telemetry(args.config)
+    if not telemetry.has_zone(args.zone):
+        # opening its storage would create an empty zone
+        zones = telemetry.zones()
+        telemetry.close()
+        sys.exit(f"unknown zone {args.zone}, known zones: {', '.join(zones) or 'none'}")
+    rows = telemetry.storage(args.zone).iter_range(since, args.until)
+
+    size = 0
+    f = sys.stdout.buffer if output == "-" else open(output, "wb")
+    try:
+        for chunk in iter_export(rows, args.format, compress):
+            f.write(chunk)
+            size += len(chunk)
+    finally:
+        if f is not sys.stdout.buffer:
+            f.close()
+        telemetry.close()
+
+    print(f"exported {size} bytes to {output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+import argparse
+import logging
+import os
+import signal
+import threading
+
+from fleet_utils.fleet_collector import CollectorServer, CollectorStore
+from metrics_utils.metrics_server import MetricsServer
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Collect the telemetry forwarded by the Inaffio nodes"
+    )
+    parser.add_argument("--db", default="fleet.sqlite", help="SQLite database of the fleet")
+    parser.add_argument("--listen", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8470)
+    parser.add_argument(
+        "--token",
+        default=os.environ.get("INAFFIO_COLLECTOR_TOKEN"),
+        help="token the nodes must send, defaults to $INAFFIO_COLLECTOR_TOKEN",
+    )
+    parser.add_argument("--max-pending", type=int, default=1000, help="batches waiting for the writer")
+    parser.add_argument("--metrics-port", type=int, help="serve Prometheus metrics on this port")
+    args = parser.parse_args()
+
+    store = CollectorStore(args.db)
+    server = CollectorServer(
+        store, args.listen, args.port, args.token, max_pending=args.max_pending
+    )
+    metrics = MetricsServer(port=args.metrics_port) if args.metrics_port else None
+
+    stopped = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopped.set())
+
+    server.start()
+    if metrics is not None:
+        metrics.start()
+
+    try:
+        stopped.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        if metrics is not None:
+            metrics.stop()
+        store.close()
+
+    logging.info(f"[COLLECTOR]: stopped, {store.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+import argparse
+import json
+import os
+import sys
+
+from db_utils.db_migrate import MIGRATE_BATCH_SIZE, migrate_tinydb
+from db_utils.db_storage import BACKENDS, CONFIG_FILE, load_configs, storage_file
+from db_utils.db_zones import ZonedTelemetry
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Stream the telemetry of a TinyDB file into another storage backend"
+    )
+    parser.add_argument("--source", default=BACKENDS["tinydb"][1], help="TinyDB file to read")
+    parser.add_argument(
+        "--config",
+        default=CONFIG_FILE,
+        help="configs whose db_task section describes the destination",
+    )
+    parser.add_argument("--backend", choices=BACKENDS.keys(), help="destination backend")
+    parser.add_argument("--db-file", help="destination file")
+    parser.add_argument("--batch-size", type=int, default=MIGRATE_BATCH_SIZE)
+    parser.add_argument(
+        "--progress",
+        help="file keeping the read position, defaults to the source with .migrate appended",
+    )
+    parser.add_argument(
+        "--restart", action="store_true", help="ignore the saved progress"
+    )
+    args = parser.parse_args()
+
+    configs = dict(load_configs(args.config))
+    if args.backend is not None and args.backend != configs.get("backend", "tinydb"):
+        configs["backend"] = args.backend
+        configs.pop("db_file", None)
+    if args.db_file is not None:
+        configs["db_file"] = args.db_file
+
+    if os.path.abspath(storage_file(configs)) == os.path.abspath(args.source):
+        sys.exit(f"{args.source} is both the source and the destination")
+
+    progress_file = args.progress or args.source + ".migrate"
+    if args.restart and os.path.exists(progress_file):
+        os.remove(progress_file)
+
+    telemetry = ZonedTelemetry(configs)
+    try:
+        counters = migrate_tinydb(args.source, telemetry, progress_file, args.batch_size)
+    finally:
+        telemetry.close()
+
+    print(json.dumps(counters, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import argparse
+import json
+import os
+import queue
+import tempfile
+import threading
+import time
+import urllib.request
+
+import telebot
+
+from alarm_utils.alarm_store import AlarmStore
+from sim_utils.fake_telegram import FakeTelegram, make_message_update
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run BotTask in webhook mode against a local fake Telegram API"
+    )
+    parser.add_argument("--chats", type=int, default=10)
+    parser.add_argument("--updates", type=int, default=20, help="updates per chat")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.02, help="API latency in seconds")
+    args = parser.parse_args()
+
+    fake = FakeTelegram(latency=args.latency)
+    fake.start()
+    telebot.apihelper.API_URL = fake.api_url
+    os.environ.setdefault("TOKEN", "123456:fake")
+
+    # BotTask reads configs.json and the telemetry files from the working directory
+    workdir = tempfile.mkdtemp(prefix="inaffio_webhook_")
+    os.chdir(workdir)
+    users = [f"user{i}" for i in range(args.chats)]
+    with open("configs.json", "w") as f:
+        json.dump(
+            {
+                "db_task": {"backend": "binary"},
+                "bot_task": {
+                    "alarm_notification_period": 3600,
+                    "allowed_users": users,
+                    "mode": "webhook",
+                    "webhook": {
+                        "url": "https://example.invalid/telegram",
+                        "listen": "127.0.0.1",
+                        "port": 0,
+                        "path": "/telegram",
+                        "secret_token": "e2e",
+                        "workers": args.workers,
+                    },
+                    "sender": {"chat_interval": 0, "global_rate": 1000},
+                },
+            },
+            f,
+        )
+
+    from tasks.bot_task import BotTask
+
+    bot_task = BotTask(AlarmStore(), queue.Queue())
+
+    # record the order in which the handlers see the updates of each chat
+    handled = []
+    process_new_updates = bot_task.bot.process_new_updates
+
+    def record(updates):
+        for update in updates:
+            handled.append((update.message.chat.id, update.update_id))
+        process_new_updates(updates)
+
+    bot_task.bot.process_new_updates = record
+
+    stop_event = threading.Event()
+    thread = threading.Thread(target=bot_task.run, args=(stop_event, None))
+    thread.start()
+
+    while bot_task.webhook_server is None:
+        time.sleep(0.01)
+    url = f"http://127.0.0.1:{bot_task.webhook_server.port}/telegram"
+
+    def post(update):
+        request = urllib.request.Request(
+            url,
+            data=json.dumps(update).encode(),
+            headers={
+                "Content-Type": "application/json",
+                "X-Telegram-Bot-Api-Secret-Token": "e2e",
+            },
+        )
+        urllib.request.urlopen(request).read()
+
+    total = args.chats * args.updates
+    start = time.monotonic()
+
+    update_id = 0
+    for _ in range(args.updates):
+        for chat in range(args.chats):
+            update_id += 1
+            post(make_message_update(update_id, 1000 + chat, users[chat], "/start"))
+
+    while len(handled) < total or bot_task.sender.pending() > 0:
+        time.sleep(0.01)
+    elapsed = time.monotonic() - start
+
+    stop_event.set()
+    bot_task.stop()
+    thread.join()
+    fake.stop()
+
+    ordered = all(
+        [u for c, u in handled if c == chat] == sorted(u for c, u in handled if c == chat)
+        for chat in set(c for c, _ in handled)
+    )
+
+    print(
+        json.dumps(
+            {
+                "updates": total,
+                "handled": len(handled),
+                "per_chat_order_kept": ordered,
+                "webhook_set": any(
+                    params.get("url") for params in fake.calls_of("setWebhook")
+                ),
+                "replies": len(fake.calls_of("sendMessage")),
+                "elapsed_seconds": round(elapsed, 3),
+                "updates_per_second": round(total / elapsed, 1),
+            }
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()